@@ -0,0 +1,95 @@
+"""Measure the cost of the append-only log under each fsync policy.
+
+SET requests go through the full server path via a fake connection that
+hands over --batch requests per read, as --batch concurrent (or pipelining)
+clients would. One log flush, and under ``always`` one fsync, covers each
+batch. Reported per policy: microseconds per SET, the overhead versus
+running without a log, fsyncs issued, write amplification (log bytes per
+byte of key and value) and the log size after a rewrite.
+
+Usage: python benchmarks/bench_aof.py [--requests 20000] [--batch 1 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from protocol import ProtocolHandler
+from server import Server
+
+class ReplayConnection:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.sent = 0
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv_into(self, buffer):
+        chunk = next(self._chunks, b'')
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+    def close(self):
+        pass
+
+def workload(requests: int, batch: int, keys: int, value_size: int):
+    protocol = ProtocolHandler()
+    value = 'v' * value_size
+    commands = [['SET', f'key:{i % keys}', value] for i in range(requests)]
+    chunks = [b''.join(protocol.encode(c) for c in commands[i:i + batch])
+              for i in range(0, requests, batch)]
+    payload = sum(len(c[1]) + len(c[2]) for c in commands)
+    return chunks, payload
+
+def bench(policy, chunks, requests: int, tmp: str):
+    path = os.path.join(tmp, f'{policy}.aof')
+    server = Server(port=0, aof_path=path if policy else None, aof_fsync=policy)
+    start = time.perf_counter()
+    server.connection_handler(ReplayConnection(chunks), ('127.0.0.1', 0))
+    if policy == 'everysec':
+        server._aof._sync()  # the once-a-second fsync the timer would run
+    elapsed = time.perf_counter() - start
+    if not policy:
+        return elapsed / requests * 1e6, 0, 0, 0
+    log = server._aof
+    size = log.size
+    log.rewrite(server._kv)
+    log.wait_rewrite()
+    rewritten = log.size
+    log.close()
+    os.unlink(path)
+    return elapsed / requests * 1e6, log.fsyncs, size, rewritten
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--value-size', type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for batch in args.batch:
+            chunks, payload = workload(args.requests, batch, args.keys, args.value_size)
+            print(f'\n{args.requests} SETs, {batch} per read, {args.keys} distinct keys')
+            print('%-9s %9s %10s %8s %10s %14s' % (
+                'policy', 'us/SET', 'overhead', 'fsyncs', 'write amp', 'after rewrite'))
+            baseline = None
+            for policy in (None, 'no', 'everysec', 'always'):
+                us, fsyncs, size, rewritten = bench(policy, chunks, args.requests, tmp)
+                baseline = baseline or us
+                if policy is None:
+                    print('%-9s %9.2f' % ('off', us))
+                    continue
+                print('%-9s %9.2f %9.2fus %8d %9.2fx %12.1f KiB' % (
+                    policy, us, us - baseline, fsyncs, size / payload, rewritten / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Compare HTTP GET latency with the API in embedded and tcp transport mode.
+
+Each mode runs app.py in its own process on free ports. The keys are
+written first, then --clients keep-alive connections send --requests
+GET /get/<key> requests between them. Reported per mode: requests per
+second and p50/p99/p99.9 latency, using the load generator in
+src/benchmark.py. Then, to show the cost of the hop itself without the
+HTTP server, GET is timed through Client and LocalClient against one
+in-process server.
+
+Usage: python benchmarks/bench_embedded.py [--requests 5000] [--clients 1 8]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from benchmark import HttpTarget, Workload, free_port, populate, run_benchmark, wait_for_port
+from client import Client, LocalClient
+from metrics import LatencyHistogram
+from server import Server
+
+APP = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/app.py'))
+
+def start_app(transport: str):
+    port = free_port()
+    env = dict(os.environ, API_TRANSPORT=transport, SERVER_ADDRESS='127.0.0.1',
+               SERVER_PORT=str(port), RESP_PORT=str(free_port()), LOG_LEVEL='WARNING')
+    proc = subprocess.Popen([sys.executable, APP], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        wait_for_port('127.0.0.1', urlsplit(url).port, timeout=30)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc, url
+
+def direct(requests: int, value_size: int):
+    server = Server(port=0)
+    server._server.start()
+    try:
+        clients = {'tcp': Client(port=server._server.server_port), 'embedded': LocalClient(server)}
+        clients['tcp'].set('key', 'v' * value_size)
+        for mode, client in clients.items():
+            histogram = LatencyHistogram()
+            for _ in range(requests):
+                start = time.perf_counter()
+                client.get('key')
+                histogram.record(time.perf_counter() - start)
+            summary = histogram.summary()
+            print('%-9s %10.1f %10.1f %10.1f' % (
+                mode, summary['p50'] * 1e3, summary['p99'] * 1e3, summary['mean'] * 1e3))
+    finally:
+        server._server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--value-size', type=int, default=64)
+    args = parser.parse_args()
+
+    workload = Workload(args.keys, (args.value_size, args.value_size), read_ratio=1.0, seed=1)
+    print('%-9s %8s %10s %10s %10s %10s' % (
+        'mode', 'clients', 'req/s', 'p50 (ms)', 'p99 (ms)', 'p99.9 (ms)'))
+    for transport in ('tcp', 'embedded'):
+        proc, url = start_app(transport)
+        try:
+            target = HttpTarget(url)
+            populate(target, workload)
+            target.close()
+            for clients in args.clients:
+                result = run_benchmark(lambda: HttpTarget(url), workload, clients, args.requests)
+                latency = result['latency_ms']['all']
+                print('%-9s %8d %10.0f %10.3f %10.3f %10.3f' % (
+                    transport, clients, result['ops_per_sec'], latency['p50'], latency['p99'],
+                    latency['p999']))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print('\nGET without HTTP, one in-process server')
+    print('%-9s %10s %10s %10s' % ('mode', 'p50 (us)', 'p99 (us)', 'mean (us)'))
+    direct(args.requests * 4, args.value_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compare GET/MGET cost with decoded values and with pre-encoded RESP values.
+
+Requests go through the full server path (parse, dispatch, encode) via a
+fake connection, so only the storage mode differs between the columns.
+
+Usage: python benchmarks/bench_encoded_values.py [--requests 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from protocol import ProtocolHandler
+from server import Server
+
+class ReplayConnection:
+    def __init__(self, payload: bytes):
+        self._payload = payload
+        self.sent = 0
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv_into(self, buffer):
+        chunk, self._payload = self._payload[:len(buffer)], self._payload[len(buffer):]
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+    def close(self):
+        pass
+
+VALUES = {
+    'short string': 'x' * 16,
+    '4 KiB string': 'x' * 4096,
+    'list value': ['item-%d' % i for i in range(20)] + [1, 2, 3],
+}
+
+def bench(encoded: bool, value, requests: int, batch: int) -> float:
+    server = Server(port=0, encoded_values=encoded)
+    keys = ['key:%d' % i for i in range(batch)]
+    server.get_response(['MSET'] + [arg for key in keys for arg in (key, value)])
+    protocol = ProtocolHandler()
+    command = ['MGET'] + keys if batch > 1 else ['GET', keys[0]]
+    payload = protocol.encode(command) * (requests // batch)
+    start = time.perf_counter()
+    server.connection_handler(ReplayConnection(payload), ('127.0.0.1', 0))
+    return (time.perf_counter() - start) / (requests // batch) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20_000)
+    args = parser.parse_args()
+
+    print('%-14s %-8s %16s %16s' % ('value', 'command', 'decoded (us)', 'encoded (us)'))
+    for name, value in VALUES.items():
+        for command, batch in (('GET', 1), ('MGET 100', 100)):
+            print('%-14s %-8s %16.2f %16.2f' % (
+                name, command, bench(False, value, args.requests, batch),
+                bench(True, value, args.requests, batch)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Compare the table-driven RESP encoder with the original recursive one.
+
+Usage: python benchmarks/bench_encoder.py [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from protocol import Error, ProtocolHandler
+
+def legacy_write(buf, data):
+    """The encoder as it was before the table-driven rewrite."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+        buf.write(b'$%d\r\n' % len(data))
+        buf.write(data)
+        buf.write(b'\r\n')
+    elif isinstance(data, bytes):
+        buf.write(b'$%d\r\n' % len(data))
+        buf.write(data)
+        buf.write(b'\r\n')
+    elif isinstance(data, int):
+        buf.write(b':%d\r\n' % data)
+    elif isinstance(data, float):
+        str_data = str(data).encode('utf-8')
+        buf.write(b'$%d\r\n' % len(str_data))
+        buf.write(str_data)
+        buf.write(b'\r\n')
+    elif isinstance(data, Error):
+        buf.write(b'-%s\r\n' % data.message.encode('utf-8'))
+    elif isinstance(data, (list, tuple)):
+        buf.write(b'*%d\r\n' % len(data))
+        for item in data:
+            legacy_write(buf, item)
+    elif isinstance(data, dict):
+        buf.write(b'%%%d\r\n' % len(data))
+        for key, value in data.items():
+            legacy_write(buf, str(key))
+            legacy_write(buf, value)
+    elif data is None:
+        buf.write(b'$-1\r\n')
+    else:
+        str_data = str(data).encode('utf-8')
+        buf.write(b'$%d\r\n' % len(str_data))
+        buf.write(str_data)
+        buf.write(b'\r\n')
+
+def legacy_encode(data):
+    buf = BytesIO()
+    legacy_write(buf, data)
+    return buf.getvalue()
+
+def bench(func, payload, repeat: int, loops: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(payload)
+        best = min(best, time.perf_counter() - start)
+    return best / loops * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    handler = ProtocolHandler()
+    cases = [
+        ('integer reply 1', 1, 10_000),
+        ('nil reply', None, 10_000),
+        ('MGET 1k strings', ['value:%d' % i for i in range(1000)], 20),
+        ('MGET 1k list values', [['v', i, 'w'] for i in range(1000)], 20),
+        ('nested depth 200', [[[['x', 1]] * 2] * 2] * 200, 20),
+    ]
+    print('%-22s %14s %14s' % ('reply', 'legacy (us)', 'current (us)'))
+    for name, payload, loops in cases:
+        assert legacy_encode(payload) == handler.encode(payload)
+        print('%-22s %14.2f %14.2f' % (
+            name, bench(legacy_encode, payload, args.repeat, loops),
+            bench(handler.encode, payload, args.repeat, loops)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Compare the gevent and asyncio server engines under many concurrent clients.
+
+Each engine runs in its own process. The load generator opens --clients
+connections concurrently and each sends --requests GET/SET round trips.
+Reported numbers are connections accepted per second while the clients
+connect, request throughput and p50/p99 round-trip latency.
+
+Usage: python benchmarks/bench_engines.py [--clients 1000] [--requests 20]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+SERVER = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/server.py'))
+
+def raise_fd_limit(needed: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(engine: str, port: int, max_clients: int) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, SERVER, '--engine', engine, '--port', str(port),
+         '--max-clients', str(max_clients)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{engine} server did not start')
+
+async def client(port: int, index: int, requests: int, latencies: list):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    key = b'key:%d' % index
+    set_request = b'*3\r\n$3\r\nSET\r\n$%d\r\n%s\r\n$5\r\nvalue\r\n' % (len(key), key)
+    get_request = b'*2\r\n$3\r\nGET\r\n$%d\r\n%s\r\n' % (len(key), key)
+    try:
+        for i in range(requests):
+            start = time.perf_counter()
+            if i % 2:
+                writer.write(get_request)
+                await writer.drain()
+                await reader.readexactly(11)
+            else:
+                writer.write(set_request)
+                await writer.drain()
+                await reader.readexactly(4)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+async def connect_all(port: int, clients: int) -> float:
+    start = time.perf_counter()
+    conns = await asyncio.gather(*(asyncio.open_connection('127.0.0.1', port)
+                                   for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    for _, writer in conns:
+        writer.close()
+    return clients / elapsed
+
+async def load(port: int, clients: int, requests: int):
+    conn_rate = await connect_all(port, clients)
+    await asyncio.sleep(0.5)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, i, requests, latencies) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1e3
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+    return conn_rate, len(latencies) / elapsed, p50, p99
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--engines', nargs='+', default=['gevent', 'asyncio'])
+    args = parser.parse_args()
+
+    raise_fd_limit(args.clients * 2 + 256)
+    print('%-8s %12s %12s %10s %10s' % ('engine', 'conn/s', 'req/s', 'p50 (ms)', 'p99 (ms)'))
+    for engine in args.engines:
+        port = free_port()
+        proc = start_server(engine, port, args.clients + 16)
+        try:
+            results = asyncio.run(load(port, args.clients, args.requests))
+        finally:
+            proc.terminate()
+            proc.wait()
+        print('%-8s %12.0f %12.0f %10.2f %10.2f' % ((engine,) + results))
+
+if __name__ == '__main__':
+    main()
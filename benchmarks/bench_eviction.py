@@ -0,0 +1,44 @@
+"""Measure the cost of a write that triggers an eviction as the store grows.
+
+Usage: python benchmarks/bench_eviction.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from storage import EVICTION_POLICIES, KeyValueStore
+
+VALUE = 'x' * 64
+
+def bench(policy: str, size: int, writes: int) -> float:
+    """Return the mean microseconds per evicting write for a store of ``size`` keys."""
+    store = KeyValueStore(max_memory_mb=1024, eviction_policy=policy)
+    for i in range(size):
+        store.set('key:%010d' % i, VALUE)
+    store._max_memory = store.memory_stats()['used_memory']
+
+    start = time.perf_counter()
+    for i in range(size, size + writes):
+        store.set('key:%010d' % i, VALUE)
+    elapsed = time.perf_counter() - start
+    assert store.memory_stats()['evicted_keys'] == writes
+    return elapsed / writes * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--writes', type=int, default=20_000)
+    parser.add_argument('--policies', nargs='+',
+                        default=[p for p in EVICTION_POLICIES if p != 'noeviction'])
+    args = parser.parse_args()
+
+    print('%-22s' % 'policy' + ''.join('%14s' % f'{n} keys' for n in args.sizes))
+    for policy in args.policies:
+        row = [bench(policy, size, args.writes) for size in args.sizes]
+        print('%-22s' % policy + ''.join('%11.2f us' % us for us in row))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Compare ways of incrementing shared counters under many concurrent clients.
+
+The server runs in its own process. --clients greenlets, each with its own
+connection, add 1 to one of --counters keys --increments times each:
+
+- ``get+set``: GET, add in the client, SET. Two round trips, and
+  concurrent updates are lost.
+- ``watch``: WATCH, GET, then MULTI/SET/EXEC, retried while EXEC returns
+  nil. Correct, but contention turns into retries.
+- ``incr``: one INCR. Atomic on the server and a single round trip.
+
+Reported per method: increments per second, p50/p99 latency of a whole
+increment (retries included) and how many increments are missing from
+the counters at the end.
+
+Usage: python benchmarks/bench_incr.py [--clients 100] [--increments 200] [--counters 1]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import gevent
+
+from benchmark import free_port, start_process, wait_for_port
+from client import Client
+from metrics import LatencyHistogram
+
+def get_set(client, key):
+    client.set(key, int(client.get(key) or 0) + 1)
+    return 0
+
+def watch(client, key):
+    retries = 0
+    while True:
+        client.watch(key)
+        value = int(client.get(key) or 0)
+        pipe = client.pipeline()
+        pipe.multi().set(key, value + 1).exec()
+        if pipe.execute()[-1] is not None:
+            return retries
+        retries += 1
+
+def incr(client, key):
+    client.incr(key)
+    return 0
+
+METHODS = {'get+set': get_set, 'watch': watch, 'incr': incr}
+
+def worker(port, method, index, args, histogram, retries):
+    client = Client(port=port)
+    try:
+        for i in range(args.increments):
+            key = f'counter:{(index + i) % args.counters}'
+            start = time.perf_counter()
+            retries[0] += method(client, key)
+            histogram.record(time.perf_counter() - start)
+    finally:
+        client.close()
+
+def run(port, name, args):
+    setup = Client(port=port)
+    setup.flush()
+    histogram = LatencyHistogram()
+    retries = [0]
+    start = time.perf_counter()
+    gevent.joinall([gevent.spawn(worker, port, METHODS[name], i, args, histogram, retries)
+                    for i in range(args.clients)], raise_error=True)
+    elapsed = time.perf_counter() - start
+    total = sum(int(value or 0) for value in
+                setup.mget(*(f'counter:{i}' for i in range(args.counters))))
+    setup.close()
+    expected = args.clients * args.increments
+    summary = histogram.summary()
+    print('%-8s %12.0f %10.3f %10.3f %10d %10d' % (
+        name, expected / elapsed, summary['p50'], summary['p99'],
+        expected - total, retries[0]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--increments', type=int, default=200)
+    parser.add_argument('--counters', type=int, default=1)
+    parser.add_argument('--engine', default='gevent')
+    args = parser.parse_args()
+
+    port = free_port()
+    proc = start_process('server.py', '--port', str(port), '--engine', args.engine,
+                         '--max-clients', str(args.clients + 16))
+    try:
+        wait_for_port('127.0.0.1', port)
+        print('%-8s %12s %10s %10s %10s %10s' % (
+            'method', 'incr/s', 'p50 (ms)', 'p99 (ms)', 'lost', 'retries'))
+        for name in METHODS:
+            run(port, name, args)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+if __name__ == '__main__':
+    main()
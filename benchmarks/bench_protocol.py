@@ -0,0 +1,89 @@
+"""Compare the file-based ProtocolHandler parser with the incremental RespParser.
+
+Each payload is parsed from memory and from a socket. The socket case is
+what the server sees: the handler reads through ``makefile()`` while the
+parser reads with ``recv_into`` into its own buffer.
+
+Usage: python benchmarks/bench_protocol.py [--repeat 20]
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from protocol import ProtocolHandler, RespParser, INCOMPLETE
+
+def large_mset(pairs: int = 10_000) -> bytes:
+    args = ['MSET']
+    for i in range(pairs):
+        args += ['key:%d' % i, 'value:%d' % i]
+    return ProtocolHandler().encode(args)
+
+def nested_array(depth: int) -> bytes:
+    return b'*2\r\n:1\r\n' * depth + b':1\r\n'
+
+def handler_from_memory(payload: bytes) -> None:
+    ProtocolHandler().handle_request(BytesIO(payload))
+
+def parser_from_memory(payload: bytes) -> None:
+    parser = RespParser()
+    parser.feed(payload)
+    assert parser.gets() is not INCOMPLETE
+
+def _socket_pair(payload: bytes):
+    reader, writer = socket.socketpair()
+    thread = threading.Thread(target=lambda: (writer.sendall(payload), writer.close()))
+    thread.start()
+    return reader, thread
+
+def handler_from_socket(payload: bytes) -> None:
+    sock, thread = _socket_pair(payload)
+    with sock, sock.makefile('rb') as socket_file:
+        ProtocolHandler().handle_request(socket_file)
+    thread.join()
+
+def parser_from_socket(payload: bytes) -> None:
+    sock, thread = _socket_pair(payload)
+    parser = RespParser()
+    with sock:
+        while parser.gets() is INCOMPLETE:
+            parser.recv_from(sock)
+    thread.join()
+
+def bench(func, payload: bytes, repeat: int) -> str:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            func(payload)
+        except RecursionError:
+            return 'RecursionError'
+        best = min(best, time.perf_counter() - start)
+    return '%.2f' % (best * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    cases = [
+        ('MSET 10k pairs', large_mset()),
+        ('nested depth 300', nested_array(300)),
+        ('nested depth 5000', nested_array(5000)),
+    ]
+    print('%-20s %-8s %16s %16s' % ('payload', 'source', 'handler (ms)', 'parser (ms)'))
+    for name, payload in cases:
+        print('%-20s %-8s %16s %16s' % (
+            name, 'memory', bench(handler_from_memory, payload, args.repeat),
+            bench(parser_from_memory, payload, args.repeat)))
+        print('%-20s %-8s %16s %16s' % (
+            name, 'socket', bench(handler_from_socket, payload, args.repeat),
+            bench(parser_from_socket, payload, args.repeat)))
+
+if __name__ == '__main__':
+    main()
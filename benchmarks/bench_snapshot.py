@@ -0,0 +1,62 @@
+"""Time snapshot save, background save and load for a filled store.
+
+Reports the file size, the foreground SAVE time, how long BGSAVE blocks the
+caller (just the fork) versus how long the child takes, and the time to
+load the snapshot into an empty store.
+
+Usage: python benchmarks/bench_snapshot.py [--keys 1000000] [--value-size 100]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from protocol import ProtocolHandler
+from snapshot import Snapshotter
+from storage import KeyValueStore
+
+def build(keys: int, value_size: int, encoded: bool) -> KeyValueStore:
+    encoder = ProtocolHandler().encode_value if encoded else None
+    store = KeyValueStore(max_memory_mb=4096, value_encoder=encoder)
+    value = 'x' * value_size
+    store.restore((f'key:{i}', value, None) for i in range(keys))
+    return store
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keys', type=int, default=1_000_000)
+    parser.add_argument('--value-size', type=int, default=100)
+    parser.add_argument('--encoded', action='store_true',
+                        help='store values pre-encoded, as with STORE_ENCODED_VALUES')
+    args = parser.parse_args()
+
+    store = build(args.keys, args.value_size, args.encoded)
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshots = Snapshotter(store, os.path.join(tmp, 'dump.kvs'))
+
+        start = time.perf_counter()
+        snapshots.save()
+        save = time.perf_counter() - start
+        size = os.path.getsize(snapshots.path)
+
+        start = time.perf_counter()
+        snapshots.bgsave()
+        fork = time.perf_counter() - start
+        snapshots.wait()
+        bgsave = time.perf_counter() - start
+
+        target = Snapshotter(build(0, 0, args.encoded), snapshots.path)
+        start = time.perf_counter()
+        loaded = target.load(args.encoded)
+        load = time.perf_counter() - start
+
+    print(f'{args.keys} keys, {args.value_size}-byte values, snapshot {size / 2**20:.1f} MiB')
+    print(f'SAVE             {save:8.3f}s')
+    print(f'BGSAVE blocking  {fork * 1e3:8.2f}ms (child finished after {bgsave:.3f}s)')
+    print(f'load             {load:8.3f}s ({loaded / load:,.0f} keys/s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Measure how long the server and the HTTP API take to start and to stop.
+
+Each run launches a fresh process and times it until it answers: PING
+for src/server.py (per engine), GET /readyz for src/app.py. It then
+sends SIGTERM with one client connected and times the exit. Reported per
+target: the median and the fastest start and stop over --runs runs.
+
+Usage: python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import http.client
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from benchmark import free_port
+from client import Client
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+def ping(port):
+    client = Client(port=port)
+    client.ping()
+    return client
+
+def readyz(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', '/readyz')
+    if conn.getresponse().status != 200:
+        raise OSError('not ready')
+    return conn
+
+def measure(argv, port, probe, env=None):
+    """Seconds until ``probe`` succeeds, and from SIGTERM to exit."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            conn = probe(port)
+            break
+        except OSError:
+            if proc.poll() is not None or time.perf_counter() - start > 30:
+                proc.kill()
+                raise RuntimeError(f'{argv[1]} did not start')
+            time.sleep(0.002)
+    started = time.perf_counter() - start
+    start = time.perf_counter()
+    proc.send_signal(signal.SIGTERM)
+    proc.wait()
+    stopped = time.perf_counter() - start
+    conn.close()
+    return started, stopped
+
+def start_server(engine):
+    def run(port):
+        return measure([sys.executable, os.path.join(SRC, 'server.py'), '--port', str(port),
+                        '--engine', engine], port, ping)
+    return run
+
+def start_app(port):
+    env = dict(os.environ, SERVER_ADDRESS='127.0.0.1', SERVER_PORT=str(port),
+               RESP_PORT=str(free_port()), LOG_LEVEL='WARNING')
+    return measure([sys.executable, os.path.join(SRC, 'app.py')], port, readyz, env)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%-16s %12s %12s %12s %12s' % (
+        'target', 'start (ms)', 'min (ms)', 'stop (ms)', 'min (ms)'))
+    targets = [('server (gevent)', start_server('gevent')),
+               ('server (asyncio)', start_server('asyncio')), ('app', start_app)]
+    for name, run in targets:
+        results = [run(free_port()) for _ in range(args.runs)]
+        starts = [started * 1e3 for started, _ in results]
+        stops = [stopped * 1e3 for _, stopped in results]
+        print('%-16s %12.1f %12.1f %12.1f %12.1f' % (
+            name, statistics.median(starts), min(starts), statistics.median(stops), min(stops)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Measure server throughput as the number of worker processes grows.
+
+For each worker count a server is started with ``--workers N`` and loaded
+by --procs client processes. Each process keeps one connection and sends
+pipelined batches of GET/SET for --seconds. In ``forward`` mode clients
+use the shared port and keys owned by another worker are proxied; in
+``redirect`` mode clients route each key to its owner's own port.
+
+Usage: python benchmarks/bench_workers.py [--workers 1 2 4] [--mode forward]
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from cluster import key_slot, worker_port
+from protocol import ProtocolHandler
+
+SERVER = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/server.py'))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(port: int):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'server on port {port} did not start')
+
+def batches(keys, batch):
+    protocol = ProtocolHandler()
+    payload = bytearray()
+    for i, key in enumerate(keys[:batch]):
+        protocol.encode_into(payload, ['SET', key, 'value'] if i % 4 == 0 else ['GET', key])
+    return bytes(payload)
+
+def drain(sock, replies: int):
+    """Read until ``replies`` CRLF-terminated replies (simple or bulk) arrived."""
+    buf = b''
+    seen = 0
+    while seen < replies:
+        buf += sock.recv(65536)
+        seen = buf.count(b'\r\n') - buf.count(b'$5\r\n')
+
+def load(proc: int, port: int, workers: int, mode: str, seconds: float, batch: int, result):
+    keys = [f'key:{proc}:{i}' for i in range(batch * workers * 4)]
+    if mode == 'redirect':
+        # One connection per worker, each sent only the keys that worker owns.
+        targets = []
+        for index in range(workers):
+            owned = [key for key in keys if key_slot(key, workers) == index]
+            sock = socket.create_connection(('127.0.0.1', worker_port(port, index)))
+            targets.append((sock, batches(owned, batch), min(batch, len(owned))))
+    else:
+        sock = socket.create_connection(('127.0.0.1', port))
+        targets = [(sock, batches(keys, batch), batch)]
+    ops = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for sock, payload, count in targets:
+            sock.sendall(payload)
+        for sock, payload, count in targets:
+            drain(sock, count)
+            ops += count
+    result.put(ops)
+
+def bench(workers: int, mode: str, procs: int, seconds: float, batch: int) -> float:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, SERVER, '--port', str(port), '--workers', str(workers),
+         '--cluster-mode', mode, '--max-clients', '1024'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        if workers > 1:
+            wait_for(worker_port(port, workers - 1))
+        result = multiprocessing.Queue()
+        clients = [multiprocessing.Process(
+            target=load, args=(i, port, workers, mode if workers > 1 else 'forward',
+                               seconds, batch, result))
+            for i in range(procs)]
+        for client in clients:
+            client.start()
+        total = sum(result.get() for _ in clients)
+        for client in clients:
+            client.join()
+        return total / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--mode', choices=('forward', 'redirect'), default='forward')
+    parser.add_argument('--procs', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} CPUs, {args.procs} client processes, {args.mode} mode')
+    print('%-8s %14s %10s' % ('workers', 'ops/s', 'speedup'))
+    baseline = None
+    for workers in args.workers:
+        ops = bench(workers, args.mode, args.procs, args.seconds, args.batch)
+        baseline = baseline or ops
+        print('%-8d %14.0f %9.2fx' % (workers, ops, ops / baseline))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import threading
+
+from protocol import RespParser, Error, ProtocolError, INCOMPLETE
+from server import (Server, Takeover, Transaction, ACTIVE_EXPIRE_INTERVAL, ACTIVE_EXPIRE_SLICE,
+                    PERSISTENCE_INTERVAL, DEFAULT_SHUTDOWN_TIMEOUT)
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+# Idle connections are closed after this many seconds, like the gevent
+# engine's socket timeout.
+IDLE_TIMEOUT = 60
+
+class RespProtocol(asyncio.Protocol):
+    """One client connection served by the asyncio engine."""
+
+    def __init__(self, server: 'AsyncioServer'):
+        self._server = server
+        self._transport = None
+        self._parser = None
+        self._address = None
+        self._idle_handle = None
+        self._active = False
+        self._transaction = Transaction()
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._address = transport.get_extra_info('peername')
+        server = self._server
+        stats = server._stats
+        stats.connections_received += 1
+        if stats.connected_clients >= server._max_clients:
+            server._client_error_log.log('Rejecting %s: max number of clients reached',
+                                        self._address)
+            stats.rejected_connections += 1
+            transport.write(b'-ERR max number of clients reached\r\n')
+            transport.close()
+            return
+        stats.connected_clients += 1
+        server._connections.add(self)
+        self._active = True
+        self._parser = RespParser(encoding=None if server._encoded_values else 'utf-8')
+        # Stop reading while the client is not draining replies.
+        transport.set_write_buffer_limits(high=server._max_output_buffer)
+        self._touched = True
+        self._idle_handle = asyncio.get_running_loop().call_later(IDLE_TIMEOUT, self._check_idle)
+        server._client_log.log('Connection received: %s', self._address)
+
+    def connection_lost(self, exc):
+        if self._active:
+            self._active = False
+            self._server._stats.connected_clients -= 1
+            self._server._connections.discard(self)
+            self._server.end_transaction(self._transaction)
+            self._idle_handle.cancel()
+            self._server._client_log.log('Client disconnected: %s', self._address)
+
+    def pause_writing(self):
+        self._transport.pause_reading()
+
+    def resume_writing(self):
+        self._transport.resume_reading()
+
+    def data_received(self, data):
+        if not self._active:
+            return
+        self._touched = True
+        parser = self._parser
+        server = self._server
+        server._stats.bytes_in += len(data)
+        parser.feed(data)
+        # A fresh buffer per batch: the transport may keep a reference to it.
+        out = bytearray()
+        while True:
+            try:
+                request = parser.gets()
+            except ProtocolError as e:
+                server._client_error_log.log('Protocol error from %s: %s', self._address, e)
+                parser.reset()
+                resp = Error(str(e))
+            else:
+                if request is INCOMPLETE:
+                    break
+                server._client_address = self._address
+                resp = server.process_request(request, self._transaction)
+                if type(resp) is Takeover:
+                    resp = Error('Replication requires the gevent engine')
+            server._protocol.encode_into(out, resp)
+        if out:
+            server._flush_log()
+            self._transport.write(out)
+            server._stats.bytes_out += len(out)
+
+    def _check_idle(self):
+        if self._touched:
+            self._touched = False
+            self._idle_handle = asyncio.get_running_loop().call_later(
+                IDLE_TIMEOUT, self._check_idle)
+        else:
+            self._server._client_log.log('Closing idle connection: %s', self._address)
+            self._transport.close()
+
+class AsyncioServer(Server):
+    """Server engine built on asyncio protocols and transports.
+
+    It shares the command table and store of ``Server`` and only replaces
+    the gevent listener. uvloop is used when it is installed. Replication
+    runs on gevent, so this engine cannot be a replica.
+    """
+
+    engine = 'asyncio'
+
+    def __init__(self, host='127.0.0.1', port=31337, max_clients=10000, **kwargs):
+        if kwargs.get('replicaof') or os.environ.get('REPLICAOF'):
+            raise ValueError('Replication requires the gevent engine')
+        super().__init__(host, port, max_clients, **kwargs)
+
+    def _create_listener(self, host, port, max_clients):
+        self._host = host
+        self._port = port
+        self._max_clients = max_clients
+        self._aio_server = None
+        self._stopped = None
+        self._shutdown_task = None
+        # Waited on from other threads, unlike the gevent engine's event.
+        self._ready = threading.Event()
+
+    @property
+    def address(self):
+        if self._aio_server is None:
+            return (self._host, self._port)
+        return self._aio_server.sockets[0].getsockname()[:2]
+
+    async def start(self):
+        """Bind the listening socket and start accepting connections."""
+        loop = asyncio.get_running_loop()
+        self._aio_server = await loop.create_server(
+            lambda: RespProtocol(self), self._host, self._port,
+            reuse_address=True, backlog=1024)
+        self._tasks = [loop.create_task(self._active_expire())]
+        if self._snapshots is not None or self._aof is not None:
+            self._tasks.append(loop.create_task(self._persistence_loop()))
+        self._stopped = asyncio.Event()
+        logger.info('Starting asyncio server on %s:%s', *self.address)
+        self._ready.set()
+
+    async def close(self):
+        self._ready.clear()
+        for task in self._tasks:
+            task.cancel()
+        self._aio_server.close()
+        await self._aio_server.wait_closed()
+        self._stopped.set()
+
+    async def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        """Stop accepting connections and drain the open ones, then ``close``.
+
+        Requests are answered as they arrive, so draining a connection means
+        closing it once its pending replies are written. Connections left
+        after ``timeout`` are aborted.
+        """
+        self._ready.clear()
+        self._aio_server.close()
+        logger.info('Shutting down, draining %d connections', len(self._connections))
+        for protocol in list(self._connections):
+            protocol._transport.close()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._connections and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        for protocol in list(self._connections):
+            protocol._transport.abort()
+        await self.close()
+
+    async def serve_forever(self, stop_signals=()):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for signum in stop_signals:
+            loop.add_signal_handler(signum, self._shutdown_on_signal)
+        try:
+            await self._stopped.wait()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            if self._aof is not None:
+                self._aof.close()
+
+    def _shutdown_on_signal(self):
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.get_running_loop().create_task(self.shutdown())
+
+    def run(self, stop_signals=()):
+        loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.serve_forever(stop_signals))
+        finally:
+            loop.close()
+
+    def _call_later(self, seconds, callback):
+        asyncio.get_running_loop().call_later(seconds, callback)
+
+    async def _active_expire(self):
+        while True:
+            if self._kv.expire_cycle(ACTIVE_EXPIRE_SLICE):
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(ACTIVE_EXPIRE_INTERVAL)
+
+    async def _persistence_loop(self):
+        while True:
+            await asyncio.sleep(PERSISTENCE_INTERVAL)
+            self._persistence_tick()
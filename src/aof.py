@@ -0,0 +1,241 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from protocol import ProtocolHandler, RespParser, INCOMPLETE
+from storage import Collection, CommandError
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('always', 'everysec', 'no')
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# A rewrite starts on its own once the log is at least this large and has
+# doubled since the last rewrite (or since it was opened).
+AUTO_REWRITE_MIN_SIZE = 64 * 1024 * 1024
+AUTO_REWRITE_PERCENTAGE = 100
+
+# Keys without a TTL are rewritten as MSET commands of this many keys.
+REWRITE_BATCH = 128
+
+def read_log(path: str, encoding: Optional[str] = 'utf-8') -> Iterator[List]:
+    """Yield the commands stored in a log file, reading it in chunks.
+
+    A command cut short at the end of the file (a crash mid-write) is
+    dropped with a warning.
+    """
+    parser = RespParser(encoding=encoding)
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            while True:
+                command = parser.gets()
+                if command is INCOMPLETE:
+                    break
+                yield command
+    if parser.buffered():
+        logger.warning('Ignoring %d bytes of truncated command at the end of %s',
+                       parser.buffered(), path)
+
+def rewrite_commands(store) -> Iterator[List]:
+    """Yield the shortest command list that rebuilds ``store``."""
+    batch = []
+    for key, value, deadline in store.items():
+        if isinstance(value, Collection):
+            # One HSET/RPUSH/SADD per REWRITE_BATCH elements (or pairs)
+            items = value.flat()
+            for start in range(0, len(items), 2 * REWRITE_BATCH):
+                yield [value.write_command, key] + items[start:start + 2 * REWRITE_BATCH]
+            if deadline is not None:
+                yield ['PEXPIREAT', key, int(deadline * 1000)]
+            continue
+        if deadline is not None:
+            yield ['SET', key, value]
+            yield ['PEXPIREAT', key, int(deadline * 1000)]
+            continue
+        batch.extend((key, value))
+        if len(batch) >= 2 * REWRITE_BATCH:
+            yield ['MSET'] + batch
+            batch = []
+    if batch:
+        yield ['MSET'] + batch
+
+class AppendOnlyLog:
+    """Append-only log of mutating commands in RESP format.
+
+    ``append`` only buffers. The server calls ``flush`` before it sends the
+    replies to a batch of requests, which writes everything buffered so far
+    by any connection in one ``write``. What happens next depends on the
+    fsync policy:
+
+    - ``always``: ``flush`` also fsyncs before returning, so no reply is
+      sent for a write that is not on disk. Concurrent connections share
+      each fsync (group commit): one that finds its data already synced
+      by another skips its own.
+    - ``everysec``: ``tick`` fsyncs at most once a second on a background
+      thread, covering every connection's writes since the last one.
+    - ``no``: the OS decides when to write back.
+
+    ``rewrite`` forks a child that writes a compact log from the store's
+    copy-on-write image. Commands appended meanwhile go to both the live log
+    and a side buffer that is added to the new log before it replaces the
+    old one.
+    """
+
+    def __init__(self, path: str, fsync: str = 'everysec',
+                 auto_rewrite_min_size: int = AUTO_REWRITE_MIN_SIZE,
+                 auto_rewrite_percentage: int = AUTO_REWRITE_PERCENTAGE):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy: {fsync}')
+        self.path = path
+        self.fsync = fsync
+        self._auto_rewrite_min_size = auto_rewrite_min_size
+        self._auto_rewrite_percentage = auto_rewrite_percentage
+        self._protocol = ProtocolHandler()
+        self._buffer = bytearray()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._written = self._synced = self._base_size = os.fstat(self._fd).st_size
+        self._fsync_lock = threading.Lock()
+        self._fsync_thread = None
+        self._last_fsync = time.monotonic()
+        self._rewrite = None  # (pid, temp path, side buffer)
+        self.fsyncs = 0
+
+    @property
+    def size(self) -> int:
+        return self._written
+
+    @property
+    def rewrite_in_progress(self) -> bool:
+        return self._rewrite is not None
+
+    def append(self, command: List) -> None:
+        start = len(self._buffer)
+        self._protocol.encode_into(self._buffer, command)
+        if self._rewrite is not None:
+            self._rewrite[2] += self._buffer[start:]
+
+    def flush(self) -> None:
+        """Write buffered commands, and fsync them under the ``always`` policy."""
+        if self._buffer:
+            self._write_all(self._fd, self._buffer)
+            self._written += len(self._buffer)
+            del self._buffer[:]
+        if self.fsync == 'always' and self._synced < self._written:
+            self._sync()
+
+    def tick(self, store=None) -> None:
+        """Periodic work: everysec fsync, reaping and auto-starting rewrites."""
+        self.flush()
+        if (self.fsync == 'everysec' and self._synced < self._written
+                and time.monotonic() - self._last_fsync >= 1.0
+                and not self._fsync_lock.locked()):
+            if self._fsync_thread is None:
+                self._fsync_thread = ThreadPoolExecutor(1, thread_name_prefix='aof-fsync')
+            self._fsync_thread.submit(self._sync)
+        self.poll_rewrite()
+        if store is not None and self._rewrite is None and self._should_rewrite():
+            logger.info('Log is %d bytes, starting automatic rewrite', self._written)
+            self.rewrite(store)
+
+    def close(self) -> None:
+        self.flush()
+        if self._fsync_thread is not None:
+            self._fsync_thread.shutdown(wait=True)
+        if self.fsync != 'no':
+            self._sync()
+        os.close(self._fd)
+
+    def rewrite(self, store) -> int:
+        if self._rewrite is not None:
+            raise CommandError('Log rewrite already in progress')
+        self.flush()
+        tmp_path = f'{self.path}.rewrite-{os.getpid()}'
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._write_rewrite(store, tmp_path)
+                code = 0
+            except BaseException:
+                logger.exception('Log rewrite failed')
+            finally:
+                os._exit(code)
+        self._rewrite = [pid, tmp_path, bytearray()]
+        logger.info('Log rewrite started by pid %d', pid)
+        return pid
+
+    def poll_rewrite(self) -> bool:
+        """Finish a completed rewrite; returns True while one is running."""
+        if self._rewrite is None:
+            return False
+        pid, tmp_path, pending = self._rewrite
+        try:
+            done, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            done, status = pid, 1
+        if not done:
+            return True
+        self._rewrite = None
+        if os.waitstatus_to_exitcode(status) != 0:
+            logger.error('Log rewrite failed with status %d', status)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return False
+
+        self.flush()
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_APPEND)
+        self._write_all(fd, pending)
+        os.fsync(fd)
+        os.replace(tmp_path, self.path)
+        with self._fsync_lock:
+            os.close(self._fd)
+            self._fd = fd
+            self._written = self._synced = self._base_size = os.fstat(fd).st_size
+        logger.info('Log rewritten to %d bytes', self._written)
+        return False
+
+    def wait_rewrite(self) -> None:
+        while self.poll_rewrite():
+            time.sleep(0.01)
+
+    def _should_rewrite(self) -> bool:
+        if self._written < self._auto_rewrite_min_size:
+            return False
+        growth = (self._written - self._base_size) * 100 / max(self._base_size, 1)
+        return growth >= self._auto_rewrite_percentage
+
+    def _write_rewrite(self, store, tmp_path: str) -> None:
+        out = bytearray()
+        with open(tmp_path, 'wb') as fh:
+            for command in rewrite_commands(store):
+                self._protocol.encode_into(out, command)
+                if len(out) >= READ_CHUNK_SIZE:
+                    fh.write(out)
+                    del out[:]
+            fh.write(out)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def _sync(self) -> None:
+        with self._fsync_lock:
+            target = self._written
+            if self._synced >= target:
+                return
+            os.fsync(self._fd)
+            self._synced = max(self._synced, target)
+            self._last_fsync = time.monotonic()
+            self.fsyncs += 1
+
+    @staticmethod
+    def _write_all(fd: int, data) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
@@ -1,99 +1,276 @@
-from flask import Flask, request, jsonify
-from client import Client, CommandError
+# Patch stdlib with gevent alternatives before anything imports socket
 from gevent import monkey
-import logging
+monkey.patch_all()
+
+import gevent
+from flask import Flask, Response, request, jsonify, stream_with_context
+from werkzeug.serving import make_server
+from client import ConnectionPool, LocalPool, CommandError
+from logconfig import configure_logging
+from metrics import prometheus_text
+import json
+import os
 from server import Server
+import signal
 from threading import Thread
 import time
 
-# Patch stdlib with gevent alternatives
-monkey.patch_all()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Queue-based logging; the level comes from LOG_LEVEL (INFO by default)
+configure_logging()
 
 # Initialize Flask app
 app = Flask(__name__)
 
-# Function to start the server
-def start_server():
-    server = Server()
-    server.run()
+# Port of the RESP server the API starts; it serves external clients in
+# either transport mode
+RESP_PORT = int(os.environ.get('RESP_PORT', 31337))
+
+# ``embedded`` runs commands directly on the in-process server; ``tcp``
+# goes through a pool of RESP connections to it like any other client.
+API_TRANSPORT = os.environ.get('API_TRANSPORT', 'embedded')
 
-# Start the server in a separate thread
-server_thread = Thread(target=start_server)
+# Bulk endpoints send keys to the server in MGET/MSET frames of this many
+# keys, with up to PIPELINE_DEPTH frames in flight, so memory stays flat
+# however large the request is.
+BATCH_SIZE = 1000
+PIPELINE_DEPTH = 8
+MAX_PIPELINE_COMMANDS = 10000
+
+# Commands that take over the connection cannot run from /pipeline.
+PIPELINE_REFUSED = frozenset(('PSYNC',))
+
+# Seconds the RESP server may take to start accepting connections
+STARTUP_TIMEOUT = float(os.environ.get('STARTUP_TIMEOUT', 10))
+
+# Start the server in a separate thread and wait until it accepts
+# connections. If it cannot bind, the thread ends and so does the start.
+server = Server(port=RESP_PORT)
+server_thread = Thread(target=server.run)
 server_thread.start()
+deadline = time.monotonic() + STARTUP_TIMEOUT
+while not server.wait_ready(0.05):
+    if not server_thread.is_alive() or time.monotonic() > deadline:
+        raise RuntimeError(f'RESP server did not start on port {RESP_PORT}')
 
-# Wait for the server to start
-time.sleep(2)
+# Shared, bounded set of connections to the server for all routes
+if API_TRANSPORT == 'embedded':
+    pool = LocalPool(server)
+elif API_TRANSPORT == 'tcp':
+    pool = ConnectionPool(port=RESP_PORT,
+                          max_connections=int(os.environ.get('CLIENT_POOL_SIZE', 32)))
+else:
+    raise ValueError(f'Unknown API_TRANSPORT: {API_TRANSPORT}')
+
+def mset_batches(client, pairs):
+    """MSET ``(key, value)`` pairs in pipelined batches; returns (keys set, errors)."""
+    pipe = client.pipeline(max_commands=PIPELINE_DEPTH)
+    items = []
+    for key, value in pairs:
+        items.append(key)
+        items.append(value)
+        if len(items) >= 2 * BATCH_SIZE:
+            pipe.mset(*items)
+            items = []
+    if items:
+        pipe.mset(*items)
+    count = errors = 0
+    for result in pipe.execute():
+        if isinstance(result, CommandError):
+            errors += 1
+        else:
+            count += result
+    return count, errors
+
+def transactions_closed(commands):
+    """False if a MULTI in ``commands`` is not followed by EXEC or DISCARD."""
+    open_multi = False
+    for command in commands:
+        name = str(command[0]).upper()
+        if name == 'MULTI':
+            open_multi = True
+        elif name in ('EXEC', 'DISCARD'):
+            open_multi = False
+    return not open_multi
+
+def ndjson_lines(stream):
+    """Parse the request body one line at a time."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
 
 @app.route('/get/<key>', methods=['GET'])
 def get_key(key):
-    client = Client()
     try:
-        value = client.get(key)
+        with pool.connection() as client:
+            value = client.get(key)
         return jsonify({'key': key, 'value': value}), 200
     except CommandError as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/set', methods=['POST'])
 def set_key():
-    client = Client()
     data = request.json
     key = data.get('key')
     value = data.get('value')
     try:
-        result = client.set(key, value)
+        with pool.connection() as client:
+            result = client.set(key, value)
         return jsonify({'result': result}), 200
     except CommandError as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/delete/<key>', methods=['DELETE'])
 def delete_key(key):
-    client = Client()
     try:
-        result = client.delete(key)
+        with pool.connection() as client:
+            result = client.delete(key)
         return jsonify({'result': result}), 200
     except CommandError as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/flush', methods=['POST'])
 def flush():
-    client = Client()
     try:
-        result = client.flush()
+        with pool.connection() as client:
+            result = client.flush()
         return jsonify({'result': result}), 200
     except CommandError as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/mget', methods=['POST'])
 def mget_keys():
-    client = Client()
     data = request.json
     keys = data.get('keys')
     try:
-        values = client.mget(*keys)
+        with pool.connection() as client:
+            values = client.mget(*keys)
         return jsonify({'keys': keys, 'values': values}), 200
     except CommandError as e:
         return jsonify({'error': str(e)}), 400
 
 @app.route('/mset', methods=['POST'])
 def mset_keys():
-    client = Client()
     data = request.json
-    items = []
-    for key, value in data.items():
-        items.append(key)
-        items.append(value)
     try:
-        result = client.mset(*items)
+        with pool.connection() as client:
+            if len(data) <= BATCH_SIZE:
+                result = client.mset(*[item for pair in data.items() for item in pair])
+            else:
+                result, errors = mset_batches(client, data.items())
+                if errors:
+                    return jsonify({'result': result, 'errors': errors}), 400
         return jsonify({'result': result}), 200
     except CommandError as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/mset/stream', methods=['POST'])
+def mset_stream():
+    """Import NDJSON lines of ``{"key": ..., "value": ...}`` in constant memory."""
+    pairs = ((line['key'], line['value']) for line in ndjson_lines(request.stream))
+    try:
+        with pool.connection() as client:
+            result, errors = mset_batches(client, pairs)
+    except CommandError as e:
+        return jsonify({'error': str(e)}), 400
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'error': f'Invalid NDJSON line: {e}'}), 400
+    if errors:
+        return jsonify({'result': result, 'errors': errors}), 400
+    return jsonify({'result': result}), 200
+
+@app.route('/mget/stream', methods=['POST'])
+def mget_stream():
+    """Answer NDJSON lines of keys (or ``{"key": ...}``) with ``{"key", "value"}`` lines."""
+    def generate():
+        batch = []
+        try:
+            with pool.connection() as client:
+                for line in ndjson_lines(request.stream):
+                    batch.append(line['key'] if isinstance(line, dict) else line)
+                    if len(batch) >= BATCH_SIZE:
+                        yield from encode_values(batch, client.mget(*batch))
+                        batch = []
+                if batch:
+                    yield from encode_values(batch, client.mget(*batch))
+        except (CommandError, ValueError, KeyError) as e:
+            # The status line is already sent; report the failure in-band.
+            yield json.dumps({'error': str(e)}) + '\n'
+
+    def encode_values(keys, values):
+        yield ''.join(json.dumps({'key': key, 'value': value}) + '\n'
+                      for key, value in zip(keys, values))
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/pipeline', methods=['POST'])
+def pipeline():
+    """Run ``{"commands": [["SET", "k", "v"], ["GET", "k"], ...]}`` as one pipelined batch."""
+    data = request.json
+    commands = data.get('commands') if isinstance(data, dict) else data
+    if not isinstance(commands, list) or not all(
+            isinstance(command, list) and command for command in commands):
+        return jsonify({'error': 'Expected a list of commands'}), 400
+    if len(commands) > MAX_PIPELINE_COMMANDS:
+        return jsonify({'error': f'At most {MAX_PIPELINE_COMMANDS} commands per pipeline'}), 400
+    if any(str(command[0]).upper() in PIPELINE_REFUSED for command in commands):
+        return jsonify({'error': 'Command not allowed in a pipeline'}), 400
+    if not transactions_closed(commands):
+        return jsonify({'error': 'MULTI without EXEC or DISCARD'}), 400
+    try:
+        with pool.connection() as client:
+            pipe = client.pipeline(max_commands=BATCH_SIZE)
+            for command in commands:
+                pipe.execute_command(*command)
+            results = pipe.execute()
+    except CommandError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'results': [
+        {'error': str(result)} if isinstance(result, CommandError) else result
+        for result in results]}), 200
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the RESP server accepts connections and answers PING."""
+    if not server.ready:
+        return jsonify({'status': 'unavailable'}), 503
+    try:
+        with pool.connection() as client:
+            client.ping()
+    except (CommandError, OSError) as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ready'}), 200
+
+@app.route('/pool', methods=['GET'])
+def pool_stats():
+    return jsonify(pool.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    try:
+        with pool.connection() as client:
+            info = client.info('all')
+    except CommandError as e:
+        return jsonify({'error': str(e)}), 503
+    return Response(prometheus_text(info, pool.stats()), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    # Start the Flask app
-    app.run(host='0.0.0.0', port=8000)
\ No newline at end of file
+    host = os.environ.get('SERVER_ADDRESS', '0.0.0.0')
+    port = int(os.environ.get('SERVER_PORT', 8000))
+    http_server = make_server(host, port, app, threaded=True)
+    # SIGTERM or Ctrl-C stops taking HTTP requests; the RESP server then
+    # drains its connections before the process exits.
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        gevent.signal_handler(signum, http_server.shutdown)
+    app.logger.info('Serving on http://%s:%s', host, port)
+    try:
+        # Checks for a shutdown request this often
+        http_server.serve_forever(poll_interval=0.1)
+    finally:
+        server.shutdown()
+        server_thread.join()
@@ -0,0 +1,326 @@
+"""Load generator for the RESP server and the HTTP API, similar to redis-benchmark.
+
+Each of --clients workers runs in its own greenlet with its own connection
+and sends --pipeline operations per round trip: a Client pipeline for the
+``resp`` test, and one /pipeline request for the ``http`` test (single-key
+/get and /set when --pipeline is 1). Operations are GETs or
+SETs on keys drawn from --keyspace, with values sized by --value-size.
+Every operation in a round trip is recorded with that round trip's
+latency.
+
+Usage:
+  python src/benchmark.py --tests resp --clients 50 --pipeline 16 --json results.json
+  python src/benchmark.py --tests http --url http://127.0.0.1:8000
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import socket as stdlib_socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+import gevent
+from gevent import socket
+
+from client import Client
+from metrics import LatencyHistogram
+from storage import CommandError
+
+logger = logging.getLogger(__name__)
+
+TESTS = ('resp', 'http')
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Prepopulation writes the keyspace with MSETs of this many keys.
+POPULATE_BATCH = 500
+
+def parse_size_range(value: str) -> Tuple[int, int]:
+    """Turn ``64`` or ``16-1024`` into a (min, max) byte range."""
+    low, _, high = value.partition('-')
+    try:
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid value size: {value!r}')
+    if low < 0 or high < low:
+        raise argparse.ArgumentTypeError(f'Invalid value size: {value!r}')
+    return low, high
+
+class Workload:
+    """Draws operations: which key, read or write, and how large a value.
+
+    Values are slices of one random block, so generating them costs no
+    more than the slice. Sizes are uniform over ``value_size`` unless
+    ``value_distribution`` is ``exponential``, which favours small values
+    with a long tail up to the maximum.
+    """
+
+    def __init__(self, keyspace: int = 10000, value_size=(64, 64), read_ratio: float = 0.5,
+                 value_distribution: str = 'uniform', seed: Optional[int] = None):
+        self.keyspace = keyspace
+        self.value_size = value_size
+        self.read_ratio = read_ratio
+        self.value_distribution = value_distribution
+        self._random = random.Random(seed)
+        alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+        self._block = ''.join(self._random.choice(alphabet) for _ in range(value_size[1] + 4096))
+
+    def key(self, index: Optional[int] = None) -> str:
+        if index is None:
+            index = self._random.randrange(self.keyspace)
+        return f'key:{index:012d}'
+
+    def value(self) -> str:
+        low, high = self.value_size
+        if self.value_distribution == 'exponential' and high > low:
+            size = min(high, low + int(self._random.expovariate(4 / (high - low))))
+        else:
+            size = self._random.randint(low, high)
+        start = self._random.randrange(len(self._block) - size + 1)
+        return self._block[start:start + size]
+
+    def batch(self, size: int) -> List[Tuple[str, str, Optional[str]]]:
+        """``size`` operations as ('get', key, None) or ('set', key, value)."""
+        ops = []
+        for _ in range(size):
+            if self._random.random() < self.read_ratio:
+                ops.append(('get', self.key(), None))
+            else:
+                ops.append(('set', self.key(), self.value()))
+        return ops
+
+class RespTarget:
+    """Runs operation batches over a Client connection and its pipeline."""
+
+    def __init__(self, host: str, port: int, timeout: float = 30):
+        self._client = Client(host, port, timeout)
+
+    def run(self, ops) -> int:
+        if len(ops) == 1:
+            op, key, value = ops[0]
+            self._client.get(key) if op == 'get' else self._client.set(key, value)
+            return 0
+        pipe = self._client.pipeline()
+        for op, key, value in ops:
+            pipe.get(key) if op == 'get' else pipe.set(key, value)
+        return sum(isinstance(result, CommandError) for result in pipe.execute())
+
+    def populate(self, items: List[str]) -> None:
+        self._client.mset(*items)
+
+    def close(self) -> None:
+        self._client.close()
+
+class HttpTarget:
+    """Runs operation batches against the Flask API over a keep-alive connection.
+
+    A batch is one /pipeline request; a single operation uses /get or /set.
+    """
+
+    def __init__(self, url: str, timeout: float = 30):
+        parts = urlsplit(url)
+        self._conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        # Cooperative sockets, so workers overlap without monkey patching.
+        self._conn._create_connection = socket.create_connection
+
+    def _request(self, method: str, path: str, body=None):
+        """Returns the decoded JSON reply, or None for a non-200 status."""
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self._conn.request(method, path, body=body, headers=headers)
+        response = self._conn.getresponse()
+        data = response.read()
+        return json.loads(data) if response.status == 200 else None
+
+    def run(self, ops) -> int:
+        if len(ops) == 1:
+            op, key, value = ops[0]
+            if op == 'get':
+                reply = self._request('GET', '/get/' + quote(key, safe=''))
+            else:
+                reply = self._request('POST', '/set', {'key': key, 'value': value})
+            return 0 if reply is not None else 1
+        reply = self._request('POST', '/pipeline', {'commands': [
+            ['GET', key] if op == 'get' else ['SET', key, value] for op, key, value in ops]})
+        if reply is None:
+            return len(ops)
+        return sum(isinstance(result, dict) and 'error' in result for result in reply['results'])
+
+    def populate(self, items: List[str]) -> None:
+        self._request('POST', '/mset', dict(zip(items[::2], items[1::2])))
+
+    def close(self) -> None:
+        self._conn.close()
+
+def populate(target, workload: Workload) -> None:
+    items = []
+    for index in range(workload.keyspace):
+        items.extend((workload.key(index), workload.value()))
+        if len(items) >= 2 * POPULATE_BATCH:
+            target.populate(items)
+            items = []
+    if items:
+        target.populate(items)
+
+def run_benchmark(make_target, workload: Workload, clients: int = 50, requests: int = 100000,
+                  pipeline: int = 1, duration: Optional[float] = None) -> Dict[str, Any]:
+    """Drive ``clients`` concurrent targets and return throughput and latencies.
+
+    Stops after ``requests`` operations in total, or after ``duration``
+    seconds when that is given.
+    """
+    histograms = {'all': LatencyHistogram(), 'get': LatencyHistogram(), 'set': LatencyHistogram()}
+    totals = {'ops': 0, 'errors': 0}
+    targets = [make_target() for _ in range(clients)]
+    per_client = [requests // clients + (i < requests % clients) for i in range(clients)]
+
+    def worker(target, budget):
+        deadline = time.monotonic() + duration if duration else None
+        while deadline is not None or budget > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            ops = workload.batch(pipeline if deadline is not None else min(pipeline, budget))
+            start = time.perf_counter()
+            try:
+                errors = target.run(ops)
+            except (CommandError, OSError, http.client.HTTPException) as exc:
+                logger.warning('Worker stopped: %s', exc)
+                totals['errors'] += len(ops)
+                return
+            elapsed = time.perf_counter() - start
+            histograms['all'].record(elapsed, len(ops))
+            for op, _, _ in ops:
+                histograms[op].record(elapsed)
+            totals['ops'] += len(ops)
+            totals['errors'] += errors
+            budget -= len(ops)
+
+    start = time.perf_counter()
+    try:
+        gevent.joinall([gevent.spawn(worker, target, budget)
+                        for target, budget in zip(targets, per_client)], raise_error=True)
+    finally:
+        elapsed = time.perf_counter() - start
+        for target in targets:
+            target.close()
+    return {
+        'ops': totals['ops'],
+        'errors': totals['errors'],
+        'seconds': round(elapsed, 4),
+        'ops_per_sec': round(totals['ops'] / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {name: histogram.summary()
+                       for name, histogram in histograms.items() if histogram.count},
+    }
+
+def free_port() -> int:
+    with stdlib_socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(host: str, port: int, timeout: float = 15) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            stdlib_socket.create_connection((host, port), timeout=0.2).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'Nothing is listening on {host}:{port}')
+            time.sleep(0.05)
+
+def start_process(script: str, *args) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.join(SRC_DIR, script), *args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tests', nargs='+', choices=TESTS, default=['resp'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=31337)
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the HTTP API')
+    parser.add_argument('--start', action='store_true',
+                        help='Start server.py (and app.py for the http test) for the run')
+    parser.add_argument('--clients', type=int, default=50, help='Concurrent connections')
+    parser.add_argument('--requests', type=int, default=100000, help='Operations per test')
+    parser.add_argument('--duration', type=float, help='Run each test for this many seconds instead')
+    parser.add_argument('--pipeline', type=int, default=1, help='Operations per round trip')
+    parser.add_argument('--keyspace', type=int, default=10000, help='Number of distinct keys')
+    parser.add_argument('--value-size', type=parse_size_range, default=(64, 64),
+                        help='Value size in bytes, or a MIN-MAX range')
+    parser.add_argument('--value-distribution', choices=('uniform', 'exponential'),
+                        default='uniform')
+    parser.add_argument('--read-ratio', type=float, default=0.5,
+                        help='Fraction of operations that are GETs')
+    parser.add_argument('--no-populate', action='store_true',
+                        help='Skip writing every key before the run')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--json', metavar='PATH', help="Write results as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    workload = Workload(args.keyspace, args.value_size, args.read_ratio,
+                        args.value_distribution, args.seed)
+    processes = []
+    if args.start:
+        # app.py always starts its own server on the default port.
+        if 'http' in args.tests:
+            args.port = 31337
+            processes.append(start_process('app.py'))
+        else:
+            args.port = free_port()
+            processes.append(start_process('server.py', '--port', str(args.port)))
+    makers = {
+        'resp': lambda: RespTarget(args.host, args.port),
+        'http': lambda: HttpTarget(args.url),
+    }
+
+    report = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('json', 'start')},
+        'results': {},
+    }
+    try:
+        if args.start:
+            wait_for_port(args.host, args.port)
+            if 'http' in args.tests:
+                url = urlsplit(args.url)
+                wait_for_port(url.hostname, url.port or 80)
+        for test in args.tests:
+            if not args.no_populate:
+                target = makers[test]()
+                try:
+                    populate(target, workload)
+                finally:
+                    target.close()
+            result = run_benchmark(makers[test], workload, args.clients, args.requests,
+                                   args.pipeline, args.duration)
+            report['results'][test] = result
+            latency = result['latency_ms'].get('all') or LatencyHistogram().summary()
+            print('%-5s %10.0f ops/s  p50 %.3f ms  p99 %.3f ms  p99.9 %.3f ms  errors %d' % (
+                test, result['ops_per_sec'], latency['p50'], latency['p99'], latency['p999'],
+                result['errors']), file=sys.stderr if args.json == '-' else sys.stdout)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,234 @@
-from gevent import socket
+import bisect
+from collections import deque
+from contextlib import contextmanager
+import gevent
+from gevent import select, socket
+from gevent.lock import BoundedSemaphore
 from socket import error as socket_error
-from typing import Any
+import hashlib
+import time
+from typing import Any, Dict, List, Optional
 
-from protocol import ProtocolHandler, Error
-from storage import CommandError
+from protocol import ProtocolHandler, RespParser, Encoded, Error, Disconnect, INCOMPLETE
+from storage import CommandError, estimate_size
 
-class Client:
+# Spellings of EXEC whose reply a client unpacks like a pipeline's
+EXEC_NAMES = frozenset(('EXEC', 'exec', b'EXEC', b'exec'))
+
+# Commands whose first argument is the only key they touch.
+KEY_COMMANDS = frozenset(
+    ('GET', 'SET', 'DELETE', 'EXPIRE', 'PEXPIRE', 'EXPIREAT', 'PEXPIREAT', 'TTL', 'PTTL',
+     'PERSIST', 'TYPE', 'HSET', 'HGET', 'HMGET', 'HDEL', 'HGETALL', 'LPUSH', 'RPUSH', 'LPOP',
+     'RPOP', 'LRANGE', 'SADD', 'SREM', 'SISMEMBER', 'SMEMBERS', 'INCR', 'DECR', 'INCRBY',
+     'DECRBY', 'INCRBYFLOAT', 'GETSET', 'SETNX'))
+
+DEFAULT_VIRTUAL_NODES = 160
+
+def _opens_transaction(name) -> bool:
+    """True for MULTI and WATCH in any case, which leave state on the connection."""
+    if isinstance(name, bytes):
+        name = name.decode('latin-1')
+    return isinstance(name, str) and len(name) == 5 and name.upper() in ('MULTI', 'WATCH')
+
+def split_msetex(args):
+    """Split MSETEX arguments after the name into (pairs, options), or None if malformed."""
+    try:
+        count = int(args[0])
+    except (IndexError, TypeError, ValueError):
+        return None
+    if count < 1 or len(args) < 1 + 2 * count:
+        return None
+    return list(args[1:1 + 2 * count]), list(args[1 + 2 * count:])
+
+class Commands:
+    """Command helpers shared by Client and Pipeline.
+
+    Subclasses provide ``execute_command``, which either runs the command
+    immediately or queues it.
+    """
+
+    def get(self, key):
+        return self.execute_command('GET', key)
+
+    def set(self, key, value, ex=None, px=None):
+        return self.execute_command('SET', key, value, *self._expiry_args(ex, px))
+
+    def delete(self, key):
+        return self.execute_command('DELETE', key)
+
+    def flush(self):
+        return self.execute_command('FLUSH')
+
+    def mget(self, *keys):
+        return self.execute_command('MGET', *keys)
+
+    def mset(self, *items, ex=None, px=None):
+        if len(items) % 2 != 0:
+            raise CommandError('MSET requires pairs of key/value arguments')
+        expiry = self._expiry_args(ex, px)
+        if expiry:
+            return self.execute_command('MSETEX', len(items) // 2, *items, *expiry)
+        return self.execute_command('MSET', *items)
+
+    def expire(self, key, seconds):
+        return self.execute_command('EXPIRE', key, seconds)
+
+    def pexpire(self, key, milliseconds):
+        return self.execute_command('PEXPIRE', key, milliseconds)
+
+    def expireat(self, key, timestamp):
+        return self.execute_command('EXPIREAT', key, timestamp)
+
+    def pexpireat(self, key, timestamp_ms):
+        return self.execute_command('PEXPIREAT', key, timestamp_ms)
+
+    def ttl(self, key):
+        return self.execute_command('TTL', key)
+
+    def pttl(self, key):
+        return self.execute_command('PTTL', key)
+
+    def persist(self, key):
+        return self.execute_command('PERSIST', key)
+
+    def type(self, key):
+        return self.execute_command('TYPE', key)
+
+    def incr(self, key):
+        return self.execute_command('INCR', key)
+
+    def decr(self, key):
+        return self.execute_command('DECR', key)
+
+    def incrby(self, key, amount):
+        return self.execute_command('INCRBY', key, amount)
+
+    def decrby(self, key, amount):
+        return self.execute_command('DECRBY', key, amount)
+
+    def incrbyfloat(self, key, amount):
+        return self.execute_command('INCRBYFLOAT', key, amount)
+
+    def getset(self, key, value):
+        return self.execute_command('GETSET', key, value)
+
+    def setnx(self, key, value):
+        return self.execute_command('SETNX', key, value)
+
+    def msetnx(self, *items):
+        if len(items) % 2 != 0:
+            raise CommandError('MSETNX requires pairs of key/value arguments')
+        return self.execute_command('MSETNX', *items)
+
+    def multi(self):
+        return self.execute_command('MULTI')
+
+    def exec(self):
+        """Run the queued commands; None if a WATCHed key changed, else their replies."""
+        return self.execute_command('EXEC')
+
+    def discard(self):
+        return self.execute_command('DISCARD')
+
+    def watch(self, *keys):
+        return self.execute_command('WATCH', *keys)
+
+    def unwatch(self):
+        return self.execute_command('UNWATCH')
+
+    def hset(self, key, *items):
+        if not items or len(items) % 2 != 0:
+            raise CommandError('HSET requires pairs of field/value arguments')
+        return self.execute_command('HSET', key, *items)
+
+    def hget(self, key, field):
+        return self.execute_command('HGET', key, field)
+
+    def hmget(self, key, *fields):
+        return self.execute_command('HMGET', key, *fields)
+
+    def hdel(self, key, *fields):
+        return self.execute_command('HDEL', key, *fields)
+
+    def hgetall(self, key):
+        return self.execute_command('HGETALL', key)
+
+    def lpush(self, key, *values):
+        return self.execute_command('LPUSH', key, *values)
+
+    def rpush(self, key, *values):
+        return self.execute_command('RPUSH', key, *values)
+
+    def lpop(self, key, count=None):
+        return self.execute_command('LPOP', key, *(() if count is None else (count,)))
+
+    def rpop(self, key, count=None):
+        return self.execute_command('RPOP', key, *(() if count is None else (count,)))
+
+    def lrange(self, key, start, stop):
+        return self.execute_command('LRANGE', key, start, stop)
+
+    def sadd(self, key, *members):
+        return self.execute_command('SADD', key, *members)
+
+    def srem(self, key, *members):
+        return self.execute_command('SREM', key, *members)
+
+    def sismember(self, key, member):
+        return self.execute_command('SISMEMBER', key, member)
+
+    def smembers(self, key):
+        return self.execute_command('SMEMBERS', key)
+
+    def memory_usage(self, key):
+        return self.execute_command('MEMORY', 'USAGE', key)
+
+    def memory_stats(self):
+        return self.execute_command('MEMORY', 'STATS')
+
+    def info(self, *sections):
+        return self.execute_command('INFO', *sections)
+
+    def slowlog_get(self, count=10):
+        return self.execute_command('SLOWLOG', 'GET', count)
+
+    def slowlog_len(self):
+        return self.execute_command('SLOWLOG', 'LEN')
+
+    def slowlog_reset(self):
+        return self.execute_command('SLOWLOG', 'RESET')
+
+    def ping(self, message=None):
+        return self.execute_command('PING', *(() if message is None else (message,)))
+
+    @staticmethod
+    def _expiry_args(ex, px):
+        if ex is not None and px is not None:
+            raise CommandError('Only one of ex and px may be given')
+        if ex is not None:
+            return ('EX', ex)
+        if px is not None:
+            return ('PX', px)
+        return ()
+
+class Client(Commands):
     """Client implementation with proper resource management."""
     
-    def __init__(self, host='127.0.0.1', port=31337, timeout=30):
+    def __init__(self, host='127.0.0.1', port=31337, timeout=30, unix_socket_path=None):
         self._protocol = ProtocolHandler()
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if unix_socket_path:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = unix_socket_path
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (host, port)
         self._socket.settimeout(timeout)
-        self._socket.connect((host, port))
+        self._socket.connect(address)
         self._fh = self._socket.makefile('rwb')
+        self._broken = False
+        # Set once MULTI or WATCH is sent; cleared by reset
+        self._in_transaction = False
+        self._created_at = self._last_used = time.monotonic()
 
     def __enter__(self):
         return self
@@ -31,32 +246,640 @@ class Client:
         except:
             pass
 
+    def is_alive(self) -> bool:
+        """Check, without blocking, that the server has not closed the socket.
+
+        An idle connection should have nothing to read; readable means the
+        peer hung up or sent something unexpected, and either way the
+        connection is no longer usable.
+        """
+        if self._broken:
+            return False
+        try:
+            readable, _, _ = select.select([self._socket], [], [], 0)
+        except (socket_error, ValueError):
+            return False
+        return not readable
+
+    def reset(self) -> None:
+        """End any MULTI or WATCH left open, so the connection can be reused."""
+        if self._in_transaction:
+            self.pipeline().discard().unwatch().execute()
+            self._in_transaction = False
+
     def execute(self, *args) -> Any:
+        if _opens_transaction(args[0]):
+            self._in_transaction = True
         try:
             self._protocol.write_response(self._fh, args)
             resp = self._protocol.handle_request(self._fh)
             if isinstance(resp, Error):
                 raise CommandError(resp.message)
+            if args[0] in EXEC_NAMES:
+                return _exec_reply(resp)
             return resp
         except socket_error as e:
+            self._broken = True
             raise CommandError(f'Connection error: {e}')
+        except Disconnect:
+            self._broken = True
+            raise CommandError('Connection error: closed by server')
 
-    def get(self, key):
-        return self.execute('GET', key)
+    def execute_command(self, *args) -> Any:
+        return self.execute(*args)
 
-    def set(self, key, value):
-        return self.execute('SET', key, value)
+    def pipeline(self, max_commands=None, max_bytes=None) -> 'Pipeline':
+        return Pipeline(self, max_commands, max_bytes)
 
-    def delete(self, key):
-        return self.execute('DELETE', key)
+class Pipeline(Commands):
+    """Queues commands and sends them to the server in a single write.
 
-    def flush(self):
-        return self.execute('FLUSH')
+    Replies are read back in order by ``execute``; a command that fails
+    leaves a CommandError in its slot instead of aborting the batch. When
+    ``max_commands`` or ``max_bytes`` is set, the queue is sent as soon as
+    either limit is reached, so very long pipelines stream to the server
+    rather than building up in memory.
+    """
 
-    def mget(self, *keys):
-        return self.execute('MGET', *keys)
+    def __init__(self, client: Client, max_commands=None, max_bytes=None):
+        self._client = client
+        self._max_commands = max_commands
+        self._max_bytes = max_bytes
+        self._buffer = bytearray()
+        self._pending = 0
+        self._results = []
+        self._exec_slots = []  # positions of queued EXECs in the unsent batch
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self._pending:
+            self.execute()
+        else:
+            self.reset()
+
+    def __len__(self):
+        return self._pending + len(self._results)
+
+    def execute_command(self, *args) -> 'Pipeline':
+        self._client._protocol.encode_into(self._buffer, args)
+        if _opens_transaction(args[0]):
+            self._client._in_transaction = True
+        if args[0] in EXEC_NAMES:
+            self._exec_slots.append(self._pending)
+        self._pending += 1
+        if ((self._max_commands and self._pending >= self._max_commands) or
+                (self._max_bytes and len(self._buffer) >= self._max_bytes)):
+            self._send()
+        return self
+
+    def execute(self) -> List[Any]:
+        """Send queued commands and return every reply since the last execute."""
+        if self._pending:
+            self._send()
+        results, self._results = self._results, []
+        return results
+
+    def reset(self) -> None:
+        self._buffer = bytearray()
+        self._pending = 0
+        self._results = []
+        self._exec_slots = []
+
+    def _send(self) -> None:
+        client = self._client
+        payload, count = self._buffer, self._pending
+        exec_slots, first = self._exec_slots, len(self._results)
+        self._buffer = bytearray()
+        self._pending = 0
+        self._exec_slots = []
+        try:
+            client._fh.write(payload)
+            client._fh.flush()
+            for _ in range(count):
+                resp = client._protocol.handle_request(client._fh)
+                self._results.append(
+                    CommandError(resp.message) if isinstance(resp, Error) else resp)
+            for slot in exec_slots:
+                self._results[first + slot] = _exec_reply(self._results[first + slot])
+        except socket_error as e:
+            client._broken = True
+            raise CommandError(f'Connection error: {e}')
+        except Disconnect:
+            client._broken = True
+            raise CommandError('Connection error: closed by server')
+
+class ConnectionPool:
+    """Bounded, gevent-aware pool of Client connections.
 
-    def mset(self, *items):
+    At most ``max_connections`` clients exist at once; callers block for up
+    to ``checkout_timeout`` seconds waiting for one. Idle connections are
+    health-checked before reuse once they have been idle for
+    ``health_check_interval`` seconds, closed after ``max_idle_time`` idle
+    seconds, and retired after ``max_lifetime`` seconds in total. A
+    connection that sent MULTI or WATCH is reset when it is returned, so the
+    next borrower never inherits a transaction.
+    """
+
+    def __init__(self, host='127.0.0.1', port=31337, max_connections=32, timeout=30,
+                 checkout_timeout=5.0, max_idle_time=60.0, max_lifetime=3600.0,
+                 health_check_interval=30.0, unix_socket_path=None):
+        self._host = host
+        self._port = port
+        self._unix_socket_path = unix_socket_path
+        self._timeout = timeout
+        self._max_connections = max_connections
+        self._checkout_timeout = checkout_timeout
+        self._max_idle_time = max_idle_time
+        self._max_lifetime = max_lifetime
+        self._health_check_interval = health_check_interval
+        self._slots = BoundedSemaphore(max_connections)
+        self._idle = deque()  # least recently used on the left
+        self._in_use = 0
+        self._closed = False
+        self._created = 0
+        self._discarded = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def get_connection(self) -> Client:
+        if self._closed:
+            raise CommandError('Connection pool is closed')
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            self._waits += 1
+            if not self._slots.acquire(timeout=self._checkout_timeout):
+                self._timeouts += 1
+                raise CommandError('Timed out waiting for a pooled connection')
+        waited = time.monotonic() - start
+        self._wait_time += waited
+        self._max_wait_time = max(self._max_wait_time, waited)
+
+        try:
+            client = self._take_idle() or self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+        self._checkouts += 1
+        self._in_use += 1
+        return client
+
+    def release(self, client: Client) -> None:
+        self._in_use -= 1
+        try:
+            if not client._broken:
+                try:
+                    client.reset()
+                except CommandError:
+                    pass  # the client is now marked broken
+            now = time.monotonic()
+            if self._closed or client._broken or self._too_old(client, now):
+                self._discard(client)
+            else:
+                client._last_used = now
+                self._idle.append(client)
+            self.reap()
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        client = self.get_connection()
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def reap(self) -> int:
+        """Close connections that have been idle longer than ``max_idle_time``."""
+        reaped = 0
+        cutoff = time.monotonic() - self._max_idle_time
+        while self._idle and self._idle[0]._last_used < cutoff:
+            self._discard(self._idle.popleft())
+            reaped += 1
+        return reaped
+
+    def close(self) -> None:
+        self._closed = True
+        while self._idle:
+            self._discard(self._idle.popleft())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_connections': self._max_connections,
+            'in_use': self._in_use,
+            'idle': len(self._idle),
+            'created': self._created,
+            'discarded': self._discarded,
+            'checkouts': self._checkouts,
+            'waits': self._waits,
+            'timeouts': self._timeouts,
+            'wait_time_total': self._wait_time,
+            'wait_time_max': self._max_wait_time,
+        }
+
+    def _connect(self) -> Client:
+        client = Client(self._host, self._port, self._timeout, self._unix_socket_path)
+        self._created += 1
+        return client
+
+    def _take_idle(self) -> Optional[Client]:
+        now = time.monotonic()
+        while self._idle:
+            # Most recently used first: it is the most likely to be healthy.
+            client = self._idle.pop()
+            if self._too_old(client, now):
+                self._discard(client)
+            elif (now - client._last_used >= self._health_check_interval
+                    and not client.is_alive()):
+                self._discard(client)
+            else:
+                return client
+        return None
+
+    def _too_old(self, client: Client, now: float) -> bool:
+        return now - client._created_at >= self._max_lifetime
+
+    def _discard(self, client: Client) -> None:
+        self._discarded += 1
+        client.close()
+
+class LocalClient(Commands):
+    """Runs commands on a Server in the same process, without a socket.
+
+    Requests go through ``Server.process_request`` just like those read
+    from a connection, so validation, errors, stats and the slow log are
+    the same. Replies are converted to what Client would have decoded from
+    the wire. Values are not copied, so lists and dicts that are stored or
+    returned must be treated as read-only. Like a connection, each client
+    has its own MULTI/WATCH state.
+    """
+
+    def __init__(self, server):
+        from server import Transaction  # only embedded clients need the server module
+        self._server = server
+        self._parser = RespParser(encoding='utf-8')
+        self._transaction = Transaction()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.reset()
+
+    def reset(self):
+        """Drop an unfinished MULTI and any WATCHed keys, as a disconnect would."""
+        self._server.end_transaction(self._transaction)
+
+    def is_alive(self) -> bool:
+        return True
+
+    def execute(self, *args) -> Any:
+        resp = self._server.process_request([_as_sent(arg) for arg in args], self._transaction)
+        if isinstance(resp, Error):
+            raise CommandError(resp.message)
+        return self._as_received(resp)
+
+    def execute_command(self, *args) -> Any:
+        return self.execute(*args)
+
+    def pipeline(self, max_commands=None, max_bytes=None) -> 'LocalPipeline':
+        return LocalPipeline(self, max_commands, max_bytes)
+
+    def _as_received(self, resp):
+        """``resp`` as Client would decode it after a trip through RESP."""
+        kind = type(resp)
+        if kind is str or kind is int or resp is None:
+            return resp
+        if kind is list:
+            return [self._as_received(item) for item in resp]
+        if kind is dict:
+            return {str(key): self._as_received(value) for key, value in resp.items()}
+        if kind is Encoded:
+            self._parser.feed(resp)
+            value = self._parser.gets()
+            if value is INCOMPLETE:
+                self._parser.reset()
+                raise CommandError('Malformed stored value')
+            return value
+        if kind is bytes:
+            try:
+                return resp.decode('utf-8')
+            except UnicodeDecodeError:
+                return resp
+        if isinstance(resp, (str, float)):
+            return str(resp)
+        if kind is bool:
+            return int(resp)
+        if kind is Error:
+            # Only nested, in an EXEC reply
+            return CommandError(resp.message)
+        # Replies such as PSYNC's hand the connection over to the server.
+        raise CommandError('Command needs a network connection')
+
+def _exec_reply(resp):
+    """EXEC's reply with the commands that failed as CommandError, as in a pipeline."""
+    if type(resp) is not list:
+        return resp
+    return [CommandError(item.message) if isinstance(item, Error) else item for item in resp]
+
+def _as_sent(arg):
+    """``arg`` as the server would parse it after Client encoded it."""
+    kind = type(arg)
+    if kind is str or kind is int or kind is bytes or arg is None:
+        return arg
+    if kind is list:
+        return [_as_sent(item) for item in arg]
+    if kind is dict:
+        return {str(key): _as_sent(value) for key, value in arg.items()}
+    if kind is bool:
+        return int(arg)
+    return str(arg)
+
+class LocalPipeline(Commands):
+    """Pipeline interface for LocalClient; commands run in order on ``execute``.
+
+    As with Pipeline, the queue is run as soon as it reaches ``max_commands``
+    or ``max_bytes`` (of RESP-encoded commands), so a long pipeline holds
+    only one batch of commands at a time.
+    """
+
+    def __init__(self, client: LocalClient, max_commands=None, max_bytes=None):
+        self._client = client
+        self._max_commands = max_commands
+        self._max_bytes = max_bytes
+        self._commands = []
+        self._bytes = 0
+        self._results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None and self._commands:
+            self.execute()
+        else:
+            self.reset()
+
+    def __len__(self):
+        return len(self._commands) + len(self._results)
+
+    def execute_command(self, *args) -> 'LocalPipeline':
+        self._commands.append(args)
+        if self._max_bytes:
+            self._bytes += estimate_size(args)
+        if ((self._max_commands and len(self._commands) >= self._max_commands) or
+                (self._max_bytes and self._bytes >= self._max_bytes)):
+            self._run()
+        return self
+
+    def execute(self) -> List[Any]:
+        """Run queued commands and return every reply since the last execute."""
+        self._run()
+        results, self._results = self._results, []
+        return results
+
+    def reset(self) -> None:
+        self._commands = []
+        self._bytes = 0
+        self._results = []
+
+    def _run(self) -> None:
+        commands, self._commands, self._bytes = self._commands, [], 0
+        for args in commands:
+            try:
+                self._results.append(self._client.execute(*args))
+            except CommandError as exc:
+                self._results.append(exc)
+
+class LocalPool:
+    """Stand-in for ConnectionPool that hands out LocalClients.
+
+    Each checkout gets a client of its own, so concurrent requests do not
+    share MULTI/WATCH state; returned clients are reset and reused.
+    ``stats`` has ConnectionPool's fields so /pool and /metrics keep working.
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._idle: List[LocalClient] = []
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+
+    @contextmanager
+    def connection(self):
+        if self._idle:
+            client = self._idle.pop()
+        else:
+            client = LocalClient(self._server)
+            self._created += 1
+        self._in_use += 1
+        self._checkouts += 1
+        try:
+            yield client
+        finally:
+            self._in_use -= 1
+            client.reset()
+            self._idle.append(client)
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'mode': 'embedded',
+            'max_connections': 0,
+            'in_use': self._in_use,
+            'idle': len(self._idle),
+            'created': self._created,
+            'discarded': 0,
+            'checkouts': self._checkouts,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+class HashRing:
+    """Consistent-hash ring that maps keys to nodes.
+
+    Each node is placed on the ring at ``virtual_nodes`` points. A key
+    belongs to the first point at or after its own hash, so adding or
+    removing one of N nodes moves only about 1/N of the keys.
+    """
+
+    def __init__(self, nodes=(), virtual_nodes=DEFAULT_VIRTUAL_NODES):
+        self._virtual_nodes = virtual_nodes
+        self._points: List[int] = []
+        self._owners: List[Any] = []
+        self.nodes: List[Any] = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        label = '%s:%s' % node if isinstance(node, tuple) else str(node)
+        for i in range(self._virtual_nodes):
+            point = self._hash(f'{label}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node) -> None:
+        self.nodes.remove(node)
+        keep = [i for i, owner in enumerate(self._owners) if owner != node]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def get(self, key) -> Any:
+        if not self._points:
+            raise CommandError('No nodes in the hash ring')
+        if isinstance(key, bytes):
+            key = key.decode('utf-8', 'replace')
+        index = bisect.bisect(self._points, self._hash(str(key)))
+        return self._owners[index % len(self._owners)]
+
+class ClusterClient(Commands):
+    """Client that spreads keys over several servers with a HashRing.
+
+    Single-key commands go to the key's node. MGET and MSET are split per
+    node and sent concurrently, each node's share pipelined in chunks of
+    ``batch_size`` keys over one pooled connection; MGET results come back
+    in the order the keys were given. FLUSH runs on every node.
+    """
+
+    def __init__(self, nodes, virtual_nodes=DEFAULT_VIRTUAL_NODES, batch_size=1000,
+                 **pool_kwargs):
+        self._pool_kwargs = pool_kwargs
+        self._batch_size = batch_size
+        self._pools: Dict[Any, ConnectionPool] = {}
+        self._ring = HashRing(virtual_nodes=virtual_nodes)
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _node(node):
+        if isinstance(node, str):
+            host, _, port = node.rpartition(':')
+            return (host or '127.0.0.1', int(port))
+        return tuple(node)
+
+    @property
+    def nodes(self) -> List:
+        return list(self._ring.nodes)
+
+    def add_node(self, node) -> None:
+        node = self._node(node)
+        if node not in self._pools:
+            self._pools[node] = ConnectionPool(*node, **self._pool_kwargs)
+            self._ring.add(node)
+
+    def remove_node(self, node) -> None:
+        node = self._node(node)
+        self._ring.remove(node)
+        self._pools.pop(node).close()
+
+    def node_for(self, key):
+        return self._ring.get(key)
+
+    def close(self) -> None:
+        for pool in self._pools.values():
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def execute_command(self, *args) -> Any:
+        command = str(args[0]).upper()
+        if command == 'MGET':
+            return self._mget(args[1:])
+        if command == 'MSET':
+            return self._mset(args[1:])
+        if command == 'MSETEX':
+            parsed = split_msetex(args[1:])
+            if parsed is None:
+                raise CommandError('MSETEX numkeys does not match the key/value arguments')
+            return self._mset(*parsed)
+        if command == 'FLUSH':
+            return sum(self._fan_out({node: [args] for node in self._pools}).values(), 0)
+        if command in KEY_COMMANDS and len(args) > 1:
+            key = args[1]
+        elif command == 'MEMORY' and len(args) == 3 and str(args[1]).upper() == 'USAGE':
+            key = args[2]
+        else:
+            raise CommandError(f'{command} cannot be routed to a single node')
+        with self._pools[self._ring.get(key)].connection() as client:
+            return client.execute(*args)
+
+    def _mget(self, keys) -> List[Any]:
+        groups: Dict[Any, List[int]] = {}
+        for pos, key in enumerate(keys):
+            groups.setdefault(self._ring.get(key), []).append(pos)
+        batch = self._batch_size
+        requests = {
+            node: [('MGET', *(keys[pos] for pos in positions[i:i + batch]))
+                   for i in range(0, len(positions), batch)]
+            for node, positions in groups.items()}
+        replies = self._fan_out(requests, merge=lambda results: [v for r in results for v in r])
+        values = [None] * len(keys)
+        for node, positions in groups.items():
+            for pos, value in zip(positions, replies[node]):
+                values[pos] = value
+        return values
+
+    def _mset(self, items, options=None) -> int:
+        """MSET ``items``, or MSETEX with ``options`` (an EX/PX pair or nothing)."""
         if len(items) % 2 != 0:
             raise CommandError('MSET requires pairs of key/value arguments')
-        return self.execute('MSET', *items)
\ No newline at end of file
+        groups: Dict[Any, List] = {}
+        for key, value in zip(items[::2], items[1::2]):
+            groups.setdefault(self._ring.get(key), []).extend((key, value))
+        step = 2 * self._batch_size
+
+        def command(pairs):
+            # Each chunk gets its own key count, so the option stays an option
+            if options is None:
+                return ('MSET', *pairs)
+            return ('MSETEX', len(pairs) // 2, *pairs, *options)
+
+        requests = {
+            node: [command(pairs[i:i + step]) for i in range(0, len(pairs), step)]
+            for node, pairs in groups.items()}
+        return sum(self._fan_out(requests).values(), 0)
+
+    def _fan_out(self, requests: Dict[Any, List[tuple]], merge=sum) -> Dict[Any, Any]:
+        """Pipeline each node's commands concurrently and merge each node's replies."""
+        def run(node, commands):
+            with self._pools[node].connection() as client:
+                pipe = client.pipeline()
+                for command in commands:
+                    pipe.execute_command(*command)
+                results = pipe.execute()
+            for result in results:
+                if isinstance(result, CommandError):
+                    raise result
+            return merge(results)
+
+        jobs = {node: gevent.spawn(run, node, commands) for node, commands in requests.items()}
+        gevent.joinall(list(jobs.values()))
+        for job in jobs.values():
+            if job.exception is not None:
+                raise job.exception
+        return {node: job.value for node, job in jobs.items()}
@@ -0,0 +1,371 @@
+import gevent
+from gevent import socket
+from gevent.pool import Pool
+from gevent.server import StreamServer
+from socket import error as socket_error
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+import zlib
+from typing import Dict, List
+
+from client import ConnectionPool, KEY_COMMANDS, split_msetex
+from logconfig import restart_after_fork, stop_logging
+from protocol import Error
+from server import Server, DEFAULT_SHUTDOWN_TIMEOUT
+from storage import CommandError
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_MODES = ('forward', 'redirect')
+
+# Commands without keys that every worker runs on its own partition.
+BROADCAST_COMMANDS = frozenset(('FLUSH', 'SAVE', 'BGSAVE', 'BGREWRITEAOF'))
+
+# A worker that dies sooner than this after starting is restarted only after
+# the same delay, so a crash loop does not spin the supervisor.
+RESTART_DELAY = 1.0
+
+PEER_POOL_SIZE = 8
+
+# Marks a request that the receiving worker owns and runs itself.
+_LOCAL = object()
+
+def key_slot(key, partitions: int) -> int:
+    """Partition owning ``key``; stable across processes, unlike hash()."""
+    if not isinstance(key, bytes):
+        key = str(key).encode('utf-8')
+    return zlib.crc32(key) % partitions
+
+def peer_socket_path(socket_dir: str, index: int) -> str:
+    return os.path.join(socket_dir, f'worker-{index}.sock')
+
+def worker_port(port: int, index: int) -> int:
+    """Port on which worker ``index`` accepts connections of its own."""
+    return port + 1 + index if port else 0
+
+class ClusterWorker(Server):
+    """One process of a multi-process server.
+
+    Every worker listens on the shared port with SO_REUSEPORT, so the kernel
+    spreads connections across workers, and also on a port of its own
+    (``port + 1 + index``). A worker stores only the keys whose
+    ``key_slot`` equals its index. Requests for other keys are forwarded to
+    their owner over a Unix socket, or in ``redirect`` mode answered with
+    ``-MOVED <slot> <host>:<port>`` so the client can go to the owner
+    directly. Multi-key commands are split per owner; MSET is therefore not
+    atomic across workers.
+    """
+
+    def __init__(self, index: int, workers: int, socket_dir: str, host='127.0.0.1',
+                 port=31337, mode='forward', **kwargs):
+        if mode not in CLUSTER_MODES:
+            raise ValueError(f'Unknown cluster mode: {mode}')
+        self.index = index
+        self.workers = workers
+        self._socket_dir = socket_dir
+        self._host = host
+        self._base_port = port
+        self._mode = mode
+        # Each worker persists its own partition. Files only match the
+        # partitioning they were written with, so keep the worker count fixed.
+        for option, variable in (('snapshot_path', 'SNAPSHOT_PATH'), ('aof_path', 'AOF_PATH')):
+            path = kwargs.get(option) or os.environ.get(variable)
+            if path:
+                kwargs[option] = f'{path}.{index}-of-{workers}'
+        super().__init__(host, port, **kwargs)
+        self._peers = {
+            i: ConnectionPool(unix_socket_path=peer_socket_path(socket_dir, i),
+                              max_connections=PEER_POOL_SIZE)
+            for i in range(workers) if i != index}
+
+    def _create_listener(self, host, port, max_clients):
+        self._pool = Pool(max_clients)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listener.bind((host, port))
+        listener.listen(1024)
+        self._server = StreamServer(listener, self.connection_handler, spawn=self._pool)
+        self._direct_server = StreamServer(
+            (host, worker_port(port, self.index)), self.connection_handler, spawn=self._pool)
+
+        path = peer_socket_path(self._socket_dir, self.index)
+        if os.path.exists(path):
+            os.unlink(path)
+        peer_listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        peer_listener.bind(path)
+        peer_listener.listen(1024)
+        self._peer_server = StreamServer(peer_listener, self._peer_handler)
+
+    def _peer_handler(self, conn, address):
+        # Forwarded requests are already routed: run them here, never re-route.
+        self.connection_handler(conn, ('worker', self.index), self._process_local)
+
+    # Server.process_request without routing, for requests from peers.
+    _process_local = Server.process_request
+
+    def start(self):
+        """Start the peer and per-worker listeners; ``run`` serves the shared port."""
+        self._peer_server.start()
+        self._direct_server.start()
+
+    def run(self, stop_signals=()):
+        self.start()
+        try:
+            super().run(stop_signals)
+        finally:
+            self._direct_server.stop()
+            self._peer_server.stop()
+            for pool in self._peers.values():
+                pool.close()
+
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        self._direct_server.stop_accepting()
+        super().shutdown(timeout)
+
+    def process_request(self, data, transaction=None):
+        # Requests queued by MULTI are checked to be local, then run here.
+        if transaction is not None and transaction.queue is not None:
+            return self._process_local(data, transaction)
+        try:
+            resp = self._route(data)
+        except CommandError as exc:
+            self._stats.error_replies += 1
+            return Error(str(exc))
+        if resp is _LOCAL:
+            return self._process_local(data, transaction)
+        return resp
+
+    def _queue_error(self, command, args):
+        if command in BROADCAST_COMMANDS:
+            return f'{command} is not allowed in a transaction with several workers'
+        if command == 'MGET':
+            keys = args
+        elif command in ('MSET', 'MSETNX'):
+            keys = args[::2]
+        elif command == 'MSETEX':
+            keys = (split_msetex(args) or ((), ()))[0][::2]
+        elif command == 'MEMORY':
+            keys = args[1:2]
+        elif command in KEY_COMMANDS:
+            keys = args[:1]
+        else:
+            keys = ()
+        if any(self.owner(key) != self.index for key in keys):
+            return f'CROSSSLOT {command} uses a key owned by another worker'
+        return super()._queue_error(command, args)
+
+    def watch(self, *keys):
+        if any(self.owner(key) != self.index for key in keys):
+            raise CommandError('CROSSSLOT WATCH uses a key owned by another worker')
+        return super().watch(*keys)
+
+    def owner(self, key) -> int:
+        return key_slot(key, self.workers)
+
+    def _route(self, data):
+        if not isinstance(data, (list, tuple)) or not data:
+            return _LOCAL
+        name = data[0]
+        if isinstance(name, bytes):
+            name = name.decode('utf-8', 'replace')
+        command = str(name).upper()
+        args = list(data[1:])
+        if self._encoded_values:
+            args = self._decode_arguments(command, args)
+
+        if command in KEY_COMMANDS and args:
+            return self._single(self.owner(args[0]), [command] + args)
+        if command == 'MEMORY' and len(args) == 2 and str(args[0]).upper() == 'USAGE':
+            return self._single(self.owner(args[1]), [command] + args)
+        if command == 'MGET' and args:
+            return self._mget(args)
+        if command == 'MSET':
+            return self._mset(args)
+        if command == 'MSETEX':
+            return self._msetex(args)
+        if command == 'MSETNX' and args:
+            # All or nothing cannot span processes: the keys must share a worker.
+            owners = {self.owner(key) for key in args[::2]}
+            if len(owners) > 1:
+                raise CommandError("CROSSSLOT MSETNX keys don't hash to the same worker")
+            return self._single(owners.pop(), [command] + args)
+        if command in BROADCAST_COMMANDS:
+            return self._broadcast(command)
+        return _LOCAL
+
+    def _single(self, owner: int, data):
+        if owner == self.index:
+            return _LOCAL
+        if self._mode == 'redirect':
+            return Error(f'MOVED {owner} {self._host}:{worker_port(self._base_port, owner)}')
+        return self._forward(owner, data)
+
+    def _split(self, command, groups: Dict[int, List]):
+        """Run one sub-request per owner, concurrently, and map owner -> reply."""
+        if self._mode == 'redirect':
+            if len(groups) > 1:
+                raise CommandError(f"CROSSSLOT {command} keys don't hash to the same worker")
+            owner, args = next(iter(groups.items()))
+            raise CommandError(self._single(owner, [command] + args).message)
+        jobs = {owner: gevent.spawn(self._forward, owner, [command] + args)
+                for owner, args in groups.items() if owner != self.index}
+        replies = {}
+        if self.index in groups:
+            replies[self.index] = self._process_local([command] + groups[self.index])
+        gevent.joinall(list(jobs.values()))
+        for owner, job in jobs.items():
+            replies[owner] = job.value
+        for reply in replies.values():
+            if isinstance(reply, Error):
+                raise CommandError(reply.message)
+        return replies
+
+    def _mget(self, keys):
+        owners = [self.owner(key) for key in keys]
+        if all(owner == self.index for owner in owners):
+            return _LOCAL
+        groups = {}
+        for key, owner in zip(keys, owners):
+            groups.setdefault(owner, []).append(key)
+        replies = self._split('MGET', groups)
+        values = {owner: iter(reply) for owner, reply in replies.items()}
+        return [next(values[owner]) for owner in owners]
+
+    def _pairs_by_owner(self, items) -> Dict[int, List]:
+        groups = {}
+        for key, value in zip(items[::2], items[1::2]):
+            groups.setdefault(self.owner(key), []).extend((key, value))
+        return groups
+
+    def _mset(self, items):
+        if len(items) % 2 != 0:
+            return _LOCAL  # let the local command report the error
+        groups = self._pairs_by_owner(items)
+        if list(groups) == [self.index]:
+            return _LOCAL
+        return sum(self._split('MSET', groups).values())
+
+    def _msetex(self, args):
+        # The key count and the option are read once, here; each worker
+        # then gets an MSETEX of its own pairs with the same option.
+        parsed = split_msetex(args)
+        if parsed is None:
+            return _LOCAL  # let the local command report the error
+        items, options = parsed
+        groups = self._pairs_by_owner(items)
+        if list(groups) == [self.index]:
+            return _LOCAL
+        for owner, pairs in groups.items():
+            groups[owner] = [len(pairs) // 2] + pairs + options
+        return sum(self._split('MSETEX', groups).values())
+
+    def _broadcast(self, command):
+        """Run ``command`` here and on every peer; FLUSH counts are summed."""
+        reply = self._process_local([command])
+        for owner in self._peers:
+            if isinstance(reply, Error):
+                return reply
+            peer_reply = self._forward(owner, [command])
+            if isinstance(peer_reply, Error):
+                return peer_reply
+            if command == 'FLUSH':
+                reply += peer_reply
+        return reply
+
+    def _forward(self, owner: int, data):
+        try:
+            with self._peers[owner].connection() as client:
+                return client.execute(*data)
+        except CommandError as exc:
+            return Error(str(exc))
+        except socket_error as exc:
+            logger.error('Worker %d unreachable: %s', owner, exc)
+            return Error(f'Worker {owner} unavailable')
+
+class Supervisor:
+    """Forks ``workers`` ClusterWorker processes and restarts any that die.
+
+    Data held by a worker that crashes is lost; its replacement starts with
+    an empty partition.
+    """
+
+    def __init__(self, workers: int, host='127.0.0.1', port=31337, mode='forward',
+                 restart_delay=RESTART_DELAY, **server_kwargs):
+        if mode not in CLUSTER_MODES:
+            raise ValueError(f'Unknown cluster mode: {mode}')
+        self.workers = workers
+        self._host = host
+        self._port = port
+        self._mode = mode
+        self._restart_delay = restart_delay
+        self._server_kwargs = server_kwargs
+        self._socket_dir = None
+        self._children: Dict[int, int] = {}  # pid -> worker index
+        self._started: Dict[int, float] = {}  # worker index -> start time
+        self._stopping = False
+
+    def run(self):
+        self._socket_dir = tempfile.mkdtemp(prefix='kvstore-')
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info('Starting %d workers on %s:%s (%s mode)',
+                    self.workers, self._host, self._port, self._mode)
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+            while self._children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                self._reap(pid, status)
+        finally:
+            self.stop()
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+    def stop(self, *args):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, index: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                # Shutdown is driven by the supervisor's SIGTERM, which
+                # drains the worker's connections before it exits.
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                restart_after_fork()
+                worker = ClusterWorker(index, self.workers, self._socket_dir, self._host,
+                                       self._port, self._mode, **self._server_kwargs)
+                worker.run(stop_signals=(signal.SIGTERM,))
+            except BaseException:
+                logger.exception('Worker %d failed', index)
+                code = 1
+            finally:
+                stop_logging()
+                os._exit(code)
+        logger.info('Worker %d started with pid %d', index, pid)
+        self._children[pid] = index
+        self._started[index] = time.monotonic()
+        return pid
+
+    def _reap(self, pid: int, status: int):
+        index = self._children.pop(pid, None)
+        if index is None or self._stopping:
+            return
+        logger.warning('Worker %d (pid %d) exited with status %d; restarting',
+                       index, pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - self._started[index] < self._restart_delay:
+            time.sleep(self._restart_delay)
+        self._spawn(index)
@@ -0,0 +1,153 @@
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import sys
+import time
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Records waiting for the writer thread. When it falls this far behind,
+# new records are dropped and counted rather than blocking the server.
+QUEUE_SIZE = 10000
+
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_COMMAND_SAMPLE = 100
+
+_listener: Optional[QueueListener] = None
+# Writer handlers a forked child inherited and now logs to directly.
+_inherited = []
+
+class DeferredQueueHandler(QueueHandler):
+    """Puts records on a bounded queue without formatting them.
+
+    The stock QueueHandler formats each record before queueing it, which
+    leaves the formatting on the caller. Here only a traceback is rendered
+    up front, since it refers to live frames; the writer does the rest.
+    """
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _parse_level(value: str) -> int:
+    level = logging.getLevelName(value.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(f'Unknown log level: {value}')
+    return level
+
+def configure_logging(level: Optional[str] = None, stream=None) -> QueueListener:
+    """Send all logging through a queue to a background writer thread.
+
+    ``level`` defaults to LOG_LEVEL (INFO). LOG_LEVELS sets individual
+    loggers, e.g. ``aof=DEBUG,replication=WARNING``.
+    """
+    global _inherited
+    stop_logging()
+    _inherited = []
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(_parse_level(level or os.environ.get('LOG_LEVEL', 'INFO')))
+    for item in filter(None, os.environ.get('LOG_LEVELS', '').split(',')):
+        name, _, value = item.partition('=')
+        logging.getLogger(name.strip()).setLevel(_parse_level(value))
+
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(logging.Formatter(LOG_FORMAT))
+    return _start([writer])
+
+def _start(handlers) -> QueueListener:
+    global _listener
+    handler = DeferredQueueHandler(queue.Queue(QUEUE_SIZE))
+    logging.getLogger().addHandler(handler)
+    _listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def restart_after_fork() -> None:
+    """Give a long-lived forked child, such as a worker, its own writer thread."""
+    global _inherited
+    if _listener is not None or not _inherited:
+        return
+    root = logging.getLogger()
+    for handler in _inherited:
+        root.removeHandler(handler)
+    handlers, _inherited = _inherited, []
+    _start(handlers)
+
+def stop_logging() -> None:
+    """Write out everything queued; call before ``os._exit`` in a child."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _write_directly_in_child():
+    # A forked child has the queue but not the writer thread, so it logs
+    # straight to the writer's handlers until restart_after_fork.
+    global _listener, _inherited
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, DeferredQueueHandler):
+            root.removeHandler(handler)
+    _inherited = list(_listener.handlers)
+    for handler in _inherited:
+        root.addHandler(handler)
+    _listener = None
+
+os.register_at_fork(after_in_child=_write_directly_in_child)
+atexit.register(stop_logging)
+
+class SampledLogger:
+    """Logs one in ``every`` calls and at most ``per_second`` lines a second.
+
+    Meant for per-command and per-connection messages: when the level is
+    disabled a call costs one level check, and a burst cannot flood the log.
+    ``suppressed`` counts calls dropped by the rate limit.
+    """
+
+    def __init__(self, logger: logging.Logger, level: int = logging.DEBUG, every: int = 1,
+                 per_second: Optional[int] = None):
+        self._logger = logger
+        self._level = level
+        self._every = max(every, 1)
+        if per_second is None:
+            per_second = int(os.environ.get('LOG_RATE_LIMIT', DEFAULT_RATE_LIMIT))
+        self._per_second = per_second
+        self._calls = 0
+        self._window_end = 0.0
+        self._in_window = 0
+        self.suppressed = 0
+
+    def log(self, msg: str, *args) -> None:
+        if not self._logger.isEnabledFor(self._level):
+            return
+        self._calls += 1
+        if self._calls % self._every:
+            return
+        now = time.monotonic()
+        if now >= self._window_end:
+            self._window_end = now + 1.0
+            self._in_window = 0
+        if self._in_window >= self._per_second:
+            self.suppressed += 1
+            return
+        self._in_window += 1
+        self._logger.log(self._level, msg, *args)
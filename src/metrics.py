@@ -0,0 +1,310 @@
+from collections import deque
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+# Values below this many microseconds get a bucket each; above it every
+# power of two is split into this many buckets, so a reported percentile
+# is within 1/SUB_BUCKETS (~1.6%) of the true value.
+SUB_BUCKETS = 64
+_SUB_BITS = SUB_BUCKETS.bit_length() - 1
+
+# Enough buckets for latencies up to 2**40 microseconds (about 12 days).
+_MAX_EXPONENT = 40
+_MAX_MICROS = (1 << _MAX_EXPONENT) - 1
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+# Upper bounds, in seconds, of the buckets exported to Prometheus.
+EXPORT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                  0.25, 0.5, 1.0, 2.5)
+
+class LatencyHistogram:
+    """Fixed-size log-linear histogram of latencies, in the spirit of HdrHistogram.
+
+    ``record`` is O(1) and allocation-free, so it can sit on the request
+    path. Histograms from several workers combine with ``merge``.
+    """
+
+    def __init__(self):
+        self._counts = [0] * (SUB_BUCKETS * (_MAX_EXPONENT - _SUB_BITS + 2))
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    @staticmethod
+    def _index(micros: int) -> int:
+        if micros < SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - _SUB_BITS - 1
+        return SUB_BUCKETS * shift + (micros >> shift)
+
+    @staticmethod
+    def _value(index: int) -> float:
+        """Midpoint of a bucket, in microseconds."""
+        if index < SUB_BUCKETS:
+            return float(index)
+        shift, offset = divmod(index, SUB_BUCKETS)
+        shift -= 1
+        return ((SUB_BUCKETS + offset) << shift) + ((1 << shift) - 1) / 2
+
+    def record(self, seconds: float, count: int = 1) -> None:
+        # _index inlined: this runs once per command.
+        micros = int(seconds * 1e6)
+        if micros < SUB_BUCKETS:
+            index = micros if micros > 0 else 0
+        else:
+            if micros > _MAX_MICROS:
+                micros = _MAX_MICROS
+            shift = micros.bit_length() - _SUB_BITS - 1
+            index = SUB_BUCKETS * shift + (micros >> shift)
+        self._counts[index] += count
+        self.count += count
+        self.total += seconds * count
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: 'LatencyHistogram') -> 'LatencyHistogram':
+        for index, count in enumerate(other._counts):
+            if count:
+                self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        return self
+
+    def percentile(self, percent: float) -> float:
+        """Latency in seconds below which ``percent`` of the samples fall."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                value = self._value(index) / 1e6
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def cumulative(self, bounds: Iterable[float] = EXPORT_BUCKETS) -> Dict[float, int]:
+        """Samples at or below each bound in seconds, as Prometheus buckets count them.
+
+        Each sample counts by its bucket's midpoint, so a bound splits at
+        most one bucket the wrong way.
+        """
+        result = {}
+        index = seen = 0
+        for bound in sorted(bounds):
+            limit = bound * 1e6
+            while index < len(self._counts) and self._value(index) <= limit:
+                seen += self._counts[index]
+                index += 1
+            result[bound] = seen
+        return result
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+        """Count plus min/mean/max and percentiles, all in milliseconds."""
+        result = {
+            'count': self.count,
+            'min': round((self.min or 0.0) * 1e3, 4),
+            'mean': round(self.mean * 1e3, 4),
+            'max': round((self.max or 0.0) * 1e3, 4),
+        }
+        for percent in percentiles:
+            result['p%s' % format(percent, 'g').replace('.', '')] = round(
+                self.percentile(percent) * 1e3, 4)
+        return result
+
+class CommandStats:
+    """Failures and latency of one command; the histogram counts the calls."""
+    __slots__ = ('errors', 'histogram')
+
+    def __init__(self):
+        self.errors = 0
+        self.histogram = LatencyHistogram()
+
+    @property
+    def calls(self) -> int:
+        return self.histogram.count
+
+class ServerStats:
+    """Counters the server keeps while it runs, reported by INFO.
+
+    Everything here is a plain attribute increment or a histogram record,
+    so it stays on all the time.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.commands: Dict[str, CommandStats] = {}
+        self.connections_received = 0
+        self.rejected_connections = 0
+        self.error_replies = 0
+        self.connected_clients = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, command: str, seconds: float, failed: bool = False) -> None:
+        stats = self.commands.get(command)
+        if stats is None:
+            stats = self.commands[command] = CommandStats()
+        if failed:
+            stats.errors += 1
+        stats.histogram.record(seconds)
+
+    def command_info(self) -> Dict[str, Any]:
+        return {command.lower(): {
+            'calls': stats.calls,
+            'errors': stats.errors,
+            'usec': round(stats.histogram.total * 1e6),
+            'usec_per_call': round(stats.histogram.mean * 1e6, 2),
+        } for command, stats in sorted(self.commands.items())}
+
+    def latency_info(self) -> Dict[str, Any]:
+        return {command.lower(): stats.histogram.summary()
+                for command, stats in sorted(self.commands.items())}
+
+    def histogram_info(self) -> Dict[str, Any]:
+        """Cumulative bucket counts per command, keyed by the bound in seconds."""
+        return {command.lower(): {
+            'buckets': {format(bound, 'g'): count
+                        for bound, count in stats.histogram.cumulative().items()},
+            'count': stats.histogram.count,
+            'sum': stats.histogram.total,
+        } for command, stats in sorted(self.commands.items())}
+
+# (metric name, type, INFO section, INFO field, help text)
+_INFO_METRICS = (
+    ('uptime_seconds', 'gauge', 'server', 'uptime_in_seconds', 'Seconds since the server started'),
+    ('connected_clients', 'gauge', 'clients', 'connected_clients', 'Open client connections'),
+    ('max_clients', 'gauge', 'clients', 'max_clients', 'Maximum client connections'),
+    ('keys', 'gauge', 'keyspace', 'keys', 'Keys in the store'),
+    ('expires', 'gauge', 'keyspace', 'expires', 'Keys with a TTL'),
+    ('used_memory_bytes', 'gauge', 'memory', 'used_memory', 'Estimated memory used by the store'),
+    ('max_memory_bytes', 'gauge', 'memory', 'max_memory', 'Memory limit of the store'),
+    ('connections_received_total', 'counter', 'stats', 'total_connections_received',
+     'Connections accepted'),
+    ('rejected_connections_total', 'counter', 'stats', 'rejected_connections',
+     'Connections refused at the client limit'),
+    ('commands_processed_total', 'counter', 'stats', 'total_commands_processed', 'Commands run'),
+    ('error_replies_total', 'counter', 'stats', 'total_error_replies',
+     'Requests answered with an error'),
+    ('evicted_keys_total', 'counter', 'stats', 'evicted_keys',
+     'Keys evicted to stay under the memory limit'),
+    ('expired_keys_total', 'counter', 'stats', 'expired_keys',
+     'Keys removed because their TTL passed'),
+    ('net_input_bytes_total', 'counter', 'stats', 'total_net_input_bytes', 'Bytes read from clients'),
+    ('net_output_bytes_total', 'counter', 'stats', 'total_net_output_bytes',
+     'Bytes written to clients'),
+)
+
+def _metric(lines: List[str], name: str, kind: str, help_text: str, samples) -> None:
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+        lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+def prometheus_text(info: Dict[str, Any], pool: Optional[Dict[str, Any]] = None,
+                    prefix: str = 'kvstore') -> str:
+    """Render the output of ``INFO all`` in the Prometheus text format.
+
+    ``pool`` adds the HTTP API's connection pool, as reported by
+    ``ConnectionPool.stats``.
+    """
+    lines: List[str] = []
+    for name, kind, section, field, help_text in _INFO_METRICS:
+        _metric(lines, f'{prefix}_{name}', kind, help_text, [((), info[section][field])])
+
+    commands = info.get('commandstats', {})
+    _metric(lines, f'{prefix}_command_calls_total', 'counter', 'Calls per command',
+            [((('command', name),), stats['calls']) for name, stats in commands.items()])
+    _metric(lines, f'{prefix}_command_errors_total', 'counter', 'Failed calls per command',
+            [((('command', name),), stats['errors']) for name, stats in commands.items()])
+
+    histograms = info.get('histograms', {})
+    name = f'{prefix}_command_duration_seconds'
+    lines.append(f'# HELP {name} Time spent running each command')
+    lines.append(f'# TYPE {name} histogram')
+    for command, histogram in histograms.items():
+        for bound, count in histogram['buckets'].items():
+            lines.append(f'{name}_bucket{{command="{command}",le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{command="{command}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{command="{command}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{command="{command}"}} {histogram["count"]}')
+
+    if pool is not None:
+        for key, kind in (('max_connections', 'gauge'), ('in_use', 'gauge'), ('idle', 'gauge'),
+                          ('created', 'counter'), ('waits', 'counter'), ('timeouts', 'counter')):
+            metric = f'{prefix}_client_pool_{key}' + ('_total' if kind == 'counter' else '')
+            _metric(lines, metric, kind, f'HTTP API connection pool: {key.replace("_", " ")}',
+                    [((), pool[key])])
+    return '\n'.join(lines) + '\n'
+
+# Slow log entries keep at most this many arguments, each cut to this many
+# characters, so a huge MSET does not pin its payload in memory.
+SLOWLOG_MAX_ARGS = 32
+SLOWLOG_MAX_ARG_LEN = 128
+
+class SlowLog:
+    """Bounded ring buffer of commands that ran longer than ``threshold`` seconds.
+
+    A negative threshold disables it; zero logs every command.
+    """
+
+    def __init__(self, threshold: float = 0.01, max_len: int = 128):
+        self.threshold = threshold if threshold >= 0 else math.inf
+        self._entries = deque(maxlen=max_len)
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, request, seconds: float, client=None) -> None:
+        self._entries.append((self._next_id, int(time.time()), round(seconds * 1e6),
+                              self._truncate(request), client))
+        self._next_id += 1
+
+    def get(self, count: int = 10) -> List[Dict[str, Any]]:
+        """The ``count`` most recent entries, newest first; all of them if negative."""
+        entries = list(reversed(self._entries))
+        if count >= 0:
+            entries = entries[:count]
+        return [{
+            'id': entry_id,
+            'timestamp': timestamp,
+            'duration_us': duration,
+            'command': args,
+            'client': f'{client[0]}:{client[1]}' if client else '',
+        } for entry_id, timestamp, duration, args, client in entries]
+
+    def reset(self) -> None:
+        self._entries.clear()
+
+    @staticmethod
+    def _truncate(request) -> List[str]:
+        if isinstance(request, (str, bytes)):
+            request = request.split()
+        args = []
+        for arg in request[:SLOWLOG_MAX_ARGS]:
+            if isinstance(arg, (bytes, bytearray)):
+                arg = bytes(arg).decode('utf-8', 'replace')
+            elif not isinstance(arg, str):
+                arg = repr(arg)
+            if len(arg) > SLOWLOG_MAX_ARG_LEN:
+                extra = len(arg) - SLOWLOG_MAX_ARG_LEN
+                arg = f'{arg[:SLOWLOG_MAX_ARG_LEN]}... ({extra} more characters)'
+            args.append(arg)
+        if len(request) > SLOWLOG_MAX_ARGS:
+            args[-1] = f'... ({len(request) - SLOWLOG_MAX_ARGS + 1} more arguments)'
+        return args
@@ -0,0 +1,150 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, Optional
+
+from storage import CommandError
+
+logger = logging.getLogger(__name__)
+
+# Sessions stop on their own after this long unless START asks for a
+# different duration, and can never run longer than the maximum, so a
+# forgotten session does not keep slowing the server down.
+DEFAULT_SESSION_SECONDS = 60
+MAX_SESSION_SECONDS = 600
+
+DEFAULT_TOP = 30
+
+def dump_path(kind: str, suffix: str) -> str:
+    """A fresh file under DEBUG_DUMP_DIR; clients never choose the path."""
+    directory = os.environ.get('DEBUG_DUMP_DIR', tempfile.gettempdir())
+    return os.path.join(directory, f'kvstore-{kind}-{os.getpid()}-{int(time.time() * 1000)}{suffix}')
+
+def session_seconds(value) -> float:
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise CommandError('Duration is not a number')
+    if not 0 < seconds <= MAX_SESSION_SECONDS:
+        raise CommandError(f'Duration must be between 0 and {MAX_SESSION_SECONDS} seconds')
+    return seconds
+
+class Profiler:
+    """cProfile session covering every connection the server handles.
+
+    The profiler hooks the whole thread, so while it runs it sees each
+    greenlet or protocol callback serving a connection. Results stay
+    available after the session ends until the next ``start``.
+    """
+
+    def __init__(self):
+        self._profile: Optional[cProfile.Profile] = None
+        self.running = False
+        self.deadline = None
+
+    def start(self, seconds: float = DEFAULT_SESSION_SECONDS) -> float:
+        if self.running:
+            raise CommandError('Profiler already running')
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self.running = True
+        self.deadline = time.monotonic() + seconds
+        logger.warning('Profiling started for up to %.0fs', seconds)
+        return seconds
+
+    def expire(self) -> None:
+        """End the session if its time is up; called by the server's timer."""
+        if self.running and time.monotonic() >= self.deadline:
+            self._disable()
+            logger.warning('Profiling stopped after its time limit')
+
+    def stop(self, limit: int = DEFAULT_TOP) -> str:
+        """End the session and return the top functions by cumulative time."""
+        if self._profile is None:
+            raise CommandError('Profiler was not started')
+        if self.running:
+            self._disable()
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    def dump(self) -> str:
+        """Write the last session's stats for pstats or snakeviz; returns the path."""
+        if self._profile is None:
+            raise CommandError('Profiler was not started')
+        if self.running:
+            self._disable()
+        path = dump_path('profile', '.prof')
+        self._profile.dump_stats(path)
+        return path
+
+    def _disable(self) -> None:
+        self._profile.disable()
+        self.running = False
+
+class MemoryTracer:
+    """tracemalloc session with snapshots of the largest allocation sites.
+
+    Each snapshot after the first also reports what grew since the one
+    before it, which is how a leak shows up.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.deadline = None
+        self._previous = None
+
+    def start(self, seconds: float = DEFAULT_SESSION_SECONDS, frames: int = 1) -> float:
+        if tracemalloc.is_tracing():
+            raise CommandError('Memory tracing already running')
+        tracemalloc.start(frames)
+        self.running = True
+        self.deadline = time.monotonic() + seconds
+        self._previous = None
+        logger.warning('Memory tracing started for up to %.0fs', seconds)
+        return seconds
+
+    def expire(self) -> None:
+        if self.running and time.monotonic() >= self.deadline:
+            self.stop()
+            logger.warning('Memory tracing stopped after its time limit')
+
+    def stop(self) -> None:
+        if not self.running:
+            raise CommandError('Memory tracing was not started')
+        tracemalloc.stop()
+        self.running = False
+        self._previous = None
+
+    def snapshot(self, limit: int = DEFAULT_TOP) -> Dict[str, Any]:
+        snapshot = self._take()
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            'traced_memory': current,
+            'peak_traced_memory': peak,
+            'top': [str(stat) for stat in snapshot.statistics('lineno')[:limit]],
+        }
+        if self._previous is not None:
+            growth = snapshot.compare_to(self._previous, 'lineno')
+            result['growth'] = [str(stat) for stat in growth[:limit] if stat.size_diff > 0]
+        self._previous = snapshot
+        return result
+
+    def dump(self) -> str:
+        """Write a snapshot loadable with ``tracemalloc.Snapshot.load``; returns the path."""
+        path = dump_path('memory', '.tracemalloc')
+        self._take().dump(path)
+        return path
+
+    def _take(self) -> tracemalloc.Snapshot:
+        if not self.running:
+            raise CommandError('Memory tracing was not started')
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
@@ -1,5 +1,4 @@
 from collections import namedtuple
-from io import BytesIO
 from typing import Any, Dict, List, Optional, Union
 import logging
 
@@ -15,6 +14,195 @@ class Disconnect(Exception):
     """Raised when a client disconnects."""
     pass
 
+class Encoded(bytes):
+    """A value that is already RESP-encoded and is written out verbatim."""
+
+class SimpleString(str):
+    """A reply sent as a RESP simple string (``+OK``) instead of a bulk string."""
+
+OK = SimpleString('OK')
+
+# Returned by RespParser.gets when the buffer ends before a complete value.
+INCOMPLETE = object()
+
+# Longest header line (type byte plus length or integer) accepted before
+# the input is rejected as malformed.
+MAX_LINE_LENGTH = 64 * 1024
+
+class RespParser:
+    """Incremental, non-recursive RESP parser over a growable bytearray.
+
+    Input is added with ``feed`` or read straight from a socket into the
+    buffer with ``recv_from``. ``gets`` returns the next complete value, or
+    ``INCOMPLETE`` if the buffer ends mid-frame; it never blocks. Partially
+    received arrays are kept on an explicit stack, so a large frame arriving
+    in many chunks is parsed once rather than restarted, and nesting depth is
+    not limited by the interpreter's recursion limit.
+
+    Bulk strings are decoded with ``encoding`` when they are valid text and
+    left as bytes otherwise; pass ``encoding=None`` to always get bytes.
+    """
+
+    def __init__(self, encoding: Optional[str] = 'utf-8', chunk_size: int = 65536):
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        self._buf = bytearray(chunk_size)
+        self._pos = 0  # start of unparsed input
+        self._end = 0  # end of received input
+        self._stack: List[list] = []  # [items, remaining, type byte]
+
+    def buffered(self) -> int:
+        return self._end - self._pos
+
+    def reset(self) -> None:
+        self._pos = self._end = 0
+        self._stack.clear()
+
+    def _reserve(self, size: int) -> None:
+        """Make room for at least ``size`` more bytes after ``_end``."""
+        if self._pos:
+            remaining = self._end - self._pos
+            self._buf[:remaining] = self._buf[self._pos:self._end]
+            self._pos, self._end = 0, remaining
+        missing = size - (len(self._buf) - self._end)
+        if missing > 0:
+            self._buf.extend(bytes(missing))
+
+    def feed(self, data: bytes) -> None:
+        self._reserve(len(data))
+        self._buf[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def recv_from(self, sock) -> int:
+        """Read once from ``sock`` into the buffer; returns 0 at EOF."""
+        if len(self._buf) - self._end < self._chunk_size:
+            self._reserve(self._chunk_size)
+        view = memoryview(self._buf)[self._end:]
+        try:
+            received = sock.recv_into(view)
+        finally:
+            view.release()
+        self._end += received
+        return received
+
+    def _read_bulk_run(self, items: list, count: int, pos: int) -> int:
+        """Append up to ``count`` consecutive complete bulk strings to ``items``.
+
+        Stops early at any other element type or at the end of the buffer
+        and returns the position after the last string consumed.
+        """
+        buf, end, encoding = self._buf, self._end, self._encoding
+        find = buf.find
+        append = items.append
+        while count and pos < end and buf[pos] == 0x24:
+            crlf = find(b'\r\n', pos, end)
+            if crlf == -1:
+                break
+            try:
+                length = int(buf[pos + 1:crlf])
+            except ValueError:
+                break  # let the general parser report it
+            if length < 0:
+                append(None)
+                pos = crlf + 2
+            else:
+                start = crlf + 2
+                stop = start + length
+                if stop + 2 > end:
+                    break
+                value = buf[start:stop]
+                if encoding is not None:
+                    try:
+                        value = value.decode(encoding)
+                    except UnicodeDecodeError:
+                        value = bytes(value)
+                else:
+                    value = bytes(value)
+                append(value)
+                pos = stop + 2
+            count -= 1
+        return pos
+
+    def gets(self) -> Any:
+        buf, end, stack, encoding = self._buf, self._end, self._stack, self._encoding
+        find = buf.find
+        pos = self._pos  # always the start of the next unparsed element
+        view = memoryview(buf)
+        try:
+            while pos < end:
+                crlf = find(b'\r\n', pos, end)
+                if crlf == -1:
+                    if end - pos > MAX_LINE_LENGTH:
+                        raise ProtocolError('Protocol line too long')
+                    return INCOMPLETE
+
+                kind = buf[pos]
+                try:
+                    if kind == 0x24:  # $ bulk string
+                        length = int(buf[pos + 1:crlf])
+                        if length < 0:
+                            value = None
+                            pos = crlf + 2
+                        else:
+                            start = crlf + 2
+                            stop = start + length
+                            if stop + 2 > end:
+                                return INCOMPLETE
+                            if encoding is None:
+                                value = bytes(view[start:stop])
+                            else:
+                                try:
+                                    value = buf[start:stop].decode(encoding)
+                                except UnicodeDecodeError:
+                                    value = bytes(view[start:stop])
+                            pos = stop + 2
+                    elif kind == 0x2a or kind == 0x25:  # * array, % map
+                        count = int(buf[pos + 1:crlf])
+                        pos = crlf + 2
+                        if count > 0:
+                            items = []
+                            if kind == 0x2a:
+                                # Fast path: arrays of bulk strings, i.e. commands.
+                                pos = self._read_bulk_run(items, count, pos)
+                                if len(items) == count:
+                                    value = items
+                                    count = 0
+                            if count:
+                                stack.append([items, (count * 2 if kind == 0x25 else count) - len(items), kind])
+                                continue
+                        else:
+                            value = None if count < 0 else ({} if kind == 0x25 else [])
+                    elif kind == 0x3a:  # : integer
+                        value = int(buf[pos + 1:crlf])
+                        pos = crlf + 2
+                    elif kind == 0x2b:  # + simple string
+                        value = str(view[pos + 1:crlf], 'utf-8')
+                        pos = crlf + 2
+                    elif kind == 0x2d:  # - error
+                        value = Error(str(view[pos + 1:crlf], 'utf-8'))
+                        pos = crlf + 2
+                    else:
+                        raise ProtocolError(f'Invalid first byte: {bytes([kind])!r}')
+                except ValueError:
+                    raise ProtocolError(f'Invalid header: {bytes(view[pos:crlf])!r}')
+
+                # Attach the value to its parent, closing every container it completes.
+                while stack:
+                    top = stack[-1]
+                    top[0].append(value)
+                    top[1] -= 1
+                    if top[1]:
+                        break
+                    stack.pop()
+                    items = top[0]
+                    value = items if top[2] == 0x2a else dict(zip(items[::2], items[1::2]))
+                else:
+                    return value
+            return INCOMPLETE
+        finally:
+            self._pos = pos
+            view.release()
+
 class ProtocolHandler:
     """Handles RESP protocol encoding/decoding with support for nested data structures."""
     
@@ -68,16 +256,7 @@ class ProtocolHandler:
         num_elements = int(socket_file.readline().rstrip(b'\r\n'))
         if num_elements == -1:
             return None
-        result = []
-        for _ in range(num_elements):
-            element = self.handle_request(socket_file)
-            if isinstance(element, bytes):
-                try:
-                    element = element.decode('utf-8')
-                except UnicodeDecodeError:
-                    pass
-            result.append(element)
-        return result
+        return [self.handle_request(socket_file) for _ in range(num_elements)]
 
     def handle_dict(self, socket_file) -> Dict:
         num_items = int(socket_file.readline().rstrip(b'\r\n'))
@@ -87,50 +266,149 @@ class ProtocolHandler:
         return dict(zip(elements[::2], elements[1::2]))
 
     def write_response(self, socket_file, data: Any) -> None:
-        buf = BytesIO()
-        self._write(buf, data)
-        buf.seek(0)
-        socket_file.write(buf.getvalue())
+        socket_file.write(self.encode(data))
         socket_file.flush()
 
-    def _write(self, buf: BytesIO, data: Any) -> None:
-        if isinstance(data, str):
-            data = data.encode('utf-8')
-            buf.write(b'$%d\r\n' % len(data))
-            buf.write(data)
-            buf.write(b'\r\n')
-        elif isinstance(data, bytes):
-            buf.write(b'$%d\r\n' % len(data))
-            buf.write(data)
-            buf.write(b'\r\n')
-        elif isinstance(data, int):
-            buf.write(b':%d\r\n' % data)
-        elif isinstance(data, float):
-            str_data = str(data).encode('utf-8')
-            buf.write(b'$%d\r\n' % len(str_data))
-            buf.write(str_data)
-            buf.write(b'\r\n')
-        elif isinstance(data, Error):
-            buf.write(b'-%s\r\n' % data.message.encode('utf-8'))
-        elif isinstance(data, (list, tuple)):
-            if data is None:
-                buf.write(b'*-1\r\n')
-            else:
-                buf.write(b'*%d\r\n' % len(data))
-                for item in data:
-                    self._write(buf, item)
-        elif isinstance(data, dict):
-            if data is None:
-                buf.write(b'%-1\r\n')
+    def encode(self, data: Any) -> bytes:
+        out = bytearray()
+        self.encode_into(out, data)
+        return bytes(out)
+
+    def encode_value(self, value: Any) -> Encoded:
+        """Encode ``value`` once so it can later be sent without re-encoding."""
+        if type(value) is Encoded:
+            return value
+        return Encoded(self.encode(value))
+
+    def encode_into(self, out: bytearray, data: Any) -> None:
+        """Append the RESP encoding of ``data`` to ``out``.
+
+        Scalars are written through a type-keyed dispatch table and nested
+        containers are walked with an explicit stack of iterators.
+        """
+        writer = _WRITERS.get(type(data))
+        if writer is not None:
+            writer(out, data)
+            return
+
+        writers = _WRITERS
+        stack = [iter((data,))]
+        while stack:
+            for item in stack[-1]:
+                item_type = type(item)
+                writer = writers.get(item_type)
+                if writer is not None:
+                    writer(out, item)
+                    continue
+                if item_type is list or item_type is tuple:
+                    kind = list
+                else:
+                    kind = _container_kind(item)
+                if kind is list:
+                    if len(item) >= _STR_ARRAY_MIN and all(type(e) is str for e in item):
+                        _write_str_array(out, item)
+                        continue
+                    out += b'*%d\r\n' % len(item)
+                    stack.append(iter(item))
+                    break
+                if kind is dict:
+                    out += b'%%%d\r\n' % len(item)
+                    stack.append(_dict_items(item))
+                    break
+                _write_fallback(out, item)
             else:
-                buf.write(b'%%%d\r\n' % len(data))
-                for key, value in data.items():
-                    self._write(buf, str(key))
-                    self._write(buf, value)
-        elif data is None:
-            buf.write(b'$-1\r\n')
-        else:
-            str_data = str(data).encode('utf-8')
-            buf.write(b'$%d\r\n' % len(str_data))
-            buf.write(str_data)
-            buf.write(b'\r\n')
\ No newline at end of file
+                stack.pop()
+
+def decode_value(data: bytes) -> Any:
+    """Decode one complete RESP value, such as a stored ``Encoded`` one."""
+    parser = RespParser(chunk_size=len(data))
+    parser.feed(data)
+    value = parser.gets()
+    if value is INCOMPLETE:
+        raise ProtocolError('Incomplete RESP value')
+    return value
+
+def _write_str(out: bytearray, data: str) -> None:
+    data = data.encode('utf-8')
+    out += b'$%d\r\n%s\r\n' % (len(data), data)
+
+def _write_bytes(out: bytearray, data: bytes) -> None:
+    out += b'$%d\r\n%s\r\n' % (len(data), data)
+
+def _write_int(out: bytearray, data: int) -> None:
+    if -2 <= data < _SMALL_INT_LIMIT:
+        out += _SMALL_INTS[data + 2]
+    else:
+        out += b':%d\r\n' % data
+
+def _write_float(out: bytearray, data: float) -> None:
+    _write_str(out, str(data))
+
+def _write_encoded(out: bytearray, data: Encoded) -> None:
+    out += data
+
+def _write_none(out: bytearray, data: None) -> None:
+    out += b'$-1\r\n'
+
+def _write_error(out: bytearray, data: Error) -> None:
+    out += b'-%s\r\n' % data.message.encode('utf-8')
+
+def _write_simple_string(out: bytearray, data: 'SimpleString') -> None:
+    prebuilt = _SIMPLE_STRINGS.get(data)
+    out += prebuilt if prebuilt is not None else b'+%s\r\n' % data.encode('utf-8')
+
+def _write_str_array(out: bytearray, items) -> None:
+    """Fast path for flat arrays of strings: format once and join."""
+    encoded = [item.encode('utf-8') for item in items]
+    out += b'*%d\r\n' % len(encoded)
+    out += b''.join([b'$%d\r\n%s\r\n' % (len(item), item) for item in encoded])
+
+def _container_kind(data: Any) -> Optional[type]:
+    if isinstance(data, Error):  # namedtuple, so check before tuple
+        return None
+    if isinstance(data, (list, tuple)):
+        return list
+    if isinstance(data, dict):
+        return dict
+    return None
+
+def _dict_items(data: Dict):
+    for key, value in data.items():
+        yield str(key)
+        yield value
+
+def _write_fallback(out: bytearray, data: Any) -> None:
+    """Encode values whose exact type is not in the dispatch table."""
+    if isinstance(data, Error):
+        _write_error(out, data)
+    elif isinstance(data, Encoded):
+        _write_encoded(out, data)
+    elif isinstance(data, SimpleString):
+        _write_simple_string(out, data)
+    elif isinstance(data, str):
+        _write_str(out, data)
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        _write_bytes(out, bytes(data))
+    elif isinstance(data, int):
+        out += b':%d\r\n' % data
+    else:
+        _write_str(out, str(data))
+
+_SMALL_INT_LIMIT = 1024
+# Arrays shorter than this are not worth the extra pass of the join fast path.
+_STR_ARRAY_MIN = 8
+_SMALL_INTS = [b':%d\r\n' % i for i in range(-2, _SMALL_INT_LIMIT)]
+_SIMPLE_STRINGS = {reply: b'+%s\r\n' % reply.encode('utf-8')
+                   for reply in ('OK', 'PONG', 'QUEUED')}
+
+_WRITERS = {
+    str: _write_str,
+    bytes: _write_bytes,
+    int: _write_int,
+    bool: _write_int,
+    float: _write_float,
+    type(None): _write_none,
+    Error: _write_error,
+    SimpleString: _write_simple_string,
+    Encoded: _write_encoded,
+}
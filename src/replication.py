@@ -0,0 +1,342 @@
+import gevent
+from gevent import socket
+from gevent.event import Event
+from socket import error as socket_error
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from protocol import ProtocolHandler, RespParser, ProtocolError, Disconnect, INCOMPLETE
+from storage import CommandError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKLOG_SIZE = 1024 * 1024
+
+# Replicas report their offset this often; the primary derives lag from it.
+ACK_INTERVAL = 1.0
+RECONNECT_DELAY = 1.0
+TRANSFER_CHUNK_SIZE = 256 * 1024
+
+def parse_address(value: str):
+    """Turn ``host:port`` (or ``host port``) into a (host, port) tuple."""
+    host, _, port = value.replace(' ', ':').rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise ValueError(f'Invalid replica-of address: {value!r}')
+
+class ReplicationBacklog:
+    """The last ``size`` bytes of the replication stream.
+
+    ``offset`` counts every byte ever appended; a replica that reconnects
+    at an offset still covered here gets the missing bytes instead of a
+    full resync.
+    """
+
+    def __init__(self, size: int = DEFAULT_BACKLOG_SIZE):
+        self.size = size
+        self.offset = 0
+        self._start = 0  # stream offset of _buf[0]
+        self._buf = bytearray()
+
+    def append(self, data: bytes) -> None:
+        self._buf += data
+        self.offset += len(data)
+        excess = len(self._buf) - self.size
+        if excess > 0:
+            del self._buf[:excess]
+            self._start += excess
+
+    def covers(self, offset: int) -> bool:
+        return self._start <= offset <= self.offset
+
+    def read_from(self, offset: int) -> Optional[bytes]:
+        """Bytes from ``offset`` to the end, or None once they were dropped."""
+        if not self.covers(offset):
+            return None
+        return bytes(self._buf[offset - self._start:])
+
+class ReplicaState:
+    """What the primary knows about one connected replica."""
+
+    def __init__(self, address, listening_port: Optional[int]):
+        self.host = address[0]
+        self.port = listening_port or address[1]
+        self.ack_offset = 0
+        self.ack_time = time.time()
+        self.wakeup = Event()
+
+class Primary:
+    """Primary side: feeds the backlog and streams it to replicas.
+
+    The backlog exists only once a replica has connected, so a server
+    without replicas does not pay for encoding the stream.
+    """
+
+    def __init__(self, server, backlog_size: int = DEFAULT_BACKLOG_SIZE):
+        self._server = server
+        self._protocol = ProtocolHandler()
+        self._backlog_size = backlog_size
+        self.replid = os.urandom(20).hex()
+        self.backlog: Optional[ReplicationBacklog] = None
+        self.replicas: List[ReplicaState] = []
+
+    @property
+    def offset(self) -> int:
+        return self.backlog.offset if self.backlog is not None else 0
+
+    def feed(self, command) -> None:
+        if self.backlog is None:
+            return
+        self.backlog.append(self._protocol.encode(command))
+        for replica in self.replicas:
+            replica.wakeup.set()
+
+    def serve(self, conn, address, parser, replid: str, offset: int,
+              listening_port: Optional[int] = None) -> None:
+        """Run a PSYNC connection: sync the replica, then stream writes to it."""
+        if self.backlog is None:
+            self.backlog = ReplicationBacklog(self._backlog_size)
+        if replid == self.replid and self.backlog.covers(offset):
+            logger.info('Partial resync of %s:%s from offset %d', *address, offset)
+            conn.sendall(b'+CONTINUE %s\r\n' % self.replid.encode())
+        else:
+            offset = self._full_sync(conn, address)
+
+        replica = ReplicaState(address, listening_port)
+        replica.ack_offset = offset
+        self.replicas.append(replica)
+        reader = gevent.spawn(self._read_acks, conn, parser, replica)
+        try:
+            while not reader.dead:
+                replica.wakeup.clear()
+                data = self.backlog.read_from(offset)
+                if data is None:
+                    logger.warning('Replica %s:%s fell out of the backlog', *address)
+                    break
+                if data:
+                    conn.sendall(data)
+                    offset += len(data)
+                else:
+                    replica.wakeup.wait(ACK_INTERVAL)
+        finally:
+            reader.kill()
+            self.replicas.remove(replica)
+            logger.info('Replica %s:%s disconnected', *address)
+
+    def info(self) -> Dict[str, Any]:
+        now = time.time()
+        offset = self.offset
+        return {
+            'role': 'master',
+            'replid': self.replid,
+            'offset': offset,
+            'connected_replicas': len(self.replicas),
+            'replicas': [{
+                'host': replica.host,
+                'port': replica.port,
+                'offset': replica.ack_offset,
+                'lag_bytes': offset - replica.ack_offset,
+                'lag_seconds': round(now - replica.ack_time, 3),
+            } for replica in self.replicas],
+        }
+
+    def _full_sync(self, conn, address) -> int:
+        """Send a point-in-time snapshot and return the stream offset it matches.
+
+        The snapshot is written by a forked child so the server keeps
+        serving; writes made meanwhile land in the backlog after ``offset``.
+        """
+        # Only needed once a replica connects, so not imported at startup.
+        import shutil
+        import tempfile
+        from snapshot import write_snapshot
+        offset = self.backlog.offset
+        tmp_dir = tempfile.mkdtemp(prefix='kvsync-')
+        path = os.path.join(tmp_dir, 'sync.kvs')
+        try:
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    write_snapshot(self._server._kv, path)
+                    code = 0
+                finally:
+                    os._exit(code)
+            while True:
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    break
+                gevent.sleep(0.01)
+            if os.waitstatus_to_exitcode(status) != 0:
+                raise CommandError('Snapshot for full resync failed')
+
+            size = os.path.getsize(path)
+            logger.info('Full resync of %s:%s: %d bytes at offset %d', *address, size, offset)
+            conn.sendall(b'+FULLRESYNC %s %d\r\n$%d\r\n' % (self.replid.encode(), offset, size))
+            with open(path, 'rb') as fh:
+                while True:
+                    chunk = fh.read(TRANSFER_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    conn.sendall(chunk)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return offset
+
+    @staticmethod
+    def _read_acks(conn, parser, replica: ReplicaState) -> None:
+        while True:
+            try:
+                request = parser.gets()
+                if request is INCOMPLETE:
+                    if not parser.recv_from(conn):
+                        return
+                    continue
+            except (socket_error, ProtocolError):
+                return
+            if isinstance(request, list) and len(request) == 3:
+                name, subcommand, offset = (
+                    item.decode('utf-8') if isinstance(item, bytes) else str(item)
+                    for item in request)
+                if name.upper() == 'REPLCONF' and subcommand.upper() == 'ACK':
+                    replica.ack_offset = int(offset)
+                    replica.ack_time = time.time()
+
+class ReplicaLink:
+    """Replica side: keeps a connection to the primary and applies its stream.
+
+    The first sync loads a full snapshot. After a disconnect the link asks
+    to continue from the last offset it applied, which the primary grants
+    while that offset is still in its backlog.
+    """
+
+    def __init__(self, server, host: str, port: int, listening_port: Optional[int] = None):
+        self._server = server
+        self.host = host
+        self.port = port
+        self._listening_port = listening_port
+        self._protocol = ProtocolHandler()
+        self.state = 'connect'
+        self.replid = None
+        self.offset = 0
+        self.last_io = None
+        self.full_syncs = 0
+        self.partial_syncs = 0
+        self._sock = None
+
+    def run(self) -> None:
+        while True:
+            try:
+                self._sync()
+            except (socket_error, ProtocolError, Disconnect, CommandError, ValueError) as exc:
+                logger.warning('Replication link to %s:%s lost: %s', self.host, self.port, exc)
+            finally:
+                self._close()
+            self.state = 'connect'
+            gevent.sleep(RECONNECT_DELAY)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'role': 'slave',
+            'master_host': self.host,
+            'master_port': self.port,
+            'master_link_status': 'up' if self.state == 'connected' else 'down',
+            'state': self.state,
+            'replid': self.replid,
+            'offset': self.offset,
+            'last_io_seconds_ago': (round(time.time() - self.last_io, 3)
+                                    if self.last_io is not None else -1),
+            'full_syncs': self.full_syncs,
+            'partial_syncs': self.partial_syncs,
+        }
+
+    def _sync(self) -> None:
+        self.state = 'connecting'
+        self._sock = sock = socket.create_connection((self.host, self.port))
+        fh = sock.makefile('rb')
+        request = ['PSYNC', self.replid or '?', self.offset]
+        if self._listening_port:
+            request.append(self._listening_port)
+        sock.sendall(self._protocol.encode(request))
+
+        self.state = 'sync'
+        line = fh.readline()
+        if not line:
+            raise Disconnect()
+        reply = line.rstrip(b'\r\n').decode('utf-8').split()
+        if reply[0] == '+FULLRESYNC':
+            self._load_snapshot(fh)
+            self.replid, self.offset = reply[1], int(reply[2])
+            self.full_syncs += 1
+        elif reply[0] == '+CONTINUE':
+            self.partial_syncs += 1
+        else:
+            raise CommandError(f'Primary refused to sync: {line!r}')
+        logger.info('Replicating from %s:%s at offset %d', self.host, self.port, self.offset)
+        self.state = 'connected'
+        self.last_io = time.time()
+
+        acks = gevent.spawn(self._send_acks, sock)
+        try:
+            self._stream(fh)
+        finally:
+            acks.kill()
+
+    def _load_snapshot(self, fh) -> None:
+        header = fh.readline()
+        if not header.startswith(b'$'):
+            raise ProtocolError(f'Expected snapshot size, got {header!r}')
+        remaining = int(header[1:])
+        import shutil
+        import tempfile
+        tmp_dir = tempfile.mkdtemp(prefix='kvsync-')
+        path = os.path.join(tmp_dir, 'sync.kvs')
+        try:
+            with open(path, 'wb') as out:
+                while remaining:
+                    chunk = fh.read(min(remaining, TRANSFER_CHUNK_SIZE))
+                    if not chunk:
+                        raise Disconnect()
+                    out.write(chunk)
+                    remaining -= len(chunk)
+            self._server._load_full_sync(path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _stream(self, fh) -> None:
+        parser = RespParser(encoding=None if self._server._encoded_values else 'utf-8')
+        base = self.offset
+        received = 0
+        apply = self._server._apply_replicated
+        while True:
+            chunk = fh.read1(TRANSFER_CHUNK_SIZE)
+            if not chunk:
+                raise Disconnect()
+            parser.feed(chunk)
+            received += len(chunk)
+            self.last_io = time.time()
+            while True:
+                command = parser.gets()
+                if command is INCOMPLETE:
+                    break
+                apply(command)
+                # Only complete commands count towards the offset.
+                self.offset = base + received - parser.buffered()
+
+    def _send_acks(self, sock) -> None:
+        while True:
+            sock.sendall(self._protocol.encode(['REPLCONF', 'ACK', self.offset]))
+            gevent.sleep(ACK_INTERVAL)
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                # shutdown() first: the makefile() reader keeps the socket open.
+                self._sock.shutdown(socket.SHUT_RDWR)
+                self._sock.close()
+            except socket_error:
+                pass
+            self._sock = None
@@ -1,26 +1,187 @@
+import gevent
+from gevent.event import Event
 from gevent.pool import Pool
 from gevent.server import StreamServer
 from socket import error as socket_error
 import logging
+import os
+import signal
+import socket
+import sys
+import time
 from typing import Dict
 
-from protocol import ProtocolHandler, Error, Disconnect, ProtocolError
-from storage import KeyValueStore, CommandError
+from protocol import (ProtocolHandler, RespParser, Error, ProtocolError, INCOMPLETE, OK,
+                      SimpleString, decode_value)
+from logconfig import SampledLogger, configure_logging, DEFAULT_COMMAND_SAMPLE
+from metrics import ServerStats, SlowLog
+from replication import Primary, ReplicaLink, parse_address, DEFAULT_BACKLOG_SIZE
+from storage import KeyValueStore, ShardedKeyValueStore, CommandError, DEFAULT_EVICTION_POLICY
+
+# Persistence (aof, snapshot), profiling and argparse are imported where
+# they are first used, so a server that needs none of them starts faster.
 
 logger = logging.getLogger(__name__)
 
+# Active expiry wakes up this often and never holds the store longer than
+# one slice before yielding back to the event loop.
+ACTIVE_EXPIRE_INTERVAL = 0.1
+ACTIVE_EXPIRE_SLICE = 0.002
+
+DEFAULT_SHARDS = 16
+
+# Commands slower than this many microseconds go to the slow log, which
+# keeps the most recent DEFAULT_SLOWLOG_MAX_LEN of them.
+DEFAULT_SLOWLOG_THRESHOLD_US = 10000
+DEFAULT_SLOWLOG_MAX_LEN = 128
+
+# On shutdown, connections get this many seconds to finish the requests
+# they already sent before they are closed.
+DEFAULT_SHUTDOWN_TIMEOUT = 10
+
+# How often the server reaps finished background saves and log rewrites,
+# fsyncs the log under the everysec policy and checks whether a periodic
+# snapshot is due.
+PERSISTENCE_INTERVAL = 0.25
+
+# Replies queued for one connection are written out once they reach this
+# size, so a client that pipelines faster than it reads applies backpressure
+# instead of growing the server's memory.
+DEFAULT_MAX_OUTPUT_BUFFER = 64 * 1024
+
+# Which arguments (indexed after the command name) carry values. When the
+# store keeps values pre-encoded, requests are parsed without decoding and
+# only the other arguments (keys, options, numbers) are decoded to text.
+VALUE_ARGUMENTS = {
+    'SET': lambda i: i == 1,
+    'MSET': lambda i: i % 2 == 1,
+    'MSETEX': lambda i: i > 0 and i % 2 == 0,
+    'GETSET': lambda i: i == 1,
+    'SETNX': lambda i: i == 1,
+    'MSETNX': lambda i: i % 2 == 1,
+}
+
+# Commands a replica refuses from clients; it only applies them from its primary.
+WRITE_COMMANDS = frozenset(('SET', 'MSET', 'MSETEX', 'DELETE', 'FLUSH', 'EXPIRE', 'PEXPIRE', 'EXPIREAT',
+                            'PEXPIREAT', 'PERSIST', 'HSET', 'HDEL', 'LPUSH', 'RPUSH', 'LPOP',
+                            'RPOP', 'SADD', 'SREM', 'INCR', 'DECR', 'INCRBY', 'DECRBY',
+                            'INCRBYFLOAT', 'GETSET', 'SETNX', 'MSETNX'))
+
+QUEUED = SimpleString('QUEUED')
+
+# Sections INFO reports when called without arguments. ``all`` adds
+# per-command latency histograms, which are what /metrics exports.
+INFO_SECTIONS = ('server', 'clients', 'memory', 'keyspace', 'persistence', 'stats',
+                 'replication', 'commandstats', 'latencystats')
+
+class Takeover:
+    """Reply of a command that takes over its connection, such as PSYNC.
+
+    Instead of encoding it, the connection handler sends any pending replies
+    and hands the socket and its parser to ``handler``.
+    """
+    __slots__ = ('handler',)
+
+    def __init__(self, handler):
+        self.handler = handler
+
+class Transaction:
+    """MULTI/EXEC and WATCH state of one client connection."""
+    __slots__ = ('queue', 'aborted', 'watched')
+
+    def __init__(self):
+        self.queue = None  # requests queued since MULTI; None outside one
+        self.aborted = False  # a request failed to queue, so EXEC will refuse
+        self.watched = {}  # key -> version when WATCHed
+
 class Server:
     """Key-value store server implementation."""
 
-    def __init__(self, host='127.0.0.1', port=31337, max_clients=64, max_memory_mb=100):
+    engine = 'gevent'
+
+    def __init__(self, host='127.0.0.1', port=31337, max_clients=64, max_memory_mb=100,
+                 eviction_policy=None, shards=None, max_output_buffer=DEFAULT_MAX_OUTPUT_BUFFER,
+                 encoded_values=None, snapshot_path=None, snapshot_interval=None,
+                 aof_path=None, aof_fsync=None, replicaof=None,
+                 repl_backlog_size=DEFAULT_BACKLOG_SIZE, slowlog_threshold_us=None,
+                 slowlog_max_len=None):
+        self._stats = ServerStats()
+        if slowlog_threshold_us is None:
+            slowlog_threshold_us = int(os.environ.get('SLOWLOG_LOG_SLOWER_THAN',
+                                                      DEFAULT_SLOWLOG_THRESHOLD_US))
+        slowlog_max_len = slowlog_max_len or int(os.environ.get('SLOWLOG_MAX_LEN',
+                                                                DEFAULT_SLOWLOG_MAX_LEN))
+        self._slowlog = SlowLog(slowlog_threshold_us / 1e6, slowlog_max_len)
+        # DEBUG PROFILE / DEBUG MEMORY sessions, created on first use.
+        self._profiler = None
+        self._memory_tracer = None
+        # Address of the connection whose request is running, for the slow
+        # log, and its transaction state for MULTI/EXEC and WATCH.
+        self._client_address = None
+        self._transaction = None
+        # Per-connection and per-command messages are rate limited, and
+        # commands are also sampled, so logging stays off the hot path.
+        self._client_log = SampledLogger(logger)
+        self._client_error_log = SampledLogger(logger, logging.WARNING)
+        self._command_log = SampledLogger(logger, every=int(
+            os.environ.get('LOG_COMMAND_SAMPLE', DEFAULT_COMMAND_SAMPLE)))
+        self._max_clients = max_clients
+        # Set once the listener is bound and accepting, cleared on shutdown.
+        self._ready = Event()
+        # Open client connections; shutdown stops reading from them.
+        self._connections = set()
+        self._create_listener(host, port, max_clients)
+        self._protocol = ProtocolHandler()
+        self._max_output_buffer = max_output_buffer
+        eviction_policy = eviction_policy or os.environ.get(
+            'MAXMEMORY_POLICY', DEFAULT_EVICTION_POLICY)
+        shards = shards or int(os.environ.get('STORE_SHARDS', DEFAULT_SHARDS))
+        if encoded_values is None:
+            encoded_values = os.environ.get('STORE_ENCODED_VALUES', '') in ('1', 'true', 'yes')
+        self._encoded_values = encoded_values
+        value_encoder = self._protocol.encode_value if encoded_values else None
+        value_decoder = decode_value if encoded_values else None
+        if shards > 1:
+            self._kv = ShardedKeyValueStore(max_memory_mb, eviction_policy, shards, value_encoder,
+                                            value_decoder, self._evicted)
+        else:
+            self._kv = KeyValueStore(max_memory_mb, eviction_policy, value_encoder, value_decoder,
+                                     self._evicted)
+        self._commands = self.get_commands()
+
+        self._primary = Primary(self, repl_backlog_size)
+        self._replica_link = None
+        replicaof = replicaof or os.environ.get('REPLICAOF')
+        if replicaof:
+            self._replica_link = ReplicaLink(self, *parse_address(replicaof), listening_port=port)
+
+        snapshot_path = snapshot_path or os.environ.get('SNAPSHOT_PATH')
+        if snapshot_interval is None and os.environ.get('SNAPSHOT_INTERVAL'):
+            snapshot_interval = float(os.environ['SNAPSHOT_INTERVAL'])
+        self._snapshots = None
+        if snapshot_path:
+            from snapshot import Snapshotter
+            self._snapshots = Snapshotter(self._kv, snapshot_path, snapshot_interval)
+
+        # The log is the more complete record, so like Redis it wins over a
+        # snapshot when both exist. It is opened only after replay, so
+        # replayed commands are not appended to it again.
+        aof_path = aof_path or os.environ.get('AOF_PATH')
+        self._aof = None
+        if aof_path and os.path.exists(aof_path):
+            self._replay_log(aof_path)
+        elif self._snapshots is not None:
+            self._snapshots.load(encoded_values)
+        if aof_path:
+            from aof import AppendOnlyLog
+            self._aof = AppendOnlyLog(aof_path, aof_fsync or os.environ.get('AOF_FSYNC', 'everysec'))
+
+    def _create_listener(self, host, port, max_clients):
         self._pool = Pool(max_clients)
         self._server = StreamServer(
             (host, port),
             self.connection_handler,
             spawn=self._pool)
-        self._protocol = ProtocolHandler()
-        self._kv = KeyValueStore(max_memory_mb)
-        self._commands = self.get_commands()
 
     def get_commands(self) -> Dict:
         return {
@@ -29,52 +190,316 @@ class Server:
             'DELETE': self.delete,
             'FLUSH': self.flush,
             'MGET': self.mget,
-            'MSET': self.mset
+            'MSET': self.mset,
+            'MSETEX': self.msetex,
+            'EXPIRE': self.expire,
+            'PEXPIRE': self.pexpire,
+            'TTL': self.ttl,
+            'PTTL': self.pttl,
+            'PERSIST': self.persist,
+            'MEMORY': self.memory,
+            'SAVE': self.save,
+            'BGSAVE': self.bgsave,
+            'LASTSAVE': self.lastsave,
+            'EXPIREAT': self.expireat,
+            'PEXPIREAT': self.pexpireat,
+            'BGREWRITEAOF': self.bgrewriteaof,
+            'PSYNC': self.psync,
+            'REPLCONF': self.replconf,
+            'ROLE': self.role,
+            'INFO': self.info,
+            'SLOWLOG': self.slowlog,
+            'DEBUG': self.debug,
+            'PING': self.ping,
+            'TYPE': self.type,
+            'HSET': self.hset,
+            'HGET': self.hget,
+            'HMGET': self.hmget,
+            'HDEL': self.hdel,
+            'HGETALL': self.hgetall,
+            'LPUSH': self.lpush,
+            'RPUSH': self.rpush,
+            'LPOP': self.lpop,
+            'RPOP': self.rpop,
+            'LRANGE': self.lrange,
+            'SADD': self.sadd,
+            'SREM': self.srem,
+            'SISMEMBER': self.sismember,
+            'SMEMBERS': self.smembers,
+            'INCR': self.incr,
+            'DECR': self.decr,
+            'INCRBY': self.incrby,
+            'DECRBY': self.decrby,
+            'INCRBYFLOAT': self.incrbyfloat,
+            'GETSET': self.getset,
+            'SETNX': self.setnx,
+            'MSETNX': self.msetnx,
+            'MULTI': self.multi,
+            'EXEC': self.exec,
+            'DISCARD': self.discard,
+            'WATCH': self.watch,
+            'UNWATCH': self.unwatch,
         }
 
-    def connection_handler(self, conn, address):
-        logger.info('Connection received: %s:%s', *address)
+    def connection_handler(self, conn, address, process=None):
+        self._client_log.log('Connection received: %s:%s', *address)
+        stats = self._stats
+        stats.connections_received += 1
+        stats.connected_clients += 1
+        self._connections.add(conn)
+        process = process or self.process_request
+        transaction = Transaction()
+        parser = RespParser(encoding=None if self._encoded_values else 'utf-8')
+        # Replies to every request already in the read buffer are encoded into
+        # one reusable output buffer and sent in a single write before waiting
+        # for more input, or sooner once they exceed the output buffer limit.
+        out = bytearray()
         try:
             conn.settimeout(60)
-            socket_file = conn.makefile('rwb')
-            try:
-                while True:
-                    try:
-                        data = self._protocol.handle_request(socket_file)
-                    except Disconnect:
-                        logger.info('Client disconnected: %s:%s', *address)
-                        break
-                    except ProtocolError as e:
-                        logger.error('Protocol error: %s', e)
-                        self._protocol.write_response(socket_file, Error(str(e)))
+            while True:
+                try:
+                    data = parser.gets()
+                except ProtocolError as e:
+                    self._client_error_log.log('Protocol error from %s:%s: %s', *address, e)
+                    parser.reset()
+                    resp = Error(str(e))
+                else:
+                    if data is INCOMPLETE:
+                        if out:
+                            self._flush_log()
+                            conn.sendall(out)
+                            stats.bytes_out += len(out)
+                            del out[:]
+                        received = parser.recv_from(conn)
+                        if not received:
+                            self._client_log.log('Client disconnected: %s:%s', *address)
+                            break
+                        stats.bytes_in += received
                         continue
-
-                    try:
-                        resp = self.get_response(data)
-                    except CommandError as exc:
-                        logger.exception('Command error')
-                        resp = Error(str(exc))
-                    except Exception as exc:
-                        logger.exception('Unexpected error')
-                        resp = Error('Internal server error')
-
-                    try:
-                        self._protocol.write_response(socket_file, resp)
-                    except socket_error:
-                        logger.error('Failed to write response')
+                    self._client_address = address
+                    resp = process(data, transaction)
+                    if type(resp) is Takeover:
+                        self._flush_log()
+                        if out:
+                            conn.sendall(out)
+                            stats.bytes_out += len(out)
+                        resp.handler(conn, address, parser)
                         break
-            finally:
-                socket_file.close()
+
+                self._protocol.encode_into(out, resp)
+                if len(out) >= self._max_output_buffer:
+                    self._flush_log()
+                    conn.sendall(out)
+                    stats.bytes_out += len(out)
+                    del out[:]
         except socket_error as e:
-            logger.error('Socket error with client %s:%s: %s', *(address + (e,)))
+            self._client_error_log.log('Socket error with client %s:%s: %s', *address, e)
         finally:
+            stats.connected_clients -= 1
+            self._connections.discard(conn)
+            self.end_transaction(transaction)
             conn.close()
 
-    def run(self):
-        logger.info('Starting server on %s:%s', *self._server.address)
-        self._server.serve_forever()
+    def process_request(self, data, transaction=None):
+        """Run a parsed request and return its reply, mapping failures to Error.
+
+        ``transaction`` is the MULTI/WATCH state of the connection the
+        request came from; between MULTI and EXEC requests are only queued.
+        """
+        self._transaction = transaction
+        try:
+            if transaction is not None and transaction.queue is not None:
+                return self._queue_request(transaction, data)
+            return self.get_response(data)
+        except CommandError as exc:
+            # Bad arguments, unknown commands and the like are the client's
+            # problem: count them, no traceback.
+            self._stats.error_replies += 1
+            self._client_log.log('Command error: %s', exc)
+            return Error(str(exc))
+        except Exception:
+            logger.exception('Unexpected error')
+            return Error('Internal server error')
+
+    @property
+    def address(self):
+        return self._server.address
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None) -> bool:
+        """Block until the server accepts connections; False if ``timeout`` runs out first."""
+        return self._ready.wait(timeout)
+
+    def run(self, stop_signals=()):
+        """Serve until ``shutdown``, which any of ``stop_signals`` also triggers."""
+        self._server.start()
+        for signum in stop_signals:
+            gevent.signal_handler(signum, self.shutdown)
+        logger.info('Starting server on %s:%s', *self.address)
+        workers = [gevent.spawn(self._active_expire)]
+        if self._snapshots is not None or self._aof is not None:
+            workers.append(gevent.spawn(self._persistence_loop))
+        if self._replica_link is not None:
+            workers.append(gevent.spawn(self._replica_link.run))
+        self._ready.set()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._ready.clear()
+            gevent.killall(workers)
+            if self._aof is not None:
+                self._aof.close()
+
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        """Stop accepting connections, drain the open ones and make ``run`` return.
+
+        Each connection stops reading but still answers the requests it has
+        already received. Connections left after ``timeout`` are closed.
+        """
+        self._ready.clear()
+        self._server.stop_accepting()
+        logger.info('Shutting down, draining %d connections', len(self._connections))
+        for conn in list(self._connections):
+            # Shut down a duplicate: on the connection itself gevent would
+            # cancel the handler's pending read instead of letting it see
+            # the end of the stream after the data already received.
+            try:
+                with socket.fromfd(conn.fileno(), conn.family, conn.type) as dup:
+                    dup.shutdown(socket.SHUT_RD)
+            except socket_error:
+                pass
+        self._pool.join(timeout)
+        self._server.stop()
+
+    def _active_expire(self):
+        while True:
+            if self._kv.expire_cycle(ACTIVE_EXPIRE_SLICE):
+                gevent.sleep(0)
+            else:
+                gevent.sleep(ACTIVE_EXPIRE_INTERVAL)
+
+    def _persistence_loop(self):
+        while True:
+            gevent.sleep(PERSISTENCE_INTERVAL)
+            self._persistence_tick()
+
+    def _persistence_tick(self):
+        try:
+            if self._snapshots is not None:
+                self._snapshots.tick()
+            if self._aof is not None:
+                self._aof.tick(self._kv)
+        except Exception:
+            logger.exception('Background persistence failed')
+
+    def _flush_log(self):
+        """Make logged writes durable per the fsync policy before replying."""
+        if self._aof is not None:
+            self._aof.flush()
+
+    def _propagate(self, *command):
+        """Record a write that changed the store in the log and the replication stream."""
+        if self._aof is not None:
+            self._aof.append(command)
+        self._primary.feed(command)
+
+    def _evicted(self, key):
+        # As in Redis, replicas and the log see an eviction as a delete,
+        # logged before the write that needed the room.
+        self._propagate('DELETE', key)
+
+    def _apply_replicated(self, data):
+        """Run a write streamed from the primary, bypassing the read-only check."""
+        try:
+            command, args = self._parse_request(data)
+            self._commands[command](*args)
+        except CommandError as exc:
+            logger.warning('Replicated command failed: %s', exc)
+
+    def _load_full_sync(self, path):
+        from snapshot import Snapshotter
+        self._kv.flush()
+        Snapshotter(self._kv, path).load(self._encoded_values)
+        if self._aof is not None and not self._aof.rewrite_in_progress:
+            self._aof.rewrite(self._kv)
+
+    def _replay_log(self, path):
+        from aof import read_log
+        start = time.perf_counter()
+        count = 0
+        for command in read_log(path, None if self._encoded_values else 'utf-8'):
+            try:
+                name, args = self._parse_request(command)
+                self._commands[name](*args)
+            except CommandError as exc:
+                logger.warning('Skipping logged command %r: %s', command[:1], exc)
+            count += 1
+        logger.info('Replayed %d commands from %s in %.3fs', count, path,
+                    time.perf_counter() - start)
 
     def get_response(self, data):
+        command, args = self._parse_request(data)
+        if self._replica_link is not None and command in WRITE_COMMANDS:
+            raise CommandError("READONLY You can't write against a read only replica")
+        handler = self._commands[command]
+        start = time.perf_counter()
+        try:
+            resp = handler(*args)
+        except Exception:
+            self._record(command, data, time.perf_counter() - start, failed=True)
+            raise
+        self._record(command, data, time.perf_counter() - start)
+        return resp
+
+    def _queue_request(self, transaction, data):
+        """Check a request sent after MULTI and queue it for EXEC."""
+        try:
+            command, args = self._parse_request(data)
+        except CommandError:
+            transaction.aborted = True
+            raise
+        if command in ('EXEC', 'DISCARD'):
+            return self.get_response(data)
+        if command in ('MULTI', 'WATCH'):
+            raise CommandError(f'{command} inside MULTI is not allowed')
+        error = self._queue_error(command, args)
+        if error is not None:
+            transaction.aborted = True
+            raise CommandError(error)
+        transaction.queue.append(data)
+        return QUEUED
+
+    def _queue_error(self, command, args):
+        """Why ``command`` cannot run inside a transaction, or None if it can."""
+        if command == 'PSYNC':
+            return 'PSYNC is not allowed in a transaction'
+        if self._replica_link is not None and command in WRITE_COMMANDS:
+            return "READONLY You can't write against a read only replica"
+        return None
+
+    def end_transaction(self, transaction):
+        """Drop a connection's queued requests and watched keys."""
+        transaction.queue = None
+        transaction.aborted = False
+        if transaction.watched:
+            self._kv.unwatch(transaction.watched)
+            transaction.watched = {}
+
+    def _current_transaction(self):
+        if self._transaction is None:
+            raise CommandError('Transactions need a client connection')
+        return self._transaction
+
+    def _record(self, command, data, elapsed, failed=False):
+        self._stats.record(command, elapsed, failed)
+        if elapsed >= self._slowlog.threshold:
+            self._slowlog.add(data, elapsed, self._client_address)
+
+    def _parse_request(self, data):
+        """Split a request into its upper-cased command name and arguments."""
         if not isinstance(data, (list, tuple)):
             try:
                 data = data.split()
@@ -88,29 +513,508 @@ class Server:
         if command not in self._commands:
             raise CommandError(f'Unrecognized command: {command}')
 
-        logger.debug('Received %s', command)
-        return self._commands[command](*data[1:])
+        self._command_log.log('Received %s', command)
+        args = data[1:]
+        if self._encoded_values:
+            args = self._decode_arguments(command, args)
+        return command, args
+
+    @staticmethod
+    def _decode_arguments(command, args):
+        """Decode every non-value argument of a raw request to text."""
+        is_value = VALUE_ARGUMENTS.get(command)
+        decoded = []
+        for i, arg in enumerate(args):
+            if isinstance(arg, bytes) and not (is_value and is_value(i)):
+                try:
+                    arg = arg.decode('utf-8')
+                except UnicodeDecodeError:
+                    pass
+            decoded.append(arg)
+        return decoded
 
     def get(self, key):
         return self._kv.get(key)
 
-    def set(self, key, value):
-        return 1 if self._kv.set(key, value) else 0
+    def set(self, key, value, *options):
+        ttl = self._parse_expiry('SET', options)
+        result = self._kv.set(key, value) if ttl is None else self._kv.set(key, value, ttl)
+        if result:
+            self._propagate('SET', key, value)
+            if ttl is not None:
+                self._propagate('PEXPIREAT', key, self._deadline_ms(ttl))
+        return 1 if result else 0
 
     def delete(self, key):
-        return 1 if self._kv.delete(key) else 0
+        if not self._kv.delete(key):
+            return 0
+        self._propagate('DELETE', key)
+        return 1
 
     def flush(self):
-        return self._kv.flush()
+        count = self._kv.flush()
+        self._propagate('FLUSH')
+        return count
 
     def mget(self, *keys):
-        return [self._kv.get(key) for key in keys]
+        return self._kv.mget(keys)
 
     def mset(self, *items):
         if len(items) % 2 != 0:
             raise CommandError('MSET requires pairs of key/value arguments')
-        count = 0
-        for key, value in zip(items[::2], items[1::2]):
-            if self._kv.set(key, value):
-                count += 1
-        return count
\ No newline at end of file
+        count = self._kv.mset(zip(items[::2], items[1::2]))
+        self._propagate('MSET', *items)
+        return count
+
+    def msetex(self, numkeys, *args):
+        """MSETEX numkeys key value [key value ...] [EX seconds | PX milliseconds]
+
+        Like MSET with one lifetime for every key. The key count tells the
+        pairs from the option, so keys may be named EX or PX.
+        """
+        count = self._parse_int(numkeys)
+        if count < 1 or len(args) < 2 * count:
+            raise CommandError('MSETEX numkeys does not match the key/value arguments')
+        items = args[:2 * count]
+        ttl = self._parse_expiry('MSETEX', args[2 * count:])
+        count = self._kv.mset(zip(items[::2], items[1::2]), ttl)
+        self._propagate('MSET', *items)
+        if ttl is not None:
+            deadline = self._deadline_ms(ttl)
+            for key in items[::2]:
+                self._propagate('PEXPIREAT', key, deadline)
+        return count
+
+    def expire(self, key, seconds):
+        seconds = self._parse_int(seconds)
+        return self._logged_expiry(key, self._kv.expire(key, seconds), time.time() + seconds)
+
+    def pexpire(self, key, milliseconds):
+        seconds = self._parse_int(milliseconds) / 1000.0
+        return self._logged_expiry(key, self._kv.expire(key, seconds), time.time() + seconds)
+
+    def expireat(self, key, timestamp):
+        deadline = self._parse_int(timestamp)
+        return self._logged_expiry(key, self._kv.expire_at(key, deadline), deadline)
+
+    def pexpireat(self, key, timestamp_ms):
+        deadline = self._parse_int(timestamp_ms) / 1000.0
+        return self._logged_expiry(key, self._kv.expire_at(key, deadline), deadline)
+
+    def _logged_expiry(self, key, applied, deadline):
+        if not applied:
+            return 0
+        # Relative lifetimes are logged as absolute deadlines so a replay
+        # later does not extend them.
+        self._propagate('PEXPIREAT', key, int(deadline * 1000))
+        return 1
+
+    def ttl(self, key):
+        remaining = self._kv.ttl(key)
+        return remaining if remaining < 0 else int(remaining + 0.5)
+
+    def pttl(self, key):
+        remaining = self._kv.ttl(key)
+        return remaining if remaining < 0 else int(remaining * 1000 + 0.5)
+
+    def persist(self, key):
+        if not self._kv.persist(key):
+            return 0
+        self._propagate('PERSIST', key)
+        return 1
+
+    def type(self, key):
+        return SimpleString(self._kv.key_type(key))
+
+    def hset(self, key, *items):
+        if not items or len(items) % 2 != 0:
+            raise CommandError('HSET requires pairs of field/value arguments')
+        count = self._kv.hset(key, list(zip(items[::2], items[1::2])))
+        self._propagate('HSET', key, *items)
+        return count
+
+    def hget(self, key, field):
+        return self._kv.hget(key, field)
+
+    def hmget(self, key, *fields):
+        return self._kv.hmget(key, fields)
+
+    def hdel(self, key, *fields):
+        count = self._kv.hdel(key, fields)
+        if count:
+            self._propagate('HDEL', key, *fields)
+        return count
+
+    def hgetall(self, key):
+        return self._kv.hgetall(key)
+
+    def lpush(self, key, *values):
+        if not values:
+            raise CommandError('LPUSH requires at least one value')
+        length = self._kv.lpush(key, values)
+        self._propagate('LPUSH', key, *values)
+        return length
+
+    def rpush(self, key, *values):
+        if not values:
+            raise CommandError('RPUSH requires at least one value')
+        length = self._kv.rpush(key, values)
+        self._propagate('RPUSH', key, *values)
+        return length
+
+    def lpop(self, key, count=None):
+        return self._pop('LPOP', self._kv.lpop, key, count)
+
+    def rpop(self, key, count=None):
+        return self._pop('RPOP', self._kv.rpop, key, count)
+
+    def _pop(self, command, pop, key, count):
+        # Without a count the reply is one element, with one a list of them.
+        amount = 1 if count is None else self._parse_int(count)
+        if amount < 0:
+            raise CommandError('Value is out of range, must be positive')
+        popped = pop(key, amount)
+        if popped:
+            self._propagate(command, key, amount)
+        if count is None:
+            return popped[0] if popped else None
+        return popped
+
+    def lrange(self, key, start, stop):
+        return self._kv.lrange(key, self._parse_int(start), self._parse_int(stop))
+
+    def sadd(self, key, *members):
+        if not members:
+            raise CommandError('SADD requires at least one member')
+        count = self._kv.sadd(key, members)
+        if count:
+            self._propagate('SADD', key, *members)
+        return count
+
+    def srem(self, key, *members):
+        count = self._kv.srem(key, members)
+        if count:
+            self._propagate('SREM', key, *members)
+        return count
+
+    def sismember(self, key, member):
+        return 1 if self._kv.sismember(key, member) else 0
+
+    def smembers(self, key):
+        return self._kv.smembers(key)
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def decr(self, key):
+        return self.incrby(key, -1)
+
+    def incrby(self, key, amount):
+        amount = self._parse_int(amount)
+        value = self._kv.incr(key, amount)
+        self._propagate('INCRBY', key, amount)
+        return value
+
+    def decrby(self, key, amount):
+        return self.incrby(key, -self._parse_int(amount))
+
+    def incrbyfloat(self, key, amount):
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise CommandError('Value is not a valid float')
+        value = self._kv.incr_float(key, amount)
+        self._propagate('INCRBYFLOAT', key, amount)
+        return value
+
+    def getset(self, key, value):
+        old = self._kv.getset(key, value)
+        self._propagate('SET', key, value)
+        return old
+
+    def setnx(self, key, value):
+        if not self._kv.setnx(key, value):
+            return 0
+        self._propagate('SET', key, value)
+        return 1
+
+    def msetnx(self, *items):
+        if not items or len(items) % 2 != 0:
+            raise CommandError('MSETNX requires pairs of key/value arguments')
+        if not self._kv.msetnx(zip(items[::2], items[1::2])):
+            return 0
+        self._propagate('MSET', *items)
+        return 1
+
+    def multi(self):
+        self._current_transaction().queue = []
+        return OK
+
+    def exec(self):
+        # Queued requests run back to back under the store lock, so no other
+        # connection sees or changes the keys halfway through. A WATCHed key
+        # that changed since cancels the lot, and EXEC replies nil.
+        transaction = self._current_transaction()
+        if transaction.queue is None:
+            raise CommandError('EXEC without MULTI')
+        try:
+            if transaction.aborted:
+                raise CommandError('EXECABORT Transaction discarded because of previous errors')
+            # Queued requests run with this connection's state, which UNWATCH
+            # needs; the queue is closed first so they are not queued again.
+            queue, transaction.queue = transaction.queue, None
+            with self._kv.locked():
+                if transaction.watched and self._kv.changed(transaction.watched):
+                    return None
+                return [self.process_request(data, transaction) for data in queue]
+        finally:
+            self.end_transaction(transaction)
+
+    def discard(self):
+        transaction = self._current_transaction()
+        if transaction.queue is None:
+            raise CommandError('DISCARD without MULTI')
+        self.end_transaction(transaction)
+        return OK
+
+    def watch(self, *keys):
+        if not keys:
+            raise CommandError('WATCH requires at least one key')
+        watched = self._current_transaction().watched
+        keys = [key for key in dict.fromkeys(keys) if key not in watched]
+        watched.update(zip(keys, self._kv.watch(keys)))
+        return OK
+
+    def unwatch(self):
+        self.end_transaction(self._current_transaction())
+        return OK
+
+    def memory(self, subcommand, *args):
+        subcommand = str(subcommand).upper()
+        if subcommand == 'USAGE':
+            if len(args) != 1:
+                raise CommandError('MEMORY USAGE requires a key')
+            return self._kv.memory_usage(args[0])
+        if subcommand == 'STATS':
+            return self._kv.memory_stats()
+        raise CommandError(f'Unknown MEMORY subcommand: {subcommand}')
+
+    def save(self):
+        self._snapshot_config().save()
+        return OK
+
+    def bgsave(self):
+        self._snapshot_config().bgsave()
+        return SimpleString('Background saving started')
+
+    def lastsave(self):
+        return self._snapshot_config().last_save
+
+    def bgrewriteaof(self):
+        if self._aof is None:
+            raise CommandError('Append-only log is not configured')
+        self._aof.rewrite(self._kv)
+        return SimpleString('Background append only file rewriting started')
+
+    def psync(self, replid, offset, listening_port=None):
+        if self._replica_link is not None:
+            raise CommandError('Replicas cannot have replicas of their own')
+        offset = self._parse_int(offset)
+        listening_port = self._parse_int(listening_port) if listening_port else None
+        return Takeover(lambda conn, address, parser: self._primary.serve(
+            conn, address, parser, replid, offset, listening_port))
+
+    def replconf(self, *args):
+        return OK
+
+    def role(self):
+        if self._replica_link is not None:
+            return self._replica_link.info()
+        return self._primary.info()
+
+    def info(self, *sections):
+        """Server state and counters, by section; ``all`` adds latency histograms."""
+        wanted = [section.lower() for section in sections] or list(INFO_SECTIONS)
+        if 'all' in wanted:
+            wanted = list(INFO_SECTIONS) + ['histograms']
+        stats = self._stats
+        memory = self._kv.memory_stats()
+        builders = {
+            'server': lambda: {
+                'engine': self.engine,
+                'python_version': '%d.%d.%d' % sys.version_info[:3],
+                'process_id': os.getpid(),
+                'shards': memory.get('shards', 1),
+                'uptime_in_seconds': int(time.time() - stats.started),
+            },
+            'clients': lambda: {
+                'connected_clients': stats.connected_clients,
+                'max_clients': self._max_clients,
+                'client_utilization': round(stats.connected_clients / self._max_clients, 4),
+            },
+            'memory': lambda: {
+                'used_memory': memory['used_memory'],
+                'max_memory': memory['max_memory'],
+                'used_memory_ratio': round(memory['used_memory'] / memory['max_memory'], 4)
+                if memory['max_memory'] else 0,
+                'eviction_policy': memory['eviction_policy'],
+            },
+            'keyspace': lambda: {'keys': memory['keys'], 'expires': memory['expires']},
+            'persistence': self._persistence_info,
+            'stats': lambda: {
+                'total_connections_received': stats.connections_received,
+                'rejected_connections': stats.rejected_connections,
+                'total_commands_processed': sum(c.calls for c in stats.commands.values()),
+                'total_errors': sum(c.errors for c in stats.commands.values()),
+                'total_error_replies': stats.error_replies,
+                'total_net_input_bytes': stats.bytes_in,
+                'total_net_output_bytes': stats.bytes_out,
+                'evicted_keys': memory['evicted_keys'],
+                'expired_keys': memory['expired_keys'],
+            },
+            'replication': self.role,
+            'commandstats': stats.command_info,
+            'latencystats': stats.latency_info,
+            'histograms': stats.histogram_info,
+        }
+        result = {}
+        for section in wanted:
+            if section not in builders:
+                raise CommandError(f'Unknown INFO section: {section}')
+            result[section] = builders[section]()
+        return result
+
+    def slowlog(self, subcommand, *args):
+        subcommand = str(subcommand).upper()
+        if subcommand == 'GET':
+            return self._slowlog.get(self._parse_int(args[0]) if args else 10)
+        if subcommand == 'LEN':
+            return len(self._slowlog)
+        if subcommand == 'RESET':
+            self._slowlog.reset()
+            return OK
+        raise CommandError(f'Unknown SLOWLOG subcommand: {subcommand}')
+
+    def debug(self, subcommand, action=None, *args):
+        """DEBUG PROFILE|MEMORY START [seconds], STOP, DUMP, and MEMORY SNAPSHOT [limit]."""
+        from profiling import (Profiler, MemoryTracer, session_seconds, DEFAULT_SESSION_SECONDS,
+                               DEFAULT_TOP)
+        subcommand = str(subcommand).upper()
+        action = str(action).upper() if action is not None else None
+        if subcommand == 'PROFILE':
+            session = self._profiler = self._profiler or Profiler()
+            if action == 'STOP':
+                return session.stop(self._parse_int(args[0]) if args else DEFAULT_TOP)
+        elif subcommand == 'MEMORY':
+            session = self._memory_tracer = self._memory_tracer or MemoryTracer()
+            if action == 'STOP':
+                session.stop()
+                return OK
+            if action == 'SNAPSHOT':
+                return session.snapshot(self._parse_int(args[0]) if args else DEFAULT_TOP)
+        else:
+            raise CommandError(f'Unknown DEBUG subcommand: {subcommand}')
+        if action == 'START':
+            seconds = session.start(session_seconds(args[0]) if args else DEFAULT_SESSION_SECONDS)
+            self._call_later(seconds, session.expire)
+            return OK
+        if action == 'DUMP':
+            return session.dump()
+        raise CommandError(f'Unknown DEBUG {subcommand} action: {action}')
+
+    def ping(self, message=None):
+        return SimpleString('PONG') if message is None else message
+
+    def _call_later(self, seconds, callback):
+        gevent.spawn_later(seconds, callback)
+
+    def _persistence_info(self):
+        snapshots, aof = self._snapshots, self._aof
+        return {
+            'snapshot_enabled': int(snapshots is not None),
+            'last_save': snapshots.last_save if snapshots is not None else 0,
+            'bgsave_in_progress': int(snapshots is not None and snapshots.in_progress),
+            'aof_enabled': int(aof is not None),
+            'aof_size': aof.size if aof is not None else 0,
+            'aof_rewrite_in_progress': int(aof is not None and aof.rewrite_in_progress),
+        }
+
+    def _snapshot_config(self) -> 'Snapshotter':
+        if self._snapshots is None:
+            raise CommandError('Snapshots are not configured')
+        return self._snapshots
+
+    @staticmethod
+    def _deadline_ms(ttl):
+        return int((time.time() + ttl) * 1000)
+
+    @staticmethod
+    def _parse_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise CommandError('Value is not an integer or out of range')
+
+    @staticmethod
+    def _is_expiry_option(option):
+        return isinstance(option, str) and option.upper() in ('EX', 'PX')
+
+    def _parse_expiry(self, command, options):
+        """Turn ``EX <seconds>`` / ``PX <milliseconds>`` into a TTL in seconds."""
+        if not options:
+            return None
+        if len(options) != 2 or not self._is_expiry_option(options[0]):
+            raise CommandError(f'Syntax error in {command} options')
+        amount = self._parse_int(options[1])
+        if amount <= 0:
+            raise CommandError(f'Invalid expire time in {command}')
+        return amount if options[0].upper() == 'EX' else amount / 1000.0
+
+
+ENGINES = ('gevent', 'asyncio')
+
+def create_server(engine=None, **kwargs) -> Server:
+    """Build a server on the given engine (default: $SERVER_ENGINE or gevent)."""
+    engine = engine or os.environ.get('SERVER_ENGINE', 'gevent')
+    if engine == 'gevent':
+        return Server(**kwargs)
+    if engine == 'asyncio':
+        from aio_server import AsyncioServer
+        return AsyncioServer(**kwargs)
+    raise ValueError(f'Unknown server engine: {engine}')
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Miniature Redis server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=31337)
+    parser.add_argument('--engine', choices=ENGINES)
+    parser.add_argument('--max-clients', type=int)
+    parser.add_argument('--max-memory-mb', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVER_WORKERS', 1)),
+                        help='fork this many worker processes sharing the port')
+    parser.add_argument('--replicaof', metavar='HOST:PORT',
+                        help='replicate from this primary and serve reads only')
+    parser.add_argument('--cluster-mode', choices=('forward', 'redirect'),
+                        default=os.environ.get('CLUSTER_MODE', 'forward'))
+    args = parser.parse_args(argv)
+    engine = args.engine or os.environ.get('SERVER_ENGINE', 'gevent')
+    if args.workers > 1 and engine != 'gevent':
+        parser.error('--workers requires the gevent engine')
+    if (args.replicaof or os.environ.get('REPLICAOF')) and engine != 'gevent':
+        parser.error('--replicaof requires the gevent engine')
+
+    configure_logging()
+    kwargs = {'host': args.host, 'port': args.port, 'max_memory_mb': args.max_memory_mb}
+    if args.replicaof:
+        kwargs['replicaof'] = args.replicaof
+    if args.max_clients:
+        kwargs['max_clients'] = args.max_clients
+    if args.workers > 1:
+        from cluster import Supervisor
+        Supervisor(args.workers, mode=args.cluster_mode, **kwargs).run()
+    else:
+        create_server(args.engine, **kwargs).run(stop_signals=(signal.SIGTERM, signal.SIGINT))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import gc
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Any, Iterator, Optional, Tuple
+
+from protocol import ProtocolHandler, RespParser, Encoded, INCOMPLETE
+from storage import CommandError, HashValue, ListValue, SetValue
+
+logger = logging.getLogger(__name__)
+
+# File layout: MAGIC, a header with the creation time and record count, then
+# one record per key: a fixed-size record header followed by the key bytes
+# and the value bytes.
+MAGIC = b'KVSNAP01'
+_HEADER = struct.Struct('<dQ')  # created at, record count
+_RECORD = struct.Struct('<IBdI')  # key length, value kind, deadline (0: none), value length
+
+# How a value's bytes are stored. Strings and bytes are written raw; every
+# other value (integers, lists, pre-encoded values) as its RESP encoding.
+KIND_TEXT = 0
+KIND_BYTES = 1
+KIND_RESP = 2
+# Collections: the RESP array of their ``flat()`` elements. They are always
+# loaded decoded, since a store keeps their elements as plain values.
+KIND_HASH = 3
+KIND_LIST = 4
+KIND_SET = 5
+
+COLLECTION_KINDS = {HashValue: KIND_HASH, ListValue: KIND_LIST, SetValue: KIND_SET}
+_COLLECTION_TYPES = {kind: value_type for value_type, kind in COLLECTION_KINDS.items()}
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+Entry = Tuple[Any, Any, Optional[float]]
+
+def write_snapshot(store, path: str) -> int:
+    """Write every live key of ``store`` to ``path`` and return the key count.
+
+    The file is written under a temporary name, fsynced and then renamed,
+    so ``path`` always holds a complete snapshot.
+    """
+    protocol = ProtocolHandler()
+    pack = _RECORD.pack
+    count = 0
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as fh:
+        fh.write(MAGIC)
+        fh.write(_HEADER.pack(0.0, 0))
+        write = fh.write
+        for key, value, deadline in store.items():
+            key = key if isinstance(key, bytes) else str(key).encode('utf-8')
+            value_type = type(value)
+            if value_type is str:
+                kind, value = KIND_TEXT, value.encode('utf-8')
+            elif value_type is Encoded:
+                kind = KIND_RESP
+            elif value_type is bytes:
+                kind = KIND_BYTES
+            elif value_type in COLLECTION_KINDS:
+                kind, value = COLLECTION_KINDS[value_type], protocol.encode(value.flat())
+            else:
+                kind, value = KIND_RESP, protocol.encode(value)
+            write(pack(len(key), kind, deadline or 0.0, len(value)))
+            write(key)
+            write(value)
+            count += 1
+        fh.seek(len(MAGIC))
+        fh.write(_HEADER.pack(time.time(), count))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+def read_snapshot(path: str, encoded: bool = False) -> Iterator[Entry]:
+    """Yield ``(key, value, deadline)`` entries from a snapshot file.
+
+    The file is memory-mapped and records are sliced straight out of the
+    mapping. With ``encoded`` values come back as ``Encoded`` RESP bytes
+    ready for a store with a value encoder; otherwise they are decoded.
+    """
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size < len(MAGIC) + _HEADER.size:
+            raise CommandError(f'Snapshot {path} is truncated')
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise CommandError(f'{path} is not a snapshot file')
+            _, count = _HEADER.unpack_from(data, len(MAGIC))
+            yield from _records(data, len(MAGIC) + _HEADER.size, count, encoded)
+
+def _records(data, pos: int, count: int, encoded: bool) -> Iterator[Entry]:
+    protocol = ProtocolHandler()
+    parser = RespParser()
+    unpack = _RECORD.unpack_from
+    header_size = _RECORD.size
+    end = len(data)
+    for _ in range(count):
+        if pos + header_size > end:
+            raise CommandError('Snapshot is truncated')
+        key_length, kind, deadline, value_length = unpack(data, pos)
+        pos += header_size
+        key = data[pos:pos + key_length]
+        pos += key_length
+        value = data[pos:pos + value_length]
+        pos += value_length
+        if pos > end:
+            raise CommandError('Snapshot is truncated')
+        try:
+            key = key.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+
+        if kind == KIND_RESP:
+            if encoded:
+                value = Encoded(value)
+            else:
+                parser.feed(value)
+                value = parser.gets()
+                if value is INCOMPLETE:
+                    raise CommandError('Snapshot holds a malformed value')
+        elif kind in _COLLECTION_TYPES:
+            parser.feed(value)
+            items = parser.gets()
+            if items is INCOMPLETE or not isinstance(items, list):
+                raise CommandError('Snapshot holds a malformed value')
+            value = _COLLECTION_TYPES[kind].from_flat(items)
+        elif kind == KIND_TEXT:
+            value = value.decode('utf-8')
+            if encoded:
+                value = protocol.encode_value(value)
+        elif encoded:
+            value = protocol.encode_value(value)
+        yield key, value, deadline or None
+
+class Snapshotter:
+    """Saves a store to ``path`` in the foreground or from a forked child.
+
+    ``bgsave`` forks: the child writes the copy-on-write image of the store
+    and exits, so the parent keeps serving. ``poll`` must be called now and
+    then to reap the child; ``tick`` does that and also starts a save every
+    ``interval`` seconds when one is configured.
+    """
+
+    def __init__(self, store, path: str, interval: Optional[float] = None):
+        self._store = store
+        self.path = path
+        self.interval = interval
+        self.last_save = int(time.time())
+        self._child = None
+
+    @property
+    def in_progress(self) -> bool:
+        return self._child is not None
+
+    def load(self, encoded: bool = False) -> int:
+        """Load ``path`` into the store if it exists; returns the number of keys."""
+        if not os.path.exists(self.path):
+            return 0
+        start = time.perf_counter()
+        # Loading allocates millions of tuples that are never garbage; pausing
+        # the cyclic collector meanwhile saves it from rescanning them.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            count = self._store.restore(read_snapshot(self.path, encoded))
+        finally:
+            if gc_enabled:
+                gc.enable()
+        logger.info('Loaded %d keys from %s in %.3fs', count, self.path,
+                    time.perf_counter() - start)
+        self.last_save = int(os.path.getmtime(self.path))
+        return count
+
+    def save(self) -> int:
+        if self.in_progress:
+            raise CommandError('Background save already in progress')
+        count = write_snapshot(self._store, self.path)
+        self.last_save = int(time.time())
+        logger.info('Saved %d keys to %s', count, self.path)
+        return count
+
+    def bgsave(self) -> int:
+        if self.in_progress:
+            raise CommandError('Background save already in progress')
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                write_snapshot(self._store, self.path)
+                code = 0
+            except BaseException:
+                logger.exception('Background save failed')
+            finally:
+                os._exit(code)
+        self._child = (pid, time.time())
+        logger.info('Background save started by pid %d', pid)
+        return pid
+
+    def poll(self) -> bool:
+        """Reap a finished background save; returns True while one is running."""
+        if self._child is None:
+            return False
+        pid, started = self._child
+        try:
+            done, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            done, status = pid, 1
+        if not done:
+            return True
+        self._child = None
+        if os.waitstatus_to_exitcode(status) == 0:
+            self.last_save = int(started)
+            logger.info('Background save done in %.3fs', time.time() - started)
+        else:
+            logger.error('Background save failed with status %d', status)
+        return False
+
+    def wait(self) -> None:
+        """Block until a running background save finishes."""
+        while self.poll():
+            time.sleep(0.01)
+
+    def tick(self) -> None:
+        if not self.poll() and self.interval and time.time() - self.last_save >= self.interval:
+            self.bgsave()
@@ -1,53 +1,1213 @@
+from collections import OrderedDict, defaultdict, deque
+from contextlib import ExitStack, contextmanager
 from gevent.lock import RLock
+import heapq
+from itertools import islice
+import math
+import random
 import time
-from typing import Any, Dict, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 class CommandError(Exception):
     """Raised when a command cannot be processed."""
     pass
 
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+
+# Counters are 64-bit signed integers, as in Redis
+MIN_INT = -2 ** 63
+MAX_INT = 2 ** 63 - 1
+
+def estimate_size(value: Any) -> int:
+    """Return the number of bytes ``value`` occupies once RESP-encoded."""
+    if isinstance(value, str):
+        length = len(value) if value.isascii() else len(value.encode('utf-8'))
+    elif isinstance(value, bytes):
+        length = len(value)
+    elif isinstance(value, int):
+        return len(b'%d' % value) + 3
+    elif isinstance(value, (list, tuple)):
+        return len(b'%d' % len(value)) + 3 + sum(estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        return len(b'%d' % len(value)) + 3 + sum(
+            estimate_size(str(k)) + estimate_size(v) for k, v in value.items())
+    elif value is None:
+        return 5
+    else:
+        length = len(str(value).encode('utf-8'))
+    return len(b'%d' % length) + length + 5
+
+class EvictionPolicy:
+    """Tracks key usage and picks which key to evict when memory runs out."""
+
+    name = None
+
+    def add(self, key: str) -> None:
+        """Called when a new key is written."""
+
+    def touch(self, key: str) -> None:
+        """Called when an existing key is read or overwritten."""
+
+    def remove(self, key: str) -> None:
+        """Called when a key leaves the store."""
+
+    def clear(self) -> None:
+        """Called when the store is flushed."""
+
+    def victim(self) -> Optional[str]:
+        """Return the key to evict next, or None if nothing may be evicted."""
+        return None
+
+class NoEvictionPolicy(EvictionPolicy):
+    """Never evicts; writes fail once the memory limit is reached."""
+
+    name = 'noeviction'
+
+class LRUPolicy(EvictionPolicy):
+    """Exact least-recently-used eviction backed by an ordered dict."""
+
+    name = 'allkeys-lru'
+
+    def __init__(self):
+        self._order: OrderedDict = OrderedDict()
+
+    def add(self, key: str) -> None:
+        self._order[key] = None
+
+    def touch(self, key: str) -> None:
+        self._order.move_to_end(key)
+
+    def remove(self, key: str) -> None:
+        self._order.pop(key, None)
+
+    def clear(self) -> None:
+        self._order.clear()
+
+    def victim(self) -> Optional[str]:
+        return next(iter(self._order), None)
+
+class _KeySampler:
+    """Set of keys supporting O(1) insert, removal and random sampling."""
+
+    def __init__(self):
+        self._keys: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def add(self, key: str) -> None:
+        if key not in self._index:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+
+    def remove(self, key: str) -> None:
+        pos = self._index.pop(key, None)
+        if pos is None:
+            return
+        last = self._keys.pop()
+        if pos < len(self._keys):
+            self._keys[pos] = last
+            self._index[last] = pos
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._index.clear()
+
+    def sample(self, count: int) -> List[str]:
+        keys = self._keys
+        if not keys:
+            return []
+        return [keys[random.randrange(len(keys))] for _ in range(count)]
+
+class SampledLRUPolicy(EvictionPolicy):
+    """Redis-style approximate LRU: evict the stalest of a few random keys."""
+
+    name = 'allkeys-lru-sampled'
+
+    def __init__(self, samples: int = 5):
+        self._samples = samples
+        self._sampler = _KeySampler()
+        self._clock: Dict[str, float] = {}
+
+    def add(self, key: str) -> None:
+        self._sampler.add(key)
+        self._clock[key] = time.monotonic()
+
+    def touch(self, key: str) -> None:
+        self._clock[key] = time.monotonic()
+
+    def remove(self, key: str) -> None:
+        self._sampler.remove(key)
+        self._clock.pop(key, None)
+
+    def clear(self) -> None:
+        self._sampler.clear()
+        self._clock.clear()
+
+    def victim(self) -> Optional[str]:
+        candidates = self._sampler.sample(self._samples)
+        if not candidates:
+            return None
+        return min(candidates, key=self._clock.__getitem__)
+
+class LFUPolicy(EvictionPolicy):
+    """Redis-style LFU with logarithmic, time-decayed access counters.
+
+    Counters start at ``LFU_INIT_VAL``, grow with probability
+    ``1 / ((counter - LFU_INIT_VAL) * log_factor + 1)`` on each access and
+    lose one point per ``decay_minutes`` without access. The victim is the
+    key with the lowest counter among a handful of random samples.
+    """
+
+    name = 'allkeys-lfu'
+
+    LFU_INIT_VAL = 5
+    MAX_COUNTER = 255
+
+    def __init__(self, samples: int = 5, log_factor: int = 10, decay_minutes: int = 1):
+        self._samples = samples
+        self._log_factor = log_factor
+        self._decay_minutes = decay_minutes
+        self._sampler = _KeySampler()
+        self._counters: Dict[str, List[int]] = {}  # [counter, last decay minute]
+
+    @staticmethod
+    def _now_minutes() -> int:
+        return int(time.monotonic() // 60)
+
+    def _decayed(self, entry: List[int], now: int) -> int:
+        if self._decay_minutes <= 0:
+            return entry[0]
+        periods = (now - entry[1]) // self._decay_minutes
+        if periods:
+            entry[0] = max(0, entry[0] - periods)
+            entry[1] = now
+        return entry[0]
+
+    def add(self, key: str) -> None:
+        self._sampler.add(key)
+        self._counters[key] = [self.LFU_INIT_VAL, self._now_minutes()]
+
+    def touch(self, key: str) -> None:
+        entry = self._counters.get(key)
+        if entry is None:
+            return
+        counter = self._decayed(entry, self._now_minutes())
+        if counter < self.MAX_COUNTER:
+            base = max(0, counter - self.LFU_INIT_VAL)
+            if random.random() < 1.0 / (base * self._log_factor + 1):
+                entry[0] = counter + 1
+
+    def frequency(self, key: str) -> Optional[int]:
+        entry = self._counters.get(key)
+        return self._decayed(entry, self._now_minutes()) if entry else None
+
+    def remove(self, key: str) -> None:
+        self._sampler.remove(key)
+        self._counters.pop(key, None)
+
+    def clear(self) -> None:
+        self._sampler.clear()
+        self._counters.clear()
+
+    def victim(self) -> Optional[str]:
+        candidates = self._sampler.sample(self._samples)
+        if not candidates:
+            return None
+        now = self._now_minutes()
+        return min(candidates, key=lambda k: self._decayed(self._counters[k], now))
+
+EVICTION_POLICIES = {
+    policy.name: policy
+    for policy in (NoEvictionPolicy, LRUPolicy, SampledLRUPolicy, LFUPolicy)
+}
+
+DEFAULT_EVICTION_POLICY = LRUPolicy.name
+
+def create_eviction_policy(name: str) -> EvictionPolicy:
+    try:
+        return EVICTION_POLICIES[name.lower()]()
+    except KeyError:
+        raise ValueError(f'Unknown eviction policy: {name}')
+
+# Collections of at most COMPACT_MAX_ENTRIES elements, none larger than
+# COMPACT_MAX_VALUE bytes once RESP-encoded, are kept in a flat list that
+# is scanned linearly (Redis's listpack). Past either limit they switch
+# for good to a dict, deque or set.
+COMPACT_MAX_ENTRIES = 128
+COMPACT_MAX_VALUE = 64
+
+# Accounted bytes of a collection on top of its key and elements
+COLLECTION_OVERHEAD = 16
+
+class Collection:
+    """Base of the hash, list and set values a key can hold.
+
+    ``size`` is the accounted size of the elements, kept up to date by
+    every change so the store never has to walk a collection to re-count.
+    ``flat()`` lists the arguments of one ``write_command`` that rebuilds
+    the value. Each subclass defines ``extend``, which applies such
+    arguments, and ``_large``, which builds its large encoding.
+    """
+
+    __slots__ = ('_items', 'size')
+
+    type_name = None
+    large_encoding = None
+    write_command = None
+
+    def __init__(self):
+        self._items = []
+        self.size = 0
+
+    @classmethod
+    def from_flat(cls, items: List[Any]) -> 'Collection':
+        value = cls()
+        value.extend(items)
+        return value
+
+    @property
+    def encoding(self) -> str:
+        return 'listpack' if type(self._items) is list else self.large_encoding
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def flat(self) -> List[Any]:
+        return list(self._items)
+
+    def _expand(self, largest: int) -> None:
+        """Leave the compact encoding once it holds too much."""
+        if type(self._items) is list and (
+                len(self) > COMPACT_MAX_ENTRIES or largest > COMPACT_MAX_VALUE):
+            self._items = self._large()
+
+class HashValue(Collection):
+    """Field-value map; compact form is ``[field, value, field, value, ...]``."""
+
+    __slots__ = ()
+
+    type_name = 'hash'
+    large_encoding = 'hashtable'
+    write_command = 'HSET'
+
+    def __len__(self) -> int:
+        items = self._items
+        return len(items) // 2 if type(items) is list else len(items)
+
+    def get(self, field: Any) -> Any:
+        items = self._items
+        if type(items) is not list:
+            return items.get(field)
+        for i in range(0, len(items), 2):
+            if items[i] == field:
+                return items[i + 1]
+        return None
+
+    def set(self, field: Any, value: Any) -> int:
+        """Set ``field``; returns 1 if it is new and 0 if it was overwritten."""
+        value_size = estimate_size(value)
+        items = self._items
+        if type(items) is list:
+            for i in range(0, len(items), 2):
+                if items[i] == field:
+                    self.size += value_size - estimate_size(items[i + 1])
+                    items[i + 1] = value
+                    self._expand(value_size)
+                    return 0
+            field_size = estimate_size(field)
+            items.append(field)
+            items.append(value)
+            self.size += field_size + value_size
+            self._expand(max(field_size, value_size))
+            return 1
+        if field in items:
+            self.size += value_size - estimate_size(items[field])
+            items[field] = value
+            return 0
+        items[field] = value
+        self.size += estimate_size(field) + value_size
+        return 1
+
+    def delete(self, field: Any) -> int:
+        items = self._items
+        if type(items) is not list:
+            if field not in items:
+                return 0
+            self.size -= estimate_size(field) + estimate_size(items.pop(field))
+            return 1
+        for i in range(0, len(items), 2):
+            if items[i] == field:
+                self.size -= estimate_size(field) + estimate_size(items[i + 1])
+                del items[i:i + 2]
+                return 1
+        return 0
+
+    def to_dict(self) -> Dict[Any, Any]:
+        items = self._items
+        if type(items) is list:
+            return dict(zip(items[::2], items[1::2]))
+        return dict(items)
+
+    def extend(self, items: List[Any]) -> None:
+        for i in range(0, len(items) - 1, 2):
+            self.set(items[i], items[i + 1])
+
+    def flat(self) -> List[Any]:
+        items = self._items
+        if type(items) is list:
+            return list(items)
+        return [item for pair in items.items() for item in pair]
+
+    def _large(self):
+        return self.to_dict()
+
+class ListValue(Collection):
+    """Sequence with pushes and pops at both ends; large form is a deque."""
+
+    __slots__ = ()
+
+    type_name = 'list'
+    large_encoding = 'quicklist'
+    write_command = 'RPUSH'
+
+    def push_left(self, values: List[Any]) -> int:
+        items = self._items
+        if type(items) is list:
+            items[0:0] = reversed(values)
+        else:
+            items.extendleft(values)
+        return self._added(values)
+
+    def push_right(self, values: List[Any]) -> int:
+        self._items.extend(values)
+        return self._added(values)
+
+    def pop_left(self, count: int) -> List[Any]:
+        items = self._items
+        if type(items) is list:
+            popped = items[:count]
+            del items[:count]
+        else:
+            popped = [items.popleft() for _ in range(min(count, len(items)))]
+        self.size -= sum(estimate_size(value) for value in popped)
+        return popped
+
+    def pop_right(self, count: int) -> List[Any]:
+        items = self._items
+        if type(items) is list:
+            popped = items[:-count - 1:-1]
+            del items[len(items) - len(popped):]
+        else:
+            popped = [items.pop() for _ in range(min(count, len(items)))]
+        self.size -= sum(estimate_size(value) for value in popped)
+        return popped
+
+    def range(self, start: int, stop: int) -> List[Any]:
+        """Elements ``start`` to ``stop`` inclusive; negative indexes count from the end."""
+        items = self._items
+        length = len(items)
+        if start < 0:
+            start = max(start + length, 0)
+        if stop < 0:
+            stop += length
+        stop = min(stop, length - 1)
+        if start > stop:
+            return []
+        if type(items) is list:
+            return items[start:stop + 1]
+        # A deque is only fast at its ends: walk in from the nearer one.
+        if start > length - 1 - stop:
+            tail = list(islice(reversed(items), length - 1 - stop, length - start))
+            tail.reverse()
+            return tail
+        return list(islice(items, start, stop + 1))
+
+    def extend(self, items: List[Any]) -> None:
+        self.push_right(items)
+
+    def _added(self, values: List[Any]) -> int:
+        sizes = [estimate_size(value) for value in values]
+        self.size += sum(sizes)
+        self._expand(max(sizes, default=0))
+        return len(self._items)
+
+    def _large(self):
+        return deque(self._items)
+
+class SetValue(Collection):
+    """Unordered unique members; compact form is a list in insertion order."""
+
+    __slots__ = ()
+
+    type_name = 'set'
+    large_encoding = 'hashtable'
+    write_command = 'SADD'
+
+    def add(self, members: List[Any]) -> int:
+        """Add ``members``; returns how many were not present yet."""
+        items = self._items
+        added = largest = 0
+        compact = type(items) is list
+        for member in members:
+            if member in items:
+                continue
+            if compact:
+                items.append(member)
+            else:
+                items.add(member)
+            member_size = estimate_size(member)
+            self.size += member_size
+            largest = max(largest, member_size)
+            added += 1
+        self._expand(largest)
+        return added
+
+    def remove(self, members: List[Any]) -> int:
+        items = self._items
+        removed = 0
+        for member in members:
+            if member in items:
+                items.remove(member)
+                self.size -= estimate_size(member)
+                removed += 1
+        return removed
+
+    def contains(self, member: Any) -> bool:
+        return member in self._items
+
+    def extend(self, items: List[Any]) -> None:
+        self.add(items)
+
+    def _large(self):
+        return set(self._items)
+
+def _check_hashable(values: Iterable[Any]) -> None:
+    # Arrays arrive as lists, which cannot be hash fields or set members
+    for value in values:
+        if isinstance(value, (list, dict)):
+            raise CommandError('Hash fields and set members must be strings or numbers')
+
 class KeyValueStore:
-    """Thread-safe key-value store with memory limits."""
-    
-    def __init__(self, max_memory_mb: int = 100):
-        self._data: Dict[str, Tuple[Any, float]] = {}  # (value, timestamp)
+    """Thread-safe key-value store with memory limits and key expiration.
+
+    Expired keys are removed lazily when they are accessed and actively by
+    ``expire_cycle``, which pops deadlines from a heap in bounded slices.
+
+    With a ``value_encoder`` every value is converted once on write (for
+    example to its RESP encoding) and stored as the resulting bytes, whose
+    length is then its exact accounted size. ``value_decoder`` reverses it
+    for the few commands that read a value's contents, such as INCR.
+
+    Keys under WATCH get a version that every change to them bumps, so a
+    transaction can tell whether they were touched since.
+
+    ``on_evict`` is called with each key evicted to make room, while the
+    store lock is held.
+    """
+
+    def __init__(self, max_memory_mb: int = 100,
+                 eviction_policy: str = DEFAULT_EVICTION_POLICY,
+                 value_encoder: Optional[Callable[[Any], bytes]] = None,
+                 value_decoder: Optional[Callable[[bytes], Any]] = None,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self._data: Dict[str, Tuple[Any, float, int]] = {}  # (value, timestamp, size)
+        self._expires: Dict[str, float] = {}  # key -> unix deadline
+        self._expire_heap: List[Tuple[float, str]] = []
         self._lock = RLock()
-        self._max_memory = max_memory_mb * 1024 * 1024
+        self._max_memory = int(max_memory_mb * 1024 * 1024)
+        self._memory_used = 0
+        self._evicted_keys = 0
+        self._expired_keys = 0
+        self._policy = create_eviction_policy(eviction_policy)
+        self._value_encoder = value_encoder
+        self._value_decoder = value_decoder
+        self._on_evict = on_evict
+        self._versions: Dict[str, List[int]] = {}  # watched key -> [version, watchers]
 
     def get(self, key: str) -> Any:
         with self._lock:
-            item = self._data.get(key)
-            return item[0] if item else None
+            item = self._lookup(key)
+            if item is None:
+                return None
+            value = item[0]
+            if isinstance(value, Collection):
+                raise CommandError(WRONGTYPE)
+            self._policy.touch(key)
+            return value
 
-    def set(self, key: str, value: Any) -> bool:
-        with self._lock:
-            self._data[key] = (value, time.time())
+    def set(self, key: str, value: Any, ttl: Optional[float] = None,
+            keep_ttl: bool = False) -> bool:
+        """Store ``value`` under ``key``, expiring after ``ttl`` seconds if given.
+
+        Otherwise any previous expiration is cleared, unless ``keep_ttl``.
+        """
+        if self._value_encoder is not None:
+            value = self._value_encoder(value)
+            size = estimate_size(key) + len(value)
+        else:
+            size = estimate_size(key) + estimate_size(value)
+        if size > self._max_memory:
+            raise CommandError('Value too large')
 
-            if len(str(value)) > self._max_memory:
-                raise CommandError('Value too large')
-                
-            while self._estimate_memory_usage() > self._max_memory:
-                if not self._evict_oldest():
+        with self._lock:
+            # Make room before writing so the new entry is never its own victim.
+            while self._memory_used + size - self._size_of(key) > self._max_memory:
+                if not self._evict():
                     raise CommandError('Cannot free enough memory')
-                    
+
+            old = self._data.get(key)
+            if old is None:
+                self._policy.add(key)
+            else:
+                self._memory_used -= old[2]
+                self._policy.touch(key)
+            self._data[key] = (value, time.time(), size)
+            self._memory_used += size
+            if self._versions:
+                self._modified(key)
+
+            if ttl is not None:
+                self._set_deadline(key, time.time() + ttl)
+            elif self._expires and not keep_ttl:
+                self._expires.pop(key, None)
+            return True
+
+    def setnx(self, key: str, value: Any) -> bool:
+        """Store ``value`` only if ``key`` does not exist."""
+        with self._lock:
+            if self._lookup(key) is not None:
+                return False
+            return self.set(key, value)
+
+    def getset(self, key: str, value: Any) -> Any:
+        """Store ``value`` and return the previous value, or None."""
+        with self._lock:
+            old = self.get(key)
+            self.set(key, value)
+            return old
+
+    def incr(self, key: str, amount: int) -> int:
+        """Add ``amount`` to the integer at ``key`` (0 if missing), keeping its TTL.
+
+        The result is stored as text, so GET returns a string as in Redis.
+        """
+        with self._lock:
+            value = self._number(key, int) + amount
+            if not MIN_INT <= value <= MAX_INT:
+                raise CommandError('Increment or decrement would overflow')
+            self.set(key, '%d' % value, keep_ttl=True)
+            return value
+
+    def incr_float(self, key: str, amount: float) -> str:
+        """Add ``amount`` to the number at ``key`` and store the result as text, like Redis."""
+        with self._lock:
+            value = self._number(key, float) + amount
+            if not math.isfinite(value):
+                raise CommandError('Increment would produce NaN or Infinity')
+            text = '%d' % value if value.is_integer() and abs(value) < 1e17 else repr(value)
+            self.set(key, text, keep_ttl=True)
+            return text
+
+    def mget(self, keys: Iterable[str]) -> List[Any]:
+        """Fetch several keys while taking the lock once; collections read as None."""
+        with self._lock:
+            values = []
+            for key in keys:
+                item = self._lookup(key)
+                if item is None or isinstance(item[0], Collection):
+                    values.append(None)
+                else:
+                    self._policy.touch(key)
+                    values.append(item[0])
+            return values
+
+    def mset(self, items: Iterable[Tuple[str, Any]], ttl: Optional[float] = None) -> int:
+        """Store several ``(key, value)`` pairs while taking the lock once."""
+        with self._lock:
+            count = 0
+            for key, value in items:
+                if self.set(key, value, ttl):
+                    count += 1
+            return count
+
+    def msetnx(self, items: Iterable[Tuple[str, Any]]) -> bool:
+        """Store every pair, or none if any of the keys exists."""
+        items = list(items)
+        with self._lock:
+            if any(self._lookup(key) is not None for key, _ in items):
+                return False
+            self.mset(items)
             return True
 
     def delete(self, key: str) -> bool:
         with self._lock:
-            return self._data.pop(key, None) is not None
+            if self._lookup(key) is None:
+                return False
+            self._remove(key)
+            return True
 
     def flush(self) -> int:
         with self._lock:
             count = len(self._data)
             self._data.clear()
+            self._expires.clear()
+            self._expire_heap.clear()
+            self._policy.clear()
+            self._memory_used = 0
+            for entry in self._versions.values():
+                entry[0] += 1
             return count
 
-    def _estimate_memory_usage(self) -> int:
-        return sum(len(str(v)) + len(k) for k, (v, _) in self._data.items())
+    def expire(self, key: str, seconds: float) -> bool:
+        """Expire ``key`` after ``seconds``; returns False if the key is missing."""
+        return self.expire_at(key, time.time() + seconds)
+
+    def expire_at(self, key: str, deadline: float) -> bool:
+        """Expire ``key`` at the unix time ``deadline``."""
+        with self._lock:
+            if self._lookup(key) is None:
+                return False
+            if deadline <= time.time():
+                self._remove(key)
+                self._expired_keys += 1
+            else:
+                self._set_deadline(key, deadline)
+                if self._versions:
+                    self._modified(key)
+            return True
+
+    def ttl(self, key: str) -> float:
+        """Return the seconds left before ``key`` expires.
+
+        Like Redis, -2 means the key does not exist and -1 means it has no
+        expiration.
+        """
+        with self._lock:
+            if self._lookup(key) is None:
+                return -2
+            deadline = self._expires.get(key)
+            if deadline is None:
+                return -1
+            return max(0.0, deadline - time.time())
+
+    def persist(self, key: str) -> bool:
+        """Remove the expiration from ``key``; returns False if it had none."""
+        with self._lock:
+            if self._lookup(key) is None or self._expires.pop(key, None) is None:
+                return False
+            if self._versions:
+                self._modified(key)
+            return True
+
+    def key_type(self, key: str) -> str:
+        """Return ``string``, ``hash``, ``list`` or ``set``, or ``none`` if missing."""
+        with self._lock:
+            item = self._lookup(key)
+            if item is None:
+                return 'none'
+            return item[0].type_name if isinstance(item[0], Collection) else 'string'
+
+    def hset(self, key: str, pairs: List[Tuple[Any, Any]]) -> int:
+        """Set fields of the hash at ``key``; returns how many were new."""
+        _check_hashable(field for field, _ in pairs)
+        grow = sum(estimate_size(field) + estimate_size(value) for field, value in pairs)
+        return self._update(key, HashValue, lambda h: sum(h.set(f, v) for f, v in pairs), grow)
+
+    def hget(self, key: str, field: Any) -> Any:
+        _check_hashable((field,))
+        with self._lock:
+            value = self._collection(key, HashValue)
+            return None if value is None else value.get(field)
+
+    def hmget(self, key: str, fields: List[Any]) -> List[Any]:
+        _check_hashable(fields)
+        with self._lock:
+            value = self._collection(key, HashValue)
+            if value is None:
+                return [None] * len(fields)
+            return [value.get(field) for field in fields]
+
+    def hdel(self, key: str, fields: List[Any]) -> int:
+        _check_hashable(fields)
+        return self._update(key, HashValue, lambda h: sum(h.delete(f) for f in fields), default=0)
+
+    def hgetall(self, key: str) -> Dict[Any, Any]:
+        with self._lock:
+            value = self._collection(key, HashValue)
+            return {} if value is None else value.to_dict()
+
+    def lpush(self, key: str, values: List[Any]) -> int:
+        """Prepend ``values`` one at a time, so the last ends up first; returns the length."""
+        grow = sum(estimate_size(value) for value in values)
+        return self._update(key, ListValue, lambda l: l.push_left(values), grow)
+
+    def rpush(self, key: str, values: List[Any]) -> int:
+        grow = sum(estimate_size(value) for value in values)
+        return self._update(key, ListValue, lambda l: l.push_right(values), grow)
+
+    def lpop(self, key: str, count: int = 1) -> Optional[List[Any]]:
+        """Remove and return up to ``count`` elements from the head; None if missing."""
+        return self._update(key, ListValue, lambda l: l.pop_left(count))
+
+    def rpop(self, key: str, count: int = 1) -> Optional[List[Any]]:
+        return self._update(key, ListValue, lambda l: l.pop_right(count))
+
+    def lrange(self, key: str, start: int, stop: int) -> List[Any]:
+        with self._lock:
+            value = self._collection(key, ListValue)
+            return [] if value is None else value.range(start, stop)
+
+    def sadd(self, key: str, members: List[Any]) -> int:
+        """Add ``members`` to the set at ``key``; returns how many were new."""
+        _check_hashable(members)
+        grow = sum(estimate_size(member) for member in members)
+        return self._update(key, SetValue, lambda s: s.add(members), grow)
+
+    def srem(self, key: str, members: List[Any]) -> int:
+        _check_hashable(members)
+        return self._update(key, SetValue, lambda s: s.remove(members), default=0)
+
+    def sismember(self, key: str, member: Any) -> bool:
+        _check_hashable((member,))
+        with self._lock:
+            value = self._collection(key, SetValue)
+            return value is not None and value.contains(member)
+
+    def smembers(self, key: str) -> List[Any]:
+        with self._lock:
+            value = self._collection(key, SetValue)
+            return [] if value is None else value.flat()
+
+    def expire_cycle(self, time_budget: float = 0.001) -> bool:
+        """Reclaim expired keys for at most ``time_budget`` seconds.
+
+        Returns True if the budget ran out while expired keys remained, so
+        the caller can yield and call again.
+        """
+        with self._lock:
+            heap = self._expire_heap
+            now = time.time()
+            stop_at = time.perf_counter() + time_budget
+            processed = 0
+            while heap and heap[0][0] <= now:
+                deadline, key = heapq.heappop(heap)
+                # Heap entries go stale when a key is overwritten or persisted.
+                if self._expires.get(key) == deadline:
+                    self._remove(key)
+                    self._expired_keys += 1
+                processed += 1
+                if processed % 32 == 0 and time.perf_counter() >= stop_at:
+                    return bool(heap) and heap[0][0] <= now
+
+            if len(heap) > 2 * len(self._expires) + 1024:
+                self._expire_heap = [(d, k) for k, d in self._expires.items()]
+                heapq.heapify(self._expire_heap)
+            return False
+
+    def items(self) -> Iterator[Tuple[str, Any, Optional[float]]]:
+        """Yield ``(key, value, deadline)`` for every live key; deadline is None without a TTL."""
+        with self._lock:
+            now = time.time()
+            expires = self._expires
+            for key, (value, _, _) in self._data.items():
+                deadline = expires.get(key)
+                if deadline is None or deadline > now:
+                    yield key, value, deadline
+
+    def restore(self, entries: Iterable[Tuple[str, Any, Optional[float]]]) -> int:
+        """Bulk-insert ``(key, value, deadline)`` entries, skipping expired ones.
+
+        This is ``set`` unrolled for loading a snapshot: the lock is taken
+        once and the per-key bookkeeping is done inline.
+        """
+        encoder = self._value_encoder
+        data = self._data
+        add = self._policy.add
+        max_memory = self._max_memory
+        with self._lock:
+            now = time.time()
+            count = 0
+            for key, value, deadline in entries:
+                if deadline is not None and deadline <= now:
+                    continue
+                if isinstance(value, Collection):
+                    size = estimate_size(key) + COLLECTION_OVERHEAD + value.size
+                elif encoder is not None:
+                    value = encoder(value)
+                    size = estimate_size(key) + len(value)
+                else:
+                    size = estimate_size(key) + estimate_size(value)
+                if size > max_memory:
+                    raise CommandError('Value too large')
+                if key in data:
+                    self._remove(key)
+                while self._memory_used + size > max_memory:
+                    if not self._evict():
+                        raise CommandError('Cannot free enough memory')
+                data[key] = (value, now, size)
+                add(key)
+                self._memory_used += size
+                if self._versions:
+                    self._modified(key)
+                if deadline is not None:
+                    self._set_deadline(key, deadline)
+                count += 1
+            return count
+
+    def locked(self):
+        """Hold the store's lock, e.g. to run several commands atomically."""
+        return self._lock
+
+    def watch(self, keys: Iterable[str]) -> List[int]:
+        """Start tracking changes to ``keys``; returns their current versions."""
+        with self._lock:
+            versions = []
+            for key in keys:
+                entry = self._versions.get(key)
+                if entry is None:
+                    entry = self._versions[key] = [0, 0]
+                entry[1] += 1
+                versions.append(entry[0])
+            return versions
+
+    def unwatch(self, keys: Iterable[str]) -> None:
+        """Drop one watcher of each of ``keys``; unwatched keys stop being versioned."""
+        with self._lock:
+            for key in keys:
+                entry = self._versions.get(key)
+                if entry is not None:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._versions[key]
+
+    def changed(self, watched: Dict[str, int]) -> bool:
+        """Whether any key changed since ``watch`` returned its version in ``watched``."""
+        with self._lock:
+            for key in watched:
+                self._lookup(key)  # a key that expired meanwhile counts as changed
+            versions = self._versions
+            return any(versions[key][0] != version for key, version in watched.items())
+
+    def memory_usage(self, key: str) -> Any:
+        """Return the accounted size of ``key`` in bytes, or None if missing."""
+        with self._lock:
+            item = self._lookup(key)
+            return item[2] if item else None
+
+    def memory_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'used_memory': self._memory_used,
+                'max_memory': self._max_memory,
+                'keys': len(self._data),
+                'expires': len(self._expires),
+                'evicted_keys': self._evicted_keys,
+                'expired_keys': self._expired_keys,
+                'eviction_policy': self._policy.name,
+            }
+
+    def _lookup(self, key: str) -> Optional[Tuple[Any, float, int]]:
+        """Return the live entry for ``key``, expiring it lazily if due."""
+        item = self._data.get(key)
+        if item is not None and self._expires:
+            deadline = self._expires.get(key)
+            if deadline is not None and deadline <= time.time():
+                self._remove(key)
+                self._expired_keys += 1
+                return None
+        return item
+
+    def _collection(self, key: str, kind: type) -> Optional[Collection]:
+        """Return the live ``kind`` value at ``key``, None if missing, WRONGTYPE if not a ``kind``."""
+        item = self._lookup(key)
+        if item is None:
+            return None
+        if type(item[0]) is not kind:
+            raise CommandError(WRONGTYPE)
+        self._policy.touch(key)
+        return item[0]
 
-    def _evict_oldest(self) -> bool:
-        if not self._data:
+    def _update(self, key: str, kind: type, change: Callable[[Collection], Any],
+                grow: Optional[int] = None, default: Any = None) -> Any:
+        """Apply ``change`` to the ``kind`` collection at ``key`` and re-account its size.
+
+        A write that adds elements passes ``grow``, an upper bound on the
+        bytes it adds: room is made before the change and a missing key is
+        created. Otherwise a missing key is left alone and ``default`` is
+        returned. A collection left empty is deleted, as in Redis.
+        """
+        with self._lock:
+            existing = self._collection(key, kind)
+            if grow is None:
+                if existing is None:
+                    return default
+            else:
+                if existing is None:
+                    grow += estimate_size(key) + COLLECTION_OVERHEAD
+                if grow > self._max_memory:
+                    raise CommandError('Value too large')
+                while self._memory_used + grow > self._max_memory:
+                    if not self._evict():
+                        raise CommandError('Cannot free enough memory')
+            item = self._data.get(key)
+            if item is None:
+                # New, or evicted just now to make room
+                value, timestamp, old_size = kind(), time.time(), 0
+                self._policy.add(key)
+            else:
+                value, timestamp, old_size = item
+            result = change(value)
+            if self._versions:
+                self._modified(key)
+            if not value:
+                if item is None:
+                    self._policy.remove(key)
+                else:
+                    self._remove(key)
+                return result
+            size = estimate_size(key) + COLLECTION_OVERHEAD + value.size
+            self._data[key] = (value, timestamp, size)
+            self._memory_used += size - old_size
+            return result
+
+    def _number(self, key: str, kind: type) -> Any:
+        """The value at ``key`` as an int or float (``kind``); 0 if missing."""
+        item = self._lookup(key)
+        if item is None:
+            return kind(0)
+        value = item[0]
+        if isinstance(value, Collection):
+            raise CommandError(WRONGTYPE)
+        if self._value_decoder is not None:
+            value = self._value_decoder(value)
+        try:
+            if type(value) is int or isinstance(value, (str, bytes)):
+                return kind(value)
+            if type(value) is float and kind is float:
+                return value
+        except ValueError:
+            pass
+        if kind is int:
+            raise CommandError('Value is not an integer or out of range')
+        raise CommandError('Value is not a valid float')
+
+    def _modified(self, key: str) -> None:
+        entry = self._versions.get(key)
+        if entry is not None:
+            entry[0] += 1
+
+    def _set_deadline(self, key: str, deadline: float) -> None:
+        self._expires[key] = deadline
+        heapq.heappush(self._expire_heap, (deadline, key))
+
+    def _remove(self, key: str) -> None:
+        self._memory_used -= self._data.pop(key)[2]
+        self._policy.remove(key)
+        if self._expires:
+            self._expires.pop(key, None)
+        if self._versions:
+            self._modified(key)
+
+    def _size_of(self, key: str) -> int:
+        item = self._data.get(key)
+        return item[2] if item else 0
+
+    def _evict(self) -> bool:
+        victim = self._policy.victim()
+        if victim is None:
             return False
-        oldest_key = min(self._data.items(), key=lambda x: x[1][1])[0]
-        del self._data[oldest_key]
-        return True
\ No newline at end of file
+        self._remove(victim)
+        self._evicted_keys += 1
+        if self._on_evict is not None:
+            self._on_evict(victim)
+        return True
+
+
+class ShardedKeyValueStore:
+    """Key-value store split into shards that each have their own lock.
+
+    Keys are assigned to a shard by hash, and every shard gets an equal
+    slice of the memory budget and its own eviction policy. Multi-key
+    operations group keys by shard and take each shard lock once.
+
+    A value has to fit in its shard's slice, so the largest value is
+    ``max_memory_mb / shards`` rather than the whole budget. Use one shard
+    to store values close to the full limit.
+    """
+
+    def __init__(self, max_memory_mb: int = 100,
+                 eviction_policy: str = DEFAULT_EVICTION_POLICY, shards: int = 16,
+                 value_encoder: Optional[Callable[[Any], bytes]] = None,
+                 value_decoder: Optional[Callable[[bytes], Any]] = None,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        if shards < 1:
+            raise ValueError('Shard count must be at least 1')
+        self._max_memory = int(max_memory_mb * 1024 * 1024)
+        self._shards = [
+            KeyValueStore(max_memory_mb / shards, eviction_policy, value_encoder, value_decoder,
+                          on_evict)
+            for _ in range(shards)]
+
+    def _shard(self, key: str) -> KeyValueStore:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _group(self, keys: List[str]) -> Dict[int, List[int]]:
+        """Map each shard index to the positions of its keys in ``keys``."""
+        groups = defaultdict(list)
+        count = len(self._shards)
+        for pos, key in enumerate(keys):
+            groups[hash(key) % count].append(pos)
+        return groups
+
+    def get(self, key: str) -> Any:
+        return self._shard(key).get(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        return self._shard(key).set(key, value, ttl)
+
+    def setnx(self, key: str, value: Any) -> bool:
+        return self._shard(key).setnx(key, value)
+
+    def getset(self, key: str, value: Any) -> Any:
+        return self._shard(key).getset(key, value)
+
+    def incr(self, key: str, amount: int) -> int:
+        return self._shard(key).incr(key, amount)
+
+    def incr_float(self, key: str, amount: float) -> str:
+        return self._shard(key).incr_float(key, amount)
+
+    def mget(self, keys: Iterable[str]) -> List[Any]:
+        keys = list(keys)
+        results = [None] * len(keys)
+        for index, positions in self._group(keys).items():
+            values = self._shards[index].mget([keys[pos] for pos in positions])
+            for pos, value in zip(positions, values):
+                results[pos] = value
+        return results
+
+    def mset(self, items: Iterable[Tuple[str, Any]], ttl: Optional[float] = None) -> int:
+        items = list(items)
+        groups = self._group([key for key, _ in items])
+        return sum(self._shards[index].mset([items[pos] for pos in positions], ttl)
+                   for index, positions in groups.items())
+
+    def msetnx(self, items: Iterable[Tuple[str, Any]]) -> bool:
+        items = list(items)
+        with self.locked():
+            if any(self.key_type(key) != 'none' for key, _ in items):
+                return False
+            self.mset(items)
+            return True
+
+    def delete(self, key: str) -> bool:
+        return self._shard(key).delete(key)
+
+    def flush(self) -> int:
+        return sum(shard.flush() for shard in self._shards)
+
+    def expire(self, key: str, seconds: float) -> bool:
+        return self._shard(key).expire(key, seconds)
+
+    def expire_at(self, key: str, deadline: float) -> bool:
+        return self._shard(key).expire_at(key, deadline)
+
+    def ttl(self, key: str) -> float:
+        return self._shard(key).ttl(key)
+
+    def persist(self, key: str) -> bool:
+        return self._shard(key).persist(key)
+
+    def key_type(self, key: str) -> str:
+        return self._shard(key).key_type(key)
+
+    def hset(self, key: str, pairs: List[Tuple[Any, Any]]) -> int:
+        return self._shard(key).hset(key, pairs)
+
+    def hget(self, key: str, field: Any) -> Any:
+        return self._shard(key).hget(key, field)
+
+    def hmget(self, key: str, fields: List[Any]) -> List[Any]:
+        return self._shard(key).hmget(key, fields)
+
+    def hdel(self, key: str, fields: List[Any]) -> int:
+        return self._shard(key).hdel(key, fields)
+
+    def hgetall(self, key: str) -> Dict[Any, Any]:
+        return self._shard(key).hgetall(key)
+
+    def lpush(self, key: str, values: List[Any]) -> int:
+        return self._shard(key).lpush(key, values)
+
+    def rpush(self, key: str, values: List[Any]) -> int:
+        return self._shard(key).rpush(key, values)
+
+    def lpop(self, key: str, count: int = 1) -> Optional[List[Any]]:
+        return self._shard(key).lpop(key, count)
+
+    def rpop(self, key: str, count: int = 1) -> Optional[List[Any]]:
+        return self._shard(key).rpop(key, count)
+
+    def lrange(self, key: str, start: int, stop: int) -> List[Any]:
+        return self._shard(key).lrange(key, start, stop)
+
+    def sadd(self, key: str, members: List[Any]) -> int:
+        return self._shard(key).sadd(key, members)
+
+    def srem(self, key: str, members: List[Any]) -> int:
+        return self._shard(key).srem(key, members)
+
+    def sismember(self, key: str, member: Any) -> bool:
+        return self._shard(key).sismember(key, member)
+
+    def smembers(self, key: str) -> List[Any]:
+        return self._shard(key).smembers(key)
+
+    def expire_cycle(self, time_budget: float = 0.001) -> bool:
+        slice_budget = time_budget / len(self._shards)
+        pending = False
+        for shard in self._shards:
+            pending |= shard.expire_cycle(slice_budget)
+        return pending
+
+    def items(self) -> Iterator[Tuple[str, Any, Optional[float]]]:
+        for shard in self._shards:
+            yield from shard.items()
+
+    def restore(self, entries: Iterable[Tuple[str, Any, Optional[float]]]) -> int:
+        groups = defaultdict(list)
+        count = len(self._shards)
+        for entry in entries:
+            groups[hash(entry[0]) % count].append(entry)
+        return sum(self._shards[index].restore(group) for index, group in groups.items())
+
+    @contextmanager
+    def locked(self):
+        """Hold every shard's lock, always taken in the same order."""
+        with ExitStack() as stack:
+            for shard in self._shards:
+                stack.enter_context(shard.locked())
+            yield
+
+    def watch(self, keys: Iterable[str]) -> List[int]:
+        return [self._shard(key).watch((key,))[0] for key in keys]
+
+    def unwatch(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._shard(key).unwatch((key,))
+
+    def changed(self, watched: Dict[str, int]) -> bool:
+        return any(self._shard(key).changed({key: version}) for key, version in watched.items())
+
+    def memory_usage(self, key: str) -> Any:
+        return self._shard(key).memory_usage(key)
+
+    def memory_stats(self) -> Dict[str, int]:
+        stats = {'used_memory': 0, 'max_memory': self._max_memory, 'keys': 0,
+                 'expires': 0, 'evicted_keys': 0, 'expired_keys': 0}
+        for shard in self._shards:
+            shard_stats = shard.memory_stats()
+            for name in ('used_memory', 'keys', 'expires', 'evicted_keys', 'expired_keys'):
+                stats[name] += shard_stats[name]
+        stats['eviction_policy'] = shard_stats['eviction_policy']
+        stats['shards'] = len(self._shards)
+        return stats
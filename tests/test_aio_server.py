@@ -0,0 +1,149 @@
+import sys
+import os
+import asyncio
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from aio_server import AsyncioServer
+from server import Server, create_server
+
+def run(coro_fn, **kwargs):
+    async def main():
+        server = AsyncioServer(port=0, **kwargs)
+        await server.start()
+        try:
+            return await coro_fn(*server.address)
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+async def roundtrip(reader, writer, payload, reply_size):
+    writer.write(payload)
+    await writer.drain()
+    return await reader.readexactly(reply_size)
+
+def test_set_get():
+    async def scenario(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            assert await roundtrip(reader, writer,
+                                   b'*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n', 4) == b':1\r\n'
+            return await roundtrip(reader, writer, b'*2\r\n$3\r\nGET\r\n$1\r\nk\r\n', 7)
+        finally:
+            writer.close()
+    assert run(scenario) == b'$1\r\nv\r\n'
+
+def test_pipelined_requests_split_across_reads():
+    async def scenario(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            payload = b'*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n' * 3 + b'*2\r\n$3\r\nGET\r\n$1\r\nk\r\n'
+            writer.write(payload[:10])
+            await writer.drain()
+            await asyncio.sleep(0.01)
+            return await roundtrip(reader, writer, payload[10:], 19)
+        finally:
+            writer.close()
+    assert run(scenario) == b':1\r\n' * 3 + b'$1\r\nv\r\n'
+
+def test_unknown_command_returns_error():
+    async def scenario(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(b'*1\r\n$4\r\nNOPE\r\n')
+            return await reader.readline()
+        finally:
+            writer.close()
+    assert run(scenario).startswith(b'-')
+
+def test_multi_exec_and_watch_released_on_disconnect():
+    async def scenario(host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            payload = (b'*2\r\n$5\r\nWATCH\r\n$1\r\nk\r\n*1\r\n$5\r\nMULTI\r\n'
+                       b'*2\r\n$4\r\nINCR\r\n$1\r\nk\r\n*1\r\n$4\r\nEXEC\r\n'
+                       b'*2\r\n$5\r\nWATCH\r\n$1\r\nk\r\n')
+            return await roundtrip(reader, writer, payload, 32)
+        finally:
+            writer.close()
+            await asyncio.sleep(0.01)
+    async def main():
+        server = AsyncioServer(port=0, shards=1)
+        await server.start()
+        try:
+            reply = await scenario(*server.address)
+            return reply, server._kv._versions
+        finally:
+            await server.close()
+    assert asyncio.run(main()) == (b'+OK\r\n+OK\r\n+QUEUED\r\n*1\r\n:1\r\n+OK\r\n', {})
+
+def test_replication_is_refused(monkeypatch):
+    with pytest.raises(ValueError, match='gevent engine'):
+        AsyncioServer(port=0, replicaof='127.0.0.1:1')
+    monkeypatch.setenv('REPLICAOF', '127.0.0.1:1')
+    with pytest.raises(ValueError, match='gevent engine'):
+        AsyncioServer(port=0)
+
+def test_main_refuses_asyncio_replica():
+    from server import main
+    with pytest.raises(SystemExit):
+        main(['--engine', 'asyncio', '--replicaof', '127.0.0.1:1'])
+
+def test_max_clients_rejects_extra_connections():
+    async def scenario(host, port):
+        first = await asyncio.open_connection(host, port)
+        second = await asyncio.open_connection(host, port)
+        try:
+            return await second[0].readline()
+        finally:
+            first[1].close()
+            second[1].close()
+    assert run(scenario, max_clients=1) == b'-ERR max number of clients reached\r\n'
+
+def test_create_server_engines():
+    assert type(create_server('gevent', port=0)) is Server
+    assert isinstance(create_server('asyncio', port=0), AsyncioServer)
+    with pytest.raises(ValueError):
+        create_server('threads')
+
+def test_info_counts_connections_and_bytes():
+    request = b'*2\r\n$3\r\nGET\r\n$1\r\nk\r\n'
+    async def main():
+        server = AsyncioServer(port=0, max_clients=1)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection(*server.address)
+            await roundtrip(reader, writer, request, 5)
+            rejected = await asyncio.open_connection(*server.address)
+            await rejected[0].readline()
+            info = server.info('stats', 'clients')
+            writer.close()
+            rejected[1].close()
+            return info
+        finally:
+            await server.close()
+    info = asyncio.run(main())
+    assert info['stats']['total_net_input_bytes'] == len(request)
+    assert info['stats']['total_net_output_bytes'] == 5
+    assert info['stats']['rejected_connections'] == 1
+    assert info['stats']['total_commands_processed'] == 1
+    assert info['clients']['connected_clients'] == 1
+
+def test_ready_and_shutdown_drains_connections():
+    async def main():
+        server = AsyncioServer(port=0)
+        serving = asyncio.ensure_future(server.serve_forever())
+        while not server.ready:
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_connection(*server.address)
+        writer.write(b'*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n')
+        await writer.drain()
+        await asyncio.sleep(0.05)
+        await server.shutdown(timeout=5)
+        replies = await reader.read()
+        writer.close()
+        await asyncio.wait_for(serving, 5)
+        return replies, server.ready
+    assert asyncio.run(main()) == (b':1\r\n', False)
@@ -0,0 +1,161 @@
+import sys
+import os
+import time
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from aof import AppendOnlyLog, read_log, rewrite_commands
+from server import Server
+from storage import KeyValueStore, CommandError
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'appendonly.aof')
+
+def restart(server, path, **kwargs):
+    server._aof.close()
+    return Server(port=0, aof_path=path, **kwargs)
+
+def test_logs_only_writes_that_changed_the_store(path):
+    server = Server(port=0, aof_path=path)
+    server.get_response(['SET', 'a', '1'])
+    server.get_response(['GET', 'a'])
+    server.get_response(['DELETE', 'missing'])
+    server.get_response(['MSET', 'b', '2', 'c', ['x', 'y']])
+    server.get_response(['DELETE', 'a'])
+    server._flush_log()
+    assert list(read_log(path)) == [
+        ['SET', 'a', '1'], ['MSET', 'b', '2', 'c', ['x', 'y']], ['DELETE', 'a']]
+
+def test_relative_ttls_are_logged_as_deadlines(path):
+    server = Server(port=0, aof_path=path)
+    server.get_response(['SET', 'a', '1', 'EX', '100'])
+    server.get_response(['SET', 'b', '1'])
+    server.get_response(['PEXPIRE', 'b', '50000'])
+    server._flush_log()
+    commands = list(read_log(path))
+    assert commands[1][:2] == ['PEXPIREAT', 'a']
+    assert commands[1][2] == pytest.approx((time.time() + 100) * 1000, abs=5000)
+    assert commands[3][:2] == ['PEXPIREAT', 'b']
+
+def test_replay_on_startup(path):
+    server = Server(port=0, aof_path=path, aof_fsync='always')
+    server.get_response(['MSET', 'a', '1', 'b', '2'])
+    server.get_response(['SET', 'c', '3', 'PX', '100000'])
+    server.get_response(['DELETE', 'b'])
+    server.get_response(['PERSIST', 'c'])
+    server._flush_log()
+
+    restarted = restart(server, path)
+    assert restarted.get_response(['MGET', 'a', 'b', 'c']) == ['1', None, '3']
+    assert restarted.get_response(['TTL', 'c']) == -1
+
+def test_replay_ignores_truncated_tail(path):
+    server = Server(port=0, aof_path=path)
+    server.get_response(['SET', 'a', '1'])
+    server._flush_log()
+    with open(path, 'ab') as fh:
+        fh.write(b'*3\r\n$3\r\nSET\r\n$1\r\nb')
+    restarted = restart(server, path)
+    assert restarted.get_response(['GET', 'a']) == '1'
+    assert restarted.get_response(['GET', 'b']) is None
+
+def test_always_policy_shares_fsyncs(path):
+    log = AppendOnlyLog(path, fsync='always')
+    log.append(['SET', 'a', '1'])
+    log.append(['SET', 'b', '2'])
+    log.flush()
+    log.flush()
+    assert log.fsyncs == 1
+    log.close()
+
+def test_rejects_unknown_policy(path):
+    with pytest.raises(ValueError):
+        AppendOnlyLog(path, fsync='sometimes')
+
+def test_rewrite_compacts_and_keeps_concurrent_writes(path):
+    server = Server(port=0, aof_path=path)
+    for i in range(50):
+        server.get_response(['SET', 'counter', str(i)])
+    server.get_response(['SET', 'ttl', 'v', 'EX', '100'])
+    server._flush_log()
+    before = os.path.getsize(path)
+
+    server.get_response(['BGREWRITEAOF'])
+    with pytest.raises(CommandError):
+        server.get_response(['BGREWRITEAOF'])
+    server.get_response(['SET', 'late', 'write'])
+    server._aof.wait_rewrite()
+
+    assert os.path.getsize(path) < before
+    restarted = restart(server, path)
+    assert restarted.get_response(['MGET', 'counter', 'late']) == ['49', 'write']
+    assert 90 < restarted.get_response(['TTL', 'ttl']) <= 100
+
+def test_rewrite_commands_batch_keys_without_ttl():
+    store = KeyValueStore()
+    store.set('a', '1')
+    store.set('b', '2')
+    store.set('c', '3', ttl=10)
+    commands = list(rewrite_commands(store))
+    assert ['MSET', 'a', '1', 'b', '2'] in commands
+    assert ['SET', 'c', '3'] in commands
+
+def test_keys_named_like_mset_options_replay(path):
+    server = Server(port=0, aof_path=path)
+    server.get_response(['MSETNX', 'a', '1', 'EX', '5'])
+    server.get_response(['MSETEX', '2', 'b', '2', 'px', '3', 'EX', '60'])
+    server._flush_log()
+    assert list(read_log(path))[:2] == [['MSET', 'a', '1', 'EX', '5'], ['MSET', 'b', '2', 'px', '3']]
+
+    restarted = restart(server, path)
+    assert restarted.get_response(['MGET', 'a', 'EX', 'b', 'px']) == ['1', '5', '2', '3']
+    assert restarted.get_response(['TTL', 'a']) == -1
+    assert 50 < restarted.get_response(['TTL', 'px']) <= 60
+
+def test_evictions_are_logged_as_deletes(path):
+    server = Server(port=0, aof_path=path, shards=1, max_memory_mb=0.01)
+    keys = [f'key{i}' for i in range(20)]
+    for key in keys:
+        server.get_response(['SET', key, 'x' * 1000])
+    server._flush_log()
+    assert ['DELETE', 'key0'] in list(read_log(path))
+
+    values = server.get_response(['MGET'] + keys)
+    restarted = restart(server, path, shards=1)
+    assert restarted.get_response(['MGET'] + keys) == values
+
+def test_rewrite_keeps_keys_named_like_mset_options(path):
+    server = Server(port=0, aof_path=path)
+    for key in ('a', 'PX', 'ex'):
+        server.get_response(['SET', key, '1000'])
+    server._aof.rewrite(server._kv)
+    server._aof.wait_rewrite()
+
+    restarted = restart(server, path)
+    assert restarted.get_response(['MGET', 'a', 'PX', 'ex']) == ['1000'] * 3
+    assert restarted.get_response(['TTL', 'a']) == -1
+
+def test_collections_replay_and_rewrite(path):
+    server = Server(port=0, aof_path=path)
+    server.get_response(['HSET', 'h', 'a', '1', 'b', '2'])
+    server.get_response(['HDEL', 'h', 'a'])
+    server.get_response(['RPUSH', 'l', 'x', 'y', 'z'])
+    server.get_response(['LPOP', 'l'])
+    server.get_response(['SADD', 's', 'm', 'n'])
+    server.get_response(['SREM', 's', 'n'])
+    server._flush_log()
+
+    restarted = restart(server, path)
+    assert restarted.get_response(['HGETALL', 'h']) == {'b': '2'}
+    assert restarted.get_response(['LRANGE', 'l', '0', '-1']) == ['y', 'z']
+    assert restarted.get_response(['SMEMBERS', 's']) == ['m']
+
+    store = KeyValueStore()
+    store.rpush('big', list(range(300)))
+    store.hset('h', [('f', 'v')])
+    commands = list(rewrite_commands(store))
+    assert [command[0] for command in commands] == ['RPUSH', 'RPUSH', 'HSET']
+    assert commands[0][2:] + commands[1][2:] == list(range(300))
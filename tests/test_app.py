@@ -0,0 +1,129 @@
+import sys
+import os
+import http.client
+import json
+import socket
+import subprocess
+import time
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+APP = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/app.py'))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_app(transport):
+    """Launch app.py and wait for /readyz; returns (process, port, seconds to ready)."""
+    port = free_port()
+    env = dict(os.environ, SERVER_ADDRESS='127.0.0.1', SERVER_PORT=str(port),
+               RESP_PORT=str(free_port()), LOG_LEVEL='WARNING', API_TRANSPORT=transport)
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, APP], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            if request(port, 'GET', '/readyz')[0] == 200:
+                return process, port, time.monotonic() - start
+        except OSError:
+            pass
+        if process.poll() is not None or time.monotonic() - start > 20:
+            process.kill()
+            raise RuntimeError('app.py did not become ready')
+        time.sleep(0.01)
+
+@pytest.fixture(scope='module', params=['embedded', 'tcp'])
+def api(request):
+    process, port, _ = start_app(request.param)
+    yield port
+    process.terminate()
+    process.wait()
+
+def request(port, method, path, body=None, content_type='application/json'):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        return response.status, response.read().decode('utf-8')
+    finally:
+        conn.close()
+
+def test_pipeline_runs_mixed_commands(api):
+    status, body = request(api, 'POST', '/pipeline', json.dumps({'commands': [
+        ['SET', 'p1', 'v1'], ['GET', 'p1'], ['EXPIRE', 'p1', 'soon'], ['DELETE', 'p1']]}))
+    assert status == 200
+    results = json.loads(body)['results']
+    assert results[:2] == [1, 'v1']
+    assert 'error' in results[2]
+    assert results[3] == 1
+
+def test_pipeline_runs_transactions(api):
+    status, body = request(api, 'POST', '/pipeline', json.dumps({'commands': [
+        ['MULTI'], ['INCR', 'tx'], ['INCRBY', 'tx', 4], ['EXEC']]}))
+    assert status == 200
+    assert json.loads(body)['results'] == ['OK', 'QUEUED', 'QUEUED', [1, 5]]
+
+def test_pipeline_rejects_unterminated_multi(api):
+    status, body = request(api, 'POST', '/pipeline', json.dumps([['MULTI'], ['INCR', 'open']]))
+    assert (status, json.loads(body)) == (400, {'error': 'MULTI without EXEC or DISCARD'})
+    status, body = request(api, 'POST', '/pipeline', json.dumps([['SET', 'after', '1'], ['GET', 'open']]))
+    assert json.loads(body)['results'] == [1, None]
+
+def test_pipeline_rejects_bad_input(api):
+    assert request(api, 'POST', '/pipeline', json.dumps({'commands': 'GET a'}))[0] == 400
+    assert request(api, 'POST', '/pipeline', json.dumps([['PSYNC', '?', 0]]))[0] == 400
+
+def test_ndjson_import_and_export(api):
+    count = 2500
+    lines = ''.join(json.dumps({'key': f'bulk:{i}', 'value': f'v{i}'}) + '\n'
+                    for i in range(count))
+    status, body = request(api, 'POST', '/mset/stream', lines, 'application/x-ndjson')
+    assert (status, json.loads(body)) == (200, {'result': count})
+
+    keys = ''.join(json.dumps(f'bulk:{i}') + '\n' for i in range(0, count, 2))
+    keys += json.dumps({'key': 'missing'}) + '\n'
+    status, body = request(api, 'POST', '/mget/stream', keys, 'application/x-ndjson')
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert status == 200 and len(rows) == count // 2 + 1
+    assert rows[1] == {'key': 'bulk:2', 'value': 'v2'}
+    assert rows[-1] == {'key': 'missing', 'value': None}
+
+def test_large_mset_is_batched(api):
+    data = {f'big:{i}': i for i in range(2500)}
+    status, body = request(api, 'POST', '/mset', json.dumps(data))
+    assert (status, json.loads(body)) == (200, {'result': 2500})
+    status, body = request(api, 'GET', '/get/big:2499')
+    assert json.loads(body)['value'] == 2499
+
+def test_mset_keys_named_like_options(api):
+    status, _ = request(api, 'POST', '/mset', json.dumps({'opt:a': '1', 'EX': '5'}))
+    assert status == 200
+    batched = {f'opt:{i}': i for i in range(1500)}
+    batched['PX'] = 1000
+    assert request(api, 'POST', '/mset', json.dumps(batched))[0] == 200
+    lines = json.dumps({'key': 'opt:b', 'value': '2'}) + '\n' + json.dumps({'key': 'ex', 'value': '3'})
+    assert request(api, 'POST', '/mset/stream', lines, 'application/x-ndjson')[0] == 200
+    status, body = request(api, 'POST', '/pipeline', json.dumps({'commands': [
+        ['MGET', 'EX', 'PX', 'ex'], ['TTL', 'opt:a'], ['TTL', 'opt:1499'], ['TTL', 'opt:b']]}))
+    assert json.loads(body)['results'] == [['5', 1000, '3'], -1, -1, -1]
+
+def test_health_endpoints(api):
+    status, body = request(api, 'GET', '/healthz')
+    assert (status, json.loads(body)) == (200, {'status': 'ok'})
+    status, body = request(api, 'GET', '/readyz')
+    assert (status, json.loads(body)) == (200, {'status': 'ready'})
+
+def test_starts_without_fixed_delay_and_exits_cleanly():
+    process, port, seconds = start_app('embedded')
+    try:
+        # Startup used to include a fixed two second sleep
+        assert seconds < 2
+        status, _ = request(port, 'POST', '/set', json.dumps({'key': 'k', 'value': 'v'}))
+        assert status == 200
+    finally:
+        process.terminate()
+    assert process.wait(10) == 0
@@ -0,0 +1,47 @@
+import sys
+import os
+import argparse
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from benchmark import RespTarget, Workload, parse_size_range, populate, run_benchmark
+from server import Server
+
+@pytest.fixture
+def server():
+    server = Server(port=0, shards=1)
+    server._server.start()
+    yield server
+    server._server.stop()
+
+def test_parse_size_range():
+    assert parse_size_range('64') == (64, 64)
+    assert parse_size_range('16-1024') == (16, 1024)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_size_range('10-1')
+
+def test_workload_mix_and_sizes():
+    workload = Workload(keyspace=10, value_size=(8, 32), read_ratio=0.8, seed=1)
+    ops = workload.batch(5000)
+    reads = sum(op == 'get' for op, _, _ in ops)
+    assert 0.75 < reads / len(ops) < 0.85
+    assert all(8 <= len(value) <= 32 for op, _, value in ops if op == 'set')
+    assert len({key for _, key, _ in ops}) == 10
+
+def test_resp_benchmark(server):
+    workload = Workload(keyspace=100, value_size=(4, 16), seed=2)
+    make_target = lambda: RespTarget('127.0.0.1', server._server.server_port)
+    target = make_target()
+    populate(target, workload)
+    target.close()
+    assert server._kv.memory_stats()['keys'] == 100
+
+    result = run_benchmark(make_target, workload, clients=4, requests=1001, pipeline=8)
+    assert (result['ops'], result['errors']) == (1001, 0)
+    assert result['ops_per_sec'] > 0
+    latency = result['latency_ms']
+    assert latency['all']['count'] == 1001
+    assert latency['get']['count'] + latency['set']['count'] == 1001
+    assert latency['all']['p50'] <= latency['all']['p999']
@@ -7,7 +7,8 @@ from socket import error as socket_error
 # Add the parent directory to the sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
-from client import Client
+import gevent
+from client import Client, ConnectionPool, ClusterClient, HashRing
 from protocol import ProtocolHandler, Error
 from storage import CommandError
 
@@ -93,4 +94,362 @@ def test_client_init():
         mock_socket_inst.makefile.return_value = MagicMock()
         client = Client()
         mock_socket_inst.connect.assert_called_once_with(('127.0.0.1', 31337))
-        mock_socket_inst.makefile.assert_called_once_with('rwb')
\ No newline at end of file
+        mock_socket_inst.makefile.assert_called_once_with('rwb')
+
+def test_memory_usage(client):
+    with patch.object(ProtocolHandler, 'write_response') as mock_write, \
+         patch.object(ProtocolHandler, 'handle_request', return_value=42):
+        assert client.memory_usage('key') == 42
+        mock_write.assert_called_once_with(client._fh, ('MEMORY', 'USAGE', 'key'))
+
+def test_set_with_expiry(client):
+    with patch.object(ProtocolHandler, 'write_response') as mock_write, \
+         patch.object(ProtocolHandler, 'handle_request', return_value=1):
+        client.set('key', 'value', ex=10)
+        mock_write.assert_called_once_with(client._fh, ('SET', 'key', 'value', 'EX', 10))
+
+def test_mset_with_expiry(client):
+    with patch.object(ProtocolHandler, 'write_response') as mock_write, \
+         patch.object(ProtocolHandler, 'handle_request', return_value=2):
+        client.mset('key1', 'value1', 'key2', 'value2', px=500)
+        mock_write.assert_called_once_with(
+            client._fh, ('MSETEX', 2, 'key1', 'value1', 'key2', 'value2', 'PX', 500))
+
+def test_set_with_both_expiry_options(client):
+    with pytest.raises(CommandError, match='Only one of ex and px may be given'):
+        client.set('key', 'value', ex=1, px=1000)
+
+
+@pytest.fixture
+def sockets():
+    with patch('client.socket.socket') as mock_socket:
+        mock_socket.side_effect = lambda *args: MagicMock()
+        yield mock_socket
+
+def test_pool_reuses_connections(sockets):
+    pool = ConnectionPool()
+    with pool.connection() as first:
+        assert pool.stats()['in_use'] == 1
+    with pool.connection() as second:
+        assert second is first
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['checkouts'] == 2
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+
+def test_pool_checkout_timeout(sockets):
+    pool = ConnectionPool(max_connections=1, checkout_timeout=0.01)
+    pool.get_connection()
+    with pytest.raises(CommandError, match='Timed out waiting for a pooled connection'):
+        pool.get_connection()
+    stats = pool.stats()
+    assert stats['waits'] == 1
+    assert stats['timeouts'] == 1
+
+def test_pool_waiter_receives_released_connection(sockets):
+    pool = ConnectionPool(max_connections=1, checkout_timeout=1)
+    client = pool.get_connection()
+    waiter = gevent.spawn(pool.get_connection)
+    gevent.sleep(0)
+    pool.release(client)
+    assert waiter.get(timeout=1) is client
+    assert pool.stats()['wait_time_max'] > 0
+
+def test_pool_discards_broken_connections(sockets):
+    pool = ConnectionPool()
+    with pool.connection() as client:
+        client._broken = True
+    assert client._fh.close.called
+    with pool.connection() as replacement:
+        assert replacement is not client
+    assert pool.stats()['discarded'] == 1
+
+def test_pool_retires_connections_past_max_lifetime(sockets):
+    pool = ConnectionPool(max_lifetime=0)
+    with pool.connection():
+        pass
+    assert pool.stats()['idle'] == 0
+    assert pool.stats()['discarded'] == 1
+
+def test_pool_reaps_idle_connections(sockets):
+    pool = ConnectionPool(max_idle_time=60)
+    with pool.connection() as client:
+        pass
+    client._last_used -= 120
+    assert pool.reap() == 1
+    assert pool.stats()['idle'] == 0
+
+def test_pool_health_checks_idle_connections(sockets):
+    pool = ConnectionPool(health_check_interval=0)
+    with pool.connection() as client:
+        pass
+    with patch.object(client, 'is_alive', return_value=False):
+        with pool.connection() as replacement:
+            assert replacement is not client
+    assert pool.stats()['created'] == 2
+
+def test_pool_close(sockets):
+    pool = ConnectionPool()
+    with pool.connection():
+        pass
+    pool.close()
+    assert pool.stats()['idle'] == 0
+    with pytest.raises(CommandError, match='Connection pool is closed'):
+        pool.get_connection()
+
+def test_execute_marks_client_broken_on_socket_error(client):
+    with patch.object(ProtocolHandler, 'write_response', side_effect=socket_error('reset')):
+        with pytest.raises(CommandError):
+            client.get('key')
+    assert client.is_alive() is False
+
+def test_pipeline_sends_one_write(client):
+    with patch.object(ProtocolHandler, 'handle_request', side_effect=[1, 1, 'value']):
+        with client.pipeline() as pipe:
+            pipe.set('key', 'value').set('key2', 'value2')
+            pipe.get('key')
+            assert len(pipe) == 3
+            assert pipe.execute() == [1, 1, 'value']
+    client._fh.write.assert_called_once_with(
+        b'*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n'
+        b'*3\r\n$3\r\nSET\r\n$4\r\nkey2\r\n$6\r\nvalue2\r\n'
+        b'*2\r\n$3\r\nGET\r\n$3\r\nkey\r\n')
+    client._fh.flush.assert_called_once()
+
+def test_pipeline_errors_are_returned_in_place(client):
+    with patch.object(ProtocolHandler, 'handle_request',
+                      side_effect=[1, Error('bad command'), 'value']):
+        pipe = client.pipeline()
+        pipe.set('key', 'value')
+        pipe.execute_command('BOGUS')
+        pipe.get('key')
+        results = pipe.execute()
+    assert results[0] == 1
+    assert isinstance(results[1], CommandError)
+    assert str(results[1]) == 'bad command'
+    assert results[2] == 'value'
+
+def test_pipeline_auto_flush_by_command_count(client):
+    with patch.object(ProtocolHandler, 'handle_request', return_value=1):
+        pipe = client.pipeline(max_commands=2)
+        for i in range(5):
+            pipe.set(f'key{i}', 'value')
+        assert client._fh.write.call_count == 2
+        assert pipe.execute() == [1] * 5
+    assert client._fh.write.call_count == 3
+
+def test_pipeline_auto_flush_by_size(client):
+    with patch.object(ProtocolHandler, 'handle_request', return_value=1):
+        pipe = client.pipeline(max_bytes=64)
+        pipe.set('key', 'x' * 100)
+        assert client._fh.write.call_count == 1
+        assert pipe.execute() == [1]
+
+def test_local_pipeline_runs_in_batches():
+    from client import LocalClient
+    from server import Server
+    local = LocalClient(Server(port=0))
+    pipe = local.pipeline(max_commands=8)
+    for i in range(50):
+        pipe.set(f'key{i}', 'value')
+        assert len(pipe._commands) < 8
+    assert local.get('key47') == 'value'
+    assert len(pipe) == 50
+    assert pipe.execute() == [1] * 50
+    assert pipe.execute() == []
+
+    pipe = local.pipeline(max_bytes=64)
+    pipe.set('big', 'x' * 100)
+    assert local.get('big') == 'x' * 100
+    assert pipe.execute() == [1]
+
+def test_pipeline_context_discards_on_exception(client):
+    with pytest.raises(RuntimeError):
+        with client.pipeline() as pipe:
+            pipe.set('key', 'value')
+            raise RuntimeError('abort')
+    client._fh.write.assert_not_called()
+
+def test_pipeline_socket_error_marks_client_broken(client):
+    client._fh.write.side_effect = socket_error('reset')
+    pipe = client.pipeline()
+    pipe.get('key')
+    with pytest.raises(CommandError, match='Connection error: reset'):
+        pipe.execute()
+    assert client.is_alive() is False
+
+def test_hash_ring_moves_about_one_nth_of_keys():
+    ring = HashRing([('10.0.0.%d' % i, 31337) for i in range(4)])
+    keys = ['key:%d' % i for i in range(20000)]
+    before = {key: ring.get(key) for key in keys}
+    shares = [list(before.values()).count(node) / len(keys) for node in ring.nodes]
+    assert all(0.15 < share < 0.35 for share in shares)
+
+    added = ('10.0.0.4', 31337)
+    ring.add(added)
+    moved = [key for key in keys if ring.get(key) != before[key]]
+    assert 0.12 < len(moved) / len(keys) < 0.28
+    assert all(ring.get(key) == added for key in moved)
+
+    ring.remove(added)
+    assert all(ring.get(key) == before[key] for key in keys)
+
+@pytest.fixture
+def cluster_servers():
+    from server import Server
+    servers = [Server(port=0, shards=1) for _ in range(3)]
+    for server in servers:
+        server._server.start()
+    yield servers
+    for server in servers:
+        server._server.stop()
+
+def test_cluster_client_spreads_keys(cluster_servers):
+    nodes = ['127.0.0.1:%d' % server._server.server_port for server in cluster_servers]
+    with ClusterClient(nodes, batch_size=7) as cluster:
+        keys = ['key:%d' % i for i in range(60)]
+        assert cluster.mset(*[arg for key in keys for arg in (key, key.upper())]) == 60
+        assert cluster.mget(*reversed(keys), 'missing') == [key.upper() for key in reversed(keys)] + [None]
+        assert cluster.set('single', 'v') == 1
+        assert cluster.get('single') == 'v'
+        assert all(server._kv.memory_stats()['keys'] > 0 for server in cluster_servers)
+        assert sum(server._kv.memory_stats()['keys'] for server in cluster_servers) == 61
+        assert cluster.flush() == 61
+
+def test_cluster_client_split_mset_keeps_keys_named_like_options(cluster_servers):
+    nodes = ['127.0.0.1:%d' % server._server.server_port for server in cluster_servers]
+    with ClusterClient(nodes, batch_size=1) as cluster:
+        items = ['a', '1', 'EX', '5', 'b', '2', 'px', '3']
+        assert cluster.mset(*items) == 4
+        assert cluster.mget('a', 'EX', 'b', 'px') == ['1', '5', '2', '3']
+        assert cluster.ttl('a') == -1
+        cluster.flush()
+        assert cluster.mset(*items, ex=100) == 4
+        assert cluster.mget('a', 'EX', 'b', 'px') == ['1', '5', '2', '3']
+        assert all(90 < cluster.ttl(key) <= 100 for key in ('a', 'EX', 'b', 'px'))
+
+def test_cluster_client_rejects_unroutable_commands(cluster_servers):
+    with ClusterClient(['127.0.0.1:%d' % cluster_servers[0]._server.server_port]) as cluster:
+        with pytest.raises(CommandError):
+            cluster.memory_stats()
+
+@pytest.mark.parametrize('encoded', [False, True])
+def test_mset_keys_named_like_options(encoded):
+    from server import Server
+    server = Server(port=0, encoded_values=encoded)
+    server._server.start()
+    try:
+        client = Client(port=server._server.server_port)
+        assert client.mset('a', '1', 'EX', '5') == 2
+        assert client.mset('b', '2', 'PX', '6', ex=100) == 2
+        assert client.mget('a', 'EX', 'b', 'PX') == ['1', '5', '2', '6']
+        assert client.ttl('a') == -1
+        assert 90 < client.ttl('PX') <= 100
+        client.close()
+    finally:
+        server._server.stop()
+
+@pytest.mark.parametrize('encoded', [False, True])
+def test_local_client_matches_tcp_client(encoded):
+    from client import LocalClient
+    from server import Server
+    server = Server(port=0, shards=1, encoded_values=encoded)
+    server._server.start()
+    try:
+        remote = Client(port=server._server.server_port)
+        local = LocalClient(server)
+        calls = [
+            ('set', 'a', 'text'), ('set', 'b', ['x', 1, 2.5]), ('set', 'c', 1.5),
+            ('get', 'a'), ('get', 'b'), ('get', 'c'), ('get', 'missing'),
+            ('mset', 'd', 'e', 'f', True), ('mget', 'a', 'd', 'f', 'missing'),
+            ('expire', 'a', 100), ('ttl', 'a'), ('delete', 'a'), ('ping',), ('ping', 'hi'),
+            ('hset', 'h', 'f', 'v', 'n', 1), ('hgetall', 'h'), ('hmget', 'h', 'f', 'x'),
+            ('rpush', 'l', 'a', 'b'), ('lpop', 'l'), ('lrange', 'l', 0, -1),
+            ('sadd', 's', 'm'), ('smembers', 's'), ('type', 'h'),
+            ('incr', 'n'), ('incrby', 'n', 5), ('incrbyfloat', 'n', 0.5), ('getset', 'n', 'x'),
+            ('setnx', 'n', 'y'), ('msetnx', 'n', 'y', 'o', 'z'), ('multi',), ('incr', 'i'),
+            ('hget', 'i', 'f'), ('exec',),
+        ]
+        expected = [getattr(remote, name)(*args) for name, *args in calls]
+        server.flush()
+        results = [getattr(local, name)(*args) for name, *args in calls]
+        # EXEC replies hold errors as exceptions, which only compare by message
+        assert str(results[-1][1]) == str(expected[-1][1])
+        assert results[:-1] == expected[:-1] and results[-1][0] == expected[-1][0]
+        with pytest.raises(CommandError) as remote_error:
+            remote.expire('a', 'soon')
+        with pytest.raises(CommandError) as local_error:
+            local.expire('a', 'soon')
+        assert str(local_error.value) == str(remote_error.value)
+        assert local.execute('ROLE')['role'] == remote.execute('ROLE')['role']
+        with pytest.raises(CommandError):
+            local.execute('PSYNC', '?', 0)
+
+        with local.pipeline() as pipe:
+            pipe.set('p', '1').get('p').expire('p', 'x')
+            results = pipe.execute()
+        assert results[:2] == [1, '1'] and isinstance(results[2], CommandError)
+        remote.close()
+    finally:
+        server._server.stop()
+
+def test_transaction_through_pipeline_and_watch():
+    from server import Server
+    server = Server(port=0)
+    server._server.start()
+    try:
+        client, other = Client(port=server._server.server_port), Client(port=server._server.server_port)
+        client.watch('w')
+        pipe = client.pipeline()
+        pipe.multi().incr('w').hset('w', 'f', 'v').exec()
+        results = pipe.execute()
+        assert results[:3] == ['OK', 'QUEUED', 'QUEUED']
+        assert results[3][0] == 1 and isinstance(results[3][1], CommandError)
+
+        client.watch('w')
+        other.incr('w')
+        client.multi()
+        client.incr('w')
+        assert client.exec() is None
+        assert other.get('w') == '2'
+        client.close()
+        other.close()
+    finally:
+        server._server.stop()
+
+def test_pool_resets_transactions_between_borrowers():
+    from server import Server
+    server = Server(port=0, shards=1)
+    server._server.start()
+    try:
+        pool = ConnectionPool(port=server._server.server_port, max_connections=1)
+        with pool.connection() as first:
+            first.watch('w')
+            pipe = first.pipeline()
+            pipe.execute_command('multi').incr('x')
+            assert pipe.execute() == ['OK', 'QUEUED']
+        with pool.connection() as second:
+            assert second is first
+            assert second.set('y', '1') == 1
+            assert second.get('x') is None
+        assert server._kv._versions == {}
+        assert pool.stats()['created'] == 1
+        pool.close()
+    finally:
+        server._server.stop()
+
+def test_local_pool_gives_each_checkout_its_own_transaction():
+    from client import LocalPool
+    from server import Server
+    pool = LocalPool(Server(port=0))
+    with pool.connection() as first:
+        first.multi()
+        first.incr('a')
+        with pool.connection() as second:
+            assert second.incr('a') == 1
+        assert first.exec() == [2]
+        first.multi()
+    with pool.connection() as reused:
+        assert reused.incr('a') == 3  # the unfinished MULTI was dropped on release
+    assert pool.stats()['created'] == 2
@@ -0,0 +1,101 @@
+import sys
+import os
+import tempfile
+import shutil
+import socket
+import pytest
+from unittest.mock import patch
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from client import Client
+from cluster import ClusterWorker, Supervisor, key_slot
+from protocol import Error
+
+def keys_owned_by(index, workers, count=5):
+    keys = []
+    i = 0
+    while len(keys) < count:
+        if key_slot(f'key:{i}', workers) == index:
+            keys.append(f'key:{i}')
+        i += 1
+    return keys
+
+@pytest.fixture
+def socket_dir():
+    path = tempfile.mkdtemp(prefix='kvtest-')
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+@pytest.fixture
+def workers(socket_dir):
+    nodes = [ClusterWorker(i, 2, socket_dir, port=0, shards=1) for i in range(2)]
+    for node in nodes:
+        node.start()
+        node._server.start()
+    yield nodes
+    for node in nodes:
+        node._server.stop()
+        node._direct_server.stop()
+        node._peer_server.stop()
+
+def connect(node):
+    return Client(*node._server.address)
+
+def test_key_slot_is_stable():
+    assert key_slot('key', 4) == key_slot(b'key', 4)
+    assert 0 <= key_slot('key', 4) < 4
+    assert {key_slot(f'k{i}', 4) for i in range(100)} == {0, 1, 2, 3}
+
+def test_forwards_single_key_commands(workers):
+    remote = keys_owned_by(1, 2)
+    with connect(workers[0]) as client:
+        for key in remote:
+            assert client.set(key, 'v') == 1
+        assert [client.get(key) for key in remote] == ['v'] * len(remote)
+        assert client.delete(remote[0]) == 1
+    assert workers[0]._kv.memory_stats()['keys'] == 0
+    assert workers[1]._kv.memory_stats()['keys'] == len(remote) - 1
+
+def test_splits_multi_key_commands(workers):
+    keys = keys_owned_by(0, 2, 3) + keys_owned_by(1, 2, 3)
+    keys.sort()
+    with connect(workers[1]) as client:
+        items = [arg for key in keys for arg in (key, key.upper())]
+        assert client.mset(*items) == len(keys)
+        assert client.mget(*keys, 'missing') == [key.upper() for key in keys] + [None]
+        assert client.flush() == len(keys)
+    assert workers[0]._kv.memory_stats()['keys'] == 0
+
+def test_split_mset_keeps_keys_named_like_options(workers):
+    local, remote = keys_owned_by(0, 2, 1)[0], keys_owned_by(1, 2, 1)[0]
+    with connect(workers[0]) as client:
+        assert client.execute('MSET', local, '1', 'EX', '5', remote, '2') == 3
+        assert client.mget(local, 'EX', remote) == ['1', '5', '2']
+        assert client.ttl(local) == -1
+        assert client.execute('MSETEX', 3, local, '1', 'PX', '6', remote, '2', 'EX', 100) == 3
+        assert client.mget(local, 'PX', remote) == ['1', '6', '2']
+        assert all(90 < client.ttl(key) <= 100 for key in (local, 'PX', remote))
+
+def test_redirect_mode(socket_dir):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    node = ClusterWorker(0, 2, socket_dir, port=port, mode='redirect')
+    local, remote = keys_owned_by(0, 2, 1)[0], keys_owned_by(1, 2, 1)[0]
+    assert node.process_request(['SET', local, 'v']) == 1
+    assert node.process_request(['GET', remote]) == Error(f'MOVED 1 127.0.0.1:{port + 2}')
+    assert node.process_request(['MGET', local, remote]).message.startswith('CROSSSLOT')
+
+def test_supervisor_restarts_crashed_worker():
+    supervisor = Supervisor(2, port=0, restart_delay=0)
+    supervisor._children = {100: 0, 101: 1}
+    supervisor._started = {0: 0.0, 1: 0.0}
+    with patch.object(supervisor, '_spawn') as spawn:
+        supervisor._reap(101, 1 << 8)
+        spawn.assert_called_once_with(1)
+        supervisor._stopping = True
+        supervisor._reap(100, 0)
+        assert spawn.call_count == 1
+    assert supervisor._children == {}
@@ -1,52 +1,74 @@
+import sys
+import os
+import socket
 import pytest
 import subprocess
 import time
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
 from client import Client
 
+SERVER = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/server.py'))
+
 @pytest.fixture(scope="module")
 def start_server():
-    """Start the server as a subprocess for integration testing."""
-    # Start the server as a subprocess
-    server_process = subprocess.Popen(["python", "main.py"])
-    time.sleep(2)  # Allow server to initialize
-    yield
+    """Start the server as a subprocess and yield its port once it answers PING."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server_process = subprocess.Popen([sys.executable, SERVER, '--port', str(port)])
+    deadline = time.monotonic() + 20
+    while True:
+        try:
+            with Client(port=port) as client:
+                client.ping()
+            break
+        except OSError:
+            if server_process.poll() is not None or time.monotonic() > deadline:
+                server_process.kill()
+                raise
+            time.sleep(0.01)
+    yield port
     # Terminate the server after tests
     server_process.terminate()
+    server_process.wait()
 
 def test_set_get(start_server):
     """Test basic SET and GET commands."""
-    client = Client()
+    client = Client(port=start_server)
     client.set("key1", "value1")
     assert client.get("key1") == "value1"
 
 def test_set_empty_value(start_server):
     """Test setting a key with an empty value."""
-    client = Client()
+    client = Client(port=start_server)
     client.set("key_empty", "")
     assert client.get("key_empty") == ""
 
 def test_get_nonexistent_key(start_server):
     """Test GET command for a non-existent key."""
-    client = Client()
+    client = Client(port=start_server)
     assert client.get("nonexistent_key") is None
 
 def test_delete_key(start_server):
     """Test DELETE command for an existing key."""
-    client = Client()
+    client = Client(port=start_server)
     client.set("key_to_delete", "value")
     client.delete("key_to_delete")
     assert client.get("key_to_delete") is None
 
 def test_delete_nonexistent_key(start_server):
     """Test DELETE command for a non-existent key."""
-    client = Client()
+    client = Client(port=start_server)
     result = client.delete("nonexistent_key")
     # Adjust expectation to match the server's actual behavior
     assert result == 0  # Server returns 0 for non-existent keys
 
 def test_flush_database(start_server):
     """Test FLUSH command to clear the entire database."""
-    client = Client()
+    client = Client(port=start_server)
     client.set("key1", "value1")
     client.set("key2", "value2")
     client.flush()
@@ -55,8 +77,8 @@ def test_flush_database(start_server):
 
 def test_concurrent_clients(start_server):
     """Test concurrent access with multiple clients."""
-    client1 = Client()
-    client2 = Client()
+    client1 = Client(port=start_server)
+    client2 = Client(port=start_server)
     client1.set("key_shared", "value_from_client1")
     assert client2.get("key_shared") == "value_from_client1"
     client2.set("key_shared", "value_from_client2")
@@ -64,7 +86,7 @@ def test_concurrent_clients(start_server):
 
 def test_invalid_command(start_server):
     """Test handling of an invalid command."""
-    client = Client()
+    client = Client(port=start_server)
     try:
         client.execute("INVALID")
     except Exception as e:
@@ -72,7 +94,7 @@ def test_invalid_command(start_server):
 
 def test_bulk_operations(start_server):
     """Test MSET and MGET commands for multiple keys."""
-    client = Client()
+    client = Client(port=start_server)
     client.mset("key1", "value1", "key2", "value2")
     responses = client.mget("key1", "key2")
     assert responses == ["value1", "value2"]
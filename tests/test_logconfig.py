@@ -0,0 +1,61 @@
+import sys
+import os
+import io
+import logging
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from logconfig import DeferredQueueHandler, SampledLogger, configure_logging, stop_logging
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    logging.getLogger('aof').setLevel(logging.NOTSET)
+
+def test_configure_logging_writes_from_a_queue(root_logger, monkeypatch):
+    monkeypatch.setenv('LOG_LEVEL', 'warning')
+    monkeypatch.setenv('LOG_LEVELS', 'aof=DEBUG')
+    stream = io.StringIO()
+    configure_logging(stream=stream)
+    assert isinstance(root_logger.handlers[0], DeferredQueueHandler)
+    logging.getLogger('server').info('hidden')
+    logging.getLogger('aof').debug('shown %d', 1)
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logging.getLogger('server').exception('failed')
+    stop_logging()
+    output = stream.getvalue()
+    assert 'hidden' not in output
+    assert 'aof - DEBUG - shown 1' in output
+    assert 'ValueError: boom' in output
+
+def test_full_queue_drops_records():
+    import queue
+    handler = DeferredQueueHandler(queue.Queue(1))
+    record = logging.makeLogRecord({'msg': 'x'})
+    handler.handle(record)
+    handler.handle(record)
+    assert handler.dropped == 1
+
+def test_sampled_logger(caplog):
+    logger = logging.getLogger('sampled')
+    sampled = SampledLogger(logger, logging.INFO, every=10, per_second=3)
+    with caplog.at_level(logging.INFO, logger='sampled'):
+        for i in range(100):
+            sampled.log('call %d', i)
+    assert [r.getMessage() for r in caplog.records] == ['call 9', 'call 19', 'call 29']
+    assert sampled.suppressed == 7
+
+def test_sampled_logger_skips_disabled_levels(caplog):
+    sampled = SampledLogger(logging.getLogger('sampled'), logging.DEBUG)
+    with caplog.at_level(logging.INFO, logger='sampled'):
+        sampled.log('nothing')
+    assert not caplog.records and sampled.suppressed == 0
@@ -0,0 +1,68 @@
+import sys
+import os
+import random
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from metrics import LatencyHistogram, SlowLog, prometheus_text
+
+def test_percentiles_are_within_bucket_precision():
+    rng = random.Random(1)
+    samples = sorted(rng.expovariate(1 / 0.002) for _ in range(50000))
+    histogram = LatencyHistogram()
+    for sample in samples:
+        histogram.record(sample)
+    for percent in (50, 99, 99.9):
+        exact = samples[int(len(samples) * percent / 100) - 1]
+        assert histogram.percentile(percent) == pytest.approx(exact, rel=0.03, abs=2e-6)
+    assert histogram.count == 50000
+    assert histogram.max == samples[-1]
+
+def test_merge_and_summary():
+    fast, slow = LatencyHistogram(), LatencyHistogram()
+    fast.record(0.001, count=99)
+    slow.record(0.5)
+    summary = fast.merge(slow).summary()
+    assert summary['count'] == 100
+    assert summary['p50'] == pytest.approx(1.0, rel=0.02)
+    assert summary['p999'] == summary['max'] == 500.0
+    assert summary['min'] == 1.0
+
+def test_empty_histogram():
+    assert LatencyHistogram().summary()['p99'] == 0.0
+
+def test_prometheus_text_from_info():
+    from server import Server
+    server = Server(port=0)
+    server.get_response(['SET', 'a', '1'])
+    server.get_response(['GET', 'a'])
+    text = prometheus_text(server.get_response(['INFO', 'all']), pool={
+        'max_connections': 4, 'in_use': 1, 'idle': 2, 'created': 3, 'waits': 0, 'timeouts': 0})
+    lines = text.splitlines()
+    assert 'kvstore_keys 1' in lines
+    assert 'kvstore_command_calls_total{command="get"} 1' in lines
+    assert 'kvstore_command_duration_seconds_bucket{command="set",le="+Inf"} 1' in lines
+    assert 'kvstore_command_duration_seconds_bucket{command="set",le="2.5"} 1' in lines
+    assert 'kvstore_client_pool_in_use 1' in lines
+    assert '# TYPE kvstore_evicted_keys_total counter' in lines
+
+def test_slowlog_is_bounded_and_truncates():
+    slowlog = SlowLog(threshold=0, max_len=2)
+    slowlog.add(['GET', 'a'], 0.001)
+    slowlog.add(['SET', 'b', 'x' * 200], 0.002, ('10.0.0.1', 5000))
+    slowlog.add(['MSET'] + ['k'] * 40, 0.003)
+    assert len(slowlog) == 2
+    newest, older = slowlog.get()
+    assert newest['id'] == 2 and older['id'] == 1
+    assert len(newest['command']) == 32
+    assert newest['command'][-1] == '... (10 more arguments)'
+    assert older['command'][2] == 'x' * 128 + '... (72 more characters)'
+    assert (older['client'], older['duration_us']) == ('10.0.0.1:5000', 2000)
+    assert len(slowlog.get(1)) == 1
+    slowlog.reset()
+    assert slowlog.get(-1) == []
+
+def test_negative_threshold_disables_slowlog():
+    assert SlowLog(threshold=-1).threshold > 1e300
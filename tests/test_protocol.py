@@ -2,12 +2,12 @@ import sys
 import os
 import pytest
 from unittest.mock import MagicMock
-from io import BytesIO
 
 # Add the parent directory to the sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
-from protocol import ProtocolHandler, ProtocolError, Error
+from protocol import (ProtocolHandler, ProtocolError, Error, RespParser, Encoded, SimpleString, OK,
+                      INCOMPLETE)
 
 @pytest.fixture
 def protocol_handler():
@@ -66,42 +66,146 @@ def test_write_response(protocol_handler):
     mock_socket_file.write.assert_called_once_with(b'$5\r\nhello\r\n')
     mock_socket_file.flush.assert_called_once()
 
-def test_write(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, 'hello')
-    assert buf.getvalue() == b'$5\r\nhello\r\n'
-
-def test_write_bytes(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, b'hello')
-    assert buf.getvalue() == b'$5\r\nhello\r\n'
-
-def test_write_int(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, 123)
-    assert buf.getvalue() == b':123\r\n'
-
-def test_write_float(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, 123.45)
-    assert buf.getvalue() == b'$6\r\n123.45\r\n'
-
-def test_write_error(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, Error('error message'))
-    assert buf.getvalue() == b'-error message\r\n'
-
-def test_write_list(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, ['hello', 'world'])
-    assert buf.getvalue() == b'*2\r\n$5\r\nhello\r\n$5\r\nworld\r\n'
-
-def test_write_dict(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, {'key': 'value', 'key2': 'value2'})
-    assert buf.getvalue() == b'%2\r\n$3\r\nkey\r\n$5\r\nvalue\r\n$4\r\nkey2\r\n$6\r\nvalue2\r\n'
-
-def test_write_none(protocol_handler):
-    buf = BytesIO()
-    protocol_handler._write(buf, None)
-    assert buf.getvalue() == b'$-1\r\n'
\ No newline at end of file
+def test_encode_str(protocol_handler):
+    assert protocol_handler.encode('hello') == b'$5\r\nhello\r\n'
+
+def test_encode_bytes(protocol_handler):
+    assert protocol_handler.encode(b'hello') == b'$5\r\nhello\r\n'
+
+def test_encode_int(protocol_handler):
+    assert protocol_handler.encode(123) == b':123\r\n'
+
+def test_encode_float(protocol_handler):
+    assert protocol_handler.encode(123.45) == b'$6\r\n123.45\r\n'
+
+def test_encode_error(protocol_handler):
+    assert protocol_handler.encode(Error('error message')) == b'-error message\r\n'
+
+def test_encode_list(protocol_handler):
+    assert protocol_handler.encode(['hello', 'world']) == b'*2\r\n$5\r\nhello\r\n$5\r\nworld\r\n'
+
+def test_encode_dict(protocol_handler):
+    assert protocol_handler.encode({'key': 'value', 'key2': 'value2'}) == b'%2\r\n$3\r\nkey\r\n$5\r\nvalue\r\n$4\r\nkey2\r\n$6\r\nvalue2\r\n'
+
+def test_encode_none(protocol_handler):
+    assert protocol_handler.encode(None) == b'$-1\r\n'
+
+def test_encode(protocol_handler):
+    assert protocol_handler.encode(['a', 1]) == b'*2\r\n$1\r\na\r\n:1\r\n'
+
+def test_parser_simple_values():
+    parser = RespParser()
+    parser.feed(b'+OK\r\n-ERR bad\r\n:42\r\n$5\r\nhello\r\n$-1\r\n')
+    assert parser.gets() == 'OK'
+    assert parser.gets() == Error('ERR bad')
+    assert parser.gets() == 42
+    assert parser.gets() == 'hello'
+    assert parser.gets() is None
+    assert parser.gets() is INCOMPLETE
+
+def test_parser_nested_containers():
+    parser = RespParser()
+    parser.feed(b'*3\r\n$1\r\na\r\n*2\r\n:1\r\n*0\r\n%1\r\n$1\r\nk\r\n$1\r\nv\r\n')
+    assert parser.gets() == ['a', [1, []], {'k': 'v'}]
+
+def test_parser_incomplete_frames_resume():
+    payload = b'*2\r\n$3\r\nGET\r\n$5\r\nhello\r\n'
+    parser = RespParser()
+    for i in range(len(payload) - 1):
+        parser.feed(payload[i:i + 1])
+        assert parser.gets() is INCOMPLETE
+    parser.feed(payload[-1:])
+    assert parser.gets() == ['GET', 'hello']
+    assert parser.buffered() == 0
+
+def test_parser_deep_nesting_does_not_recurse():
+    depth = 5000
+    parser = RespParser()
+    parser.feed(b'*1\r\n' * depth + b':1\r\n')
+    value = parser.gets()
+    for _ in range(depth):
+        value = value[0]
+    assert value == 1
+
+def test_parser_binary_and_raw_modes():
+    parser = RespParser()
+    parser.feed(b'$2\r\n\xff\xfe\r\n')
+    assert parser.gets() == b'\xff\xfe'
+    raw = RespParser(encoding=None)
+    raw.feed(b'$5\r\nhello\r\n')
+    assert raw.gets() == b'hello'
+
+def test_parser_invalid_input():
+    parser = RespParser()
+    parser.feed(b'!nope\r\n')
+    with pytest.raises(ProtocolError, match='Invalid first byte'):
+        parser.gets()
+    parser.reset()
+    parser.feed(b'$abc\r\n')
+    with pytest.raises(ProtocolError, match='Invalid header'):
+        parser.gets()
+
+def test_parser_recv_from_grows_buffer():
+    class ChunkedSocket:
+        def __init__(self, *chunks):
+            self._chunks = list(chunks)
+
+        def recv_into(self, buffer):
+            chunk = self._chunks.pop(0) if self._chunks else b''
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+    value = b'x' * 100
+    sock = ChunkedSocket(b'$100\r\n' + value[:40], value[40:] + b'\r\n')
+    parser = RespParser(chunk_size=64)
+    assert parser.recv_from(sock) == 46
+    assert parser.gets() is INCOMPLETE
+    assert parser.recv_from(sock) == 62
+    assert parser.gets() == value.decode()
+    assert parser.recv_from(sock) == 0
+
+def test_encode_simple_string(protocol_handler):
+    assert protocol_handler.encode(OK) == b'+OK\r\n'
+    assert protocol_handler.encode(SimpleString('HELLO')) == b'+HELLO\r\n'
+
+def test_encode_integers(protocol_handler):
+    assert protocol_handler.encode(-2) == b':-2\r\n'
+    assert protocol_handler.encode(1) == b':1\r\n'
+    assert protocol_handler.encode(True) == b':1\r\n'
+    assert protocol_handler.encode(10 ** 20) == b':100000000000000000000\r\n'
+
+def test_encode_mixed_nested_values(protocol_handler):
+    value = ['a', 1, None, ('b', [b'c']), {'k': ['v', 2]}, Error('boom'), 1.5]
+    assert protocol_handler.encode(value) == (
+        b'*7\r\n$1\r\na\r\n:1\r\n$-1\r\n*2\r\n$1\r\nb\r\n*1\r\n$1\r\nc\r\n'
+        b'%1\r\n$1\r\nk\r\n*2\r\n$1\r\nv\r\n:2\r\n-boom\r\n$3\r\n1.5\r\n')
+
+def test_encode_flat_string_array(protocol_handler):
+    assert protocol_handler.encode(['héllo', '']) == b'*2\r\n$6\r\nh\xc3\xa9llo\r\n$0\r\n\r\n'
+
+def test_encode_deep_nesting_does_not_recurse(protocol_handler):
+    value = 1
+    for _ in range(5000):
+        value = [value]
+    assert protocol_handler.encode(value) == b'*1\r\n' * 5000 + b':1\r\n'
+
+def test_encode_subclasses_use_fallback(protocol_handler):
+    from enum import IntEnum
+
+    class Level(IntEnum):
+        HIGH = 3
+
+    assert protocol_handler.encode(Level.HIGH) == b':3\r\n'
+    assert protocol_handler.encode(bytearray(b'ab')) == b'$2\r\nab\r\n'
+
+def test_encode_into_appends(protocol_handler):
+    out = bytearray(b':0\r\n')
+    protocol_handler.encode_into(out, 'x')
+    assert out == b':0\r\n$1\r\nx\r\n'
+
+def test_encoded_values_are_written_verbatim(protocol_handler):
+    encoded = protocol_handler.encode_value(['a', 1])
+    assert isinstance(encoded, Encoded)
+    assert encoded == b'*2\r\n$1\r\na\r\n:1\r\n'
+    assert protocol_handler.encode_value(encoded) is encoded
+    assert protocol_handler.encode([encoded, None]) == b'*2\r\n*2\r\n$1\r\na\r\n:1\r\n$-1\r\n'
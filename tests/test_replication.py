@@ -0,0 +1,142 @@
+import sys
+import os
+import socket
+import subprocess
+import time
+import gevent
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from client import Client
+from replication import ReplicationBacklog, parse_address
+from server import Server
+from storage import CommandError
+
+SERVER = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/server.py'))
+
+def wait_until(predicate, timeout=5.0, sleep=gevent.sleep):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        sleep(0.02)
+    return False
+
+def test_backlog_keeps_only_the_tail():
+    backlog = ReplicationBacklog(size=8)
+    backlog.append(b'abcdef')
+    assert backlog.read_from(2) == b'cdef'
+    backlog.append(b'ghijk')
+    assert backlog.offset == 11
+    assert backlog.read_from(2) is None
+    assert backlog.read_from(3) == b'defghijk'
+    assert backlog.read_from(11) == b''
+    assert backlog.read_from(12) is None
+
+def test_parse_address():
+    assert parse_address('10.0.0.1:6000') == ('10.0.0.1', 6000)
+    assert parse_address('localhost 6000') == ('localhost', 6000)
+    with pytest.raises(ValueError):
+        parse_address('nowhere')
+
+@pytest.fixture
+def primary():
+    server = Server(port=0, shards=1)
+    server._server.start()
+    yield server
+    server._server.stop()
+
+def start_replica(primary):
+    replica = Server(port=0, replicaof='127.0.0.1:%d' % primary._server.server_port)
+    link = gevent.spawn(replica._replica_link.run)
+    return replica, link
+
+def test_full_then_streamed_sync(primary):
+    primary.get_response(['SET', 'before', '1'])
+    replica, link = start_replica(primary)
+    try:
+        assert wait_until(lambda: replica.get_response(['GET', 'before']) == '1')
+        primary.get_response(['MSET', 'a', '1', 'b', '2'])
+        primary.get_response(['SET', 'ttl', 'v', 'EX', '100'])
+        primary.get_response(['DELETE', 'before'])
+        assert wait_until(lambda: replica.get_response(['MGET', 'a', 'b', 'before']) == ['1', '2', None])
+        assert 90 < replica.get_response(['TTL', 'ttl']) <= 100
+
+        assert wait_until(lambda: primary.role()['replicas'] and
+                          primary.role()['replicas'][0]['lag_bytes'] == 0)
+        assert replica.role()['master_link_status'] == 'up'
+        with pytest.raises(CommandError, match='READONLY'):
+            replica.get_response(['SET', 'a', 'x'])
+    finally:
+        link.kill()
+
+def test_partial_resync_after_disconnect(primary):
+    replica, link = start_replica(primary)
+    try:
+        primary.get_response(['SET', 'a', '1'])
+        assert wait_until(lambda: replica.get_response(['GET', 'a']) == '1')
+        replica._replica_link._close()
+        primary.get_response(['SET', 'b', '2'])
+        assert wait_until(lambda: replica.get_response(['GET', 'b']) == '2')
+        info = replica.role()
+        assert (info['full_syncs'], info['partial_syncs']) == (1, 1)
+    finally:
+        link.kill()
+
+def test_evictions_reach_the_replica():
+    primary = Server(port=0, shards=1, max_memory_mb=0.01)
+    primary._server.start()
+    replica, link = start_replica(primary)
+    try:
+        # Evict after the initial sync, so only the stream can carry it
+        assert wait_until(lambda: replica.role()['master_link_status'] == 'up')
+        for i in range(20):
+            primary.get_response(['SET', f'key{i}', 'x' * 1000])
+        keys = [f'key{i}' for i in range(20)]
+        values = primary.get_response(['MGET'] + keys)
+        assert None in values
+        assert wait_until(lambda: replica.get_response(['MGET'] + keys) == values)
+    finally:
+        link.kill()
+        primary._server.stop()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def launch(*args):
+    return subprocess.Popen([sys.executable, SERVER, *args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def connect(port):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            return Client(port=port, timeout=5)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def test_primary_and_replica_processes():
+    primary_port, replica_port = free_port(), free_port()
+    processes = [launch('--port', str(primary_port))]
+    try:
+        primary = connect(primary_port)
+        primary.set('seed', 'value')
+        processes.append(launch('--port', str(replica_port),
+                                '--replicaof', f'127.0.0.1:{primary_port}'))
+        replica = connect(replica_port)
+        assert wait_until(lambda: replica.get('seed') == 'value', 10, time.sleep)
+        primary.mset('k1', 'v1', 'k2', 'v2')
+        assert wait_until(lambda: replica.mget('k1', 'k2') == ['v1', 'v2'], 10, time.sleep)
+        with pytest.raises(CommandError, match='READONLY'):
+            replica.set('k1', 'other')
+        assert primary.execute('ROLE')['connected_replicas'] == 1
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
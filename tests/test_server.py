@@ -1,14 +1,18 @@
 import sys
 import os
+import logging
+import subprocess
+import gevent
+import gevent.socket
 import pytest
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to the sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
-from server import Server, CommandError
-from protocol import ProtocolHandler
-from storage import KeyValueStore
+from server import Server, Transaction, CommandError, QUEUED
+from protocol import ProtocolHandler, OK
+from storage import KeyValueStore, ShardedKeyValueStore
 
 @pytest.fixture
 def server():
@@ -42,16 +46,19 @@ def test_flush(server):
         mock_flush.assert_called_once()
 
 def test_mget(server):
-    with patch.object(server._kv, 'get', side_effect=['value1', 'value2']) as mock_get:
+    with patch.object(server._kv, 'mget', return_value=['value1', 'value2']) as mock_mget:
         assert server.mget('key1', 'key2') == ['value1', 'value2']
-        mock_get.assert_any_call('key1')
-        mock_get.assert_any_call('key2')
+        mock_mget.assert_called_once_with(('key1', 'key2'))
 
 def test_mset(server):
-    with patch.object(server._kv, 'set', return_value=True) as mock_set:
+    with patch.object(server._kv, 'mset', side_effect=lambda items: len(list(items))):
         assert server.mset('key1', 'value1', 'key2', 'value2') == 2
-        mock_set.assert_any_call('key1', 'value1')
-        mock_set.assert_any_call('key2', 'value2')
+
+def test_mset_keys_named_like_options(server):
+    # MSET takes pairs only, so a last key named EX is just a key
+    assert server.get_response(['MSET', 'a', '1', 'EX', '5']) == 2
+    assert server.get_response(['MGET', 'a', 'EX']) == ['1', '5']
+    assert server.get_response(['TTL', 'a']) == -1
 
 def test_mset_odd_number_of_arguments(server):
     with pytest.raises(CommandError, match='MSET requires pairs of key/value arguments'):
@@ -67,4 +74,381 @@ def test_get_response_missing_command(server):
 
 def test_get_response_invalid_request_type(server):
     with pytest.raises(CommandError, match='Request must be list or simple string'):
-        server.get_response(None)
\ No newline at end of file
+        server.get_response(None)
+
+def test_memory_usage(server):
+    with patch.object(server._kv, 'memory_usage', return_value=42) as mock_usage:
+        assert server.get_response(['MEMORY', 'usage', 'key']) == 42
+        mock_usage.assert_called_once_with('key')
+
+def test_memory_stats(server):
+    with patch.object(server._kv, 'memory_stats', return_value={'used_memory': 1}) as mock_stats:
+        assert server.get_response(['MEMORY', 'STATS']) == {'used_memory': 1}
+        mock_stats.assert_called_once()
+
+def test_memory_unknown_subcommand(server):
+    with pytest.raises(CommandError, match='Unknown MEMORY subcommand: DOCTOR'):
+        server.memory('doctor')
+
+def test_eviction_policy_from_environment():
+    with patch.dict(os.environ, {'MAXMEMORY_POLICY': 'allkeys-lfu'}):
+        assert Server(port=0)._kv.memory_stats()['eviction_policy'] == 'allkeys-lfu'
+
+def test_eviction_policy_argument_overrides_environment():
+    with patch.dict(os.environ, {'MAXMEMORY_POLICY': 'allkeys-lfu'}):
+        server = Server(port=0, eviction_policy='noeviction')
+        assert server._kv.memory_stats()['eviction_policy'] == 'noeviction'
+
+def test_set_with_expiry(server):
+    with patch.object(server._kv, 'set', return_value=True) as mock_set:
+        assert server.set('key', 'value', 'EX', '10') == 1
+        mock_set.assert_called_once_with('key', 'value', 10)
+    with patch.object(server._kv, 'set', return_value=True) as mock_set:
+        assert server.set('key', 'value', 'px', 1500) == 1
+        mock_set.assert_called_once_with('key', 'value', 1.5)
+
+def test_set_invalid_expiry(server):
+    with pytest.raises(CommandError, match='Invalid expire time in SET'):
+        server.set('key', 'value', 'EX', '0')
+    with pytest.raises(CommandError, match='Syntax error in SET options'):
+        server.set('key', 'value', 'XX')
+    with pytest.raises(CommandError, match='Value is not an integer'):
+        server.set('key', 'value', 'EX', 'soon')
+
+def test_msetex(server):
+    calls = []
+    with patch.object(server._kv, 'mset', side_effect=lambda items, ttl: calls.append((list(items), ttl)) or 2):
+        assert server.msetex('2', 'key1', 'value1', 'EX', 'value2', 'EX', '5') == 2
+        assert server.msetex('1', 'PX', '1') == 2
+    assert calls == [([('key1', 'value1'), ('EX', 'value2')], 5), ([('PX', '1')], None)]
+    with pytest.raises(CommandError, match='numkeys'):
+        server.msetex('2', 'key1', 'value1')
+    with pytest.raises(CommandError, match='Syntax error in MSETEX options'):
+        server.msetex('1', 'key1', 'value1', 'key2', 'value2')
+
+def test_expire_commands(server):
+    with patch.object(server._kv, 'expire', return_value=True) as mock_expire:
+        assert server.get_response(['EXPIRE', 'key', '10']) == 1
+        mock_expire.assert_called_once_with('key', 10)
+    with patch.object(server._kv, 'expire', return_value=False) as mock_expire:
+        assert server.get_response(['PEXPIRE', 'key', '2500']) == 0
+        mock_expire.assert_called_once_with('key', 2.5)
+
+def test_ttl_commands(server):
+    with patch.object(server._kv, 'ttl', return_value=9.6):
+        assert server.get_response(['TTL', 'key']) == 10
+        assert server.get_response(['PTTL', 'key']) == 9600
+    with patch.object(server._kv, 'ttl', return_value=-2):
+        assert server.get_response(['TTL', 'key']) == -2
+
+def test_persist(server):
+    with patch.object(server._kv, 'persist', return_value=True) as mock_persist:
+        assert server.get_response(['PERSIST', 'key']) == 1
+        mock_persist.assert_called_once_with('key')
+
+
+def test_shards_from_environment():
+    with patch.dict(os.environ, {'STORE_SHARDS': '4'}):
+        server = Server(port=0)
+    assert isinstance(server._kv, ShardedKeyValueStore)
+    assert server._kv.memory_stats()['shards'] == 4
+
+def test_single_shard_uses_plain_store():
+    server = Server(port=0, shards=1)
+    assert isinstance(server._kv, KeyValueStore)
+
+class FakeConnection:
+    """Socket stand-in that replays ``chunks`` and records writes."""
+
+    def __init__(self, *chunks):
+        self._chunks = list(chunks)
+        self.writes = []
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv_into(self, buffer):
+        chunk = self._chunks.pop(0) if self._chunks else b''
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def sendall(self, data):
+        self.writes.append(bytes(data))
+
+    def close(self):
+        self.closed = True
+
+def test_connection_handler_batches_pipelined_replies():
+    server = Server(port=0)
+    conn = FakeConnection(
+        b'*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n'
+        b'*2\r\n$3\r\nGET\r\n$1\r\na\r\n'
+        b'*2\r\n$3\r\nGET\r\n$1\r\nb\r\n')
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    assert conn.writes == [b':1\r\n$1\r\n1\r\n$-1\r\n']
+    assert conn.closed
+
+def test_connection_handler_flushes_before_waiting_for_input():
+    server = Server(port=0)
+    conn = FakeConnection(
+        b'*2\r\n$3\r\nGET\r\n$1\r\na\r\n*2\r\n$3\r\nGET',
+        b'\r\n$1\r\nb\r\n')
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    assert conn.writes == [b'$-1\r\n', b'$-1\r\n']
+
+def test_connection_handler_respects_output_buffer_limit():
+    server = Server(port=0, max_output_buffer=8)
+    conn = FakeConnection(b'*2\r\n$3\r\nGET\r\n$1\r\na\r\n' * 4)
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    assert conn.writes == [b'$-1\r\n$-1\r\n', b'$-1\r\n$-1\r\n']
+
+def test_connection_handler_replies_to_protocol_errors():
+    server = Server(port=0)
+    conn = FakeConnection(b'!oops\r\n')
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    assert conn.writes[0].startswith(b'-Invalid first byte')
+
+def test_encoded_values_round_trip_binary_data():
+    server = Server(port=0, encoded_values=True)
+    conn = FakeConnection(
+        b'*5\r\n$3\r\nSET\r\n$1\r\na\r\n$2\r\n\xff\x00\r\n$2\r\nEX\r\n$2\r\n10\r\n'
+        b'*3\r\n$4\r\nMGET\r\n$1\r\na\r\n$1\r\nb\r\n'
+        b'*2\r\n$3\r\nTTL\r\n$1\r\na\r\n')
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    assert conn.writes == [b':1\r\n*2\r\n$2\r\n\xff\x00\r\n$-1\r\n:10\r\n']
+
+def test_encoded_values_store_resp_bytes():
+    server = Server(port=0, shards=1, encoded_values=True)
+    server.get_response([b'MSET', b'k1', [b'v', 1], b'k2', b'v2'])
+    assert server.get('k1') == b'*2\r\n$1\r\nv\r\n:1\r\n'
+    assert server.get_response([b'MEMORY', b'USAGE', b'k2']) == len(b'$2\r\nk2\r\n$2\r\nv2\r\n')
+
+def test_collection_commands():
+    server = Server(port=0)
+    assert server.get_response(['HSET', 'h', 'f1', 'a', 'f2', 'b']) == 2
+    assert server.get_response(['HMGET', 'h', 'f1', 'nope']) == ['a', None]
+    assert server.get_response(['HGETALL', 'h']) == {'f1': 'a', 'f2': 'b'}
+    assert server.get_response(['RPUSH', 'l', 'x', 'y', 'z']) == 3
+    assert server.get_response(['LPOP', 'l']) == 'x'
+    assert server.get_response(['LPOP', 'l', '5']) == ['y', 'z']
+    assert server.get_response(['LPOP', 'l']) is None
+    assert server.get_response(['SADD', 's', 'm', 'm']) == 1
+    assert server.get_response(['SISMEMBER', 's', 'm']) == 1
+    assert server.get_response(['TYPE', 's']) == 'set'
+    with pytest.raises(CommandError, match='WRONGTYPE'):
+        server.get_response(['GET', 'h'])
+    with pytest.raises(CommandError, match='pairs'):
+        server.get_response(['HSET', 'h', 'f1'])
+    with pytest.raises(CommandError, match='not an integer'):
+        server.get_response(['LRANGE', 'l', '0', 'end'])
+
+def test_collection_commands_with_encoded_values():
+    server = Server(port=0, encoded_values=True)
+    server.get_response([b'HSET', b'h', b'f', b'\xff'])
+    server.get_response([b'RPUSH', b'l', b'a', b'b'])
+    assert server.get_response([b'HGET', b'h', b'f']) == b'\xff'
+    assert server.get_response([b'LRANGE', b'l', b'0', b'-1']) == ['a', 'b']
+
+def test_counter_commands():
+    server = Server(port=0)
+    assert server.get_response(['INCR', 'c']) == 1
+    assert server.get_response(['INCRBY', 'c', '10']) == 11
+    assert server.get_response(['DECRBY', 'c', '3']) == 8
+    assert server.get_response(['DECR', 'c']) == 7
+    assert server.get_response(['GET', 'c']) == '7'
+    assert server.get_response(['INCRBYFLOAT', 'c', '0.5']) == '7.5'
+    assert server.get_response(['SETNX', 'c', 'x']) == 0
+    assert server.get_response(['GETSET', 'c', '1']) == '7.5'
+    assert server.get_response(['MSETNX', 'c', 'x', 'd', 'y']) == 0
+    with pytest.raises(CommandError, match='not an integer'):
+        server.get_response(['INCRBY', 'c', 'many'])
+
+def transaction_requests(*requests):
+    protocol = ProtocolHandler()
+    return b''.join(protocol.encode(list(request)) for request in requests)
+
+def test_transaction_queues_and_runs_atomically():
+    server = Server(port=0)
+    conn = FakeConnection(transaction_requests(
+        ('MULTI',), ('INCR', 'a'), ('HSET', 'a', 'f', 'v'), ('GET', 'a'), ('EXEC',)))
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    assert conn.writes == [
+        b'+OK\r\n+QUEUED\r\n+QUEUED\r\n+QUEUED\r\n'
+        b'*3\r\n:1\r\n-WRONGTYPE Operation against a key holding the wrong kind of value\r\n'
+        b'$1\r\n1\r\n']
+
+def test_transaction_errors_while_queueing_abort_exec():
+    server = Server(port=0)
+    conn = FakeConnection(transaction_requests(
+        ('MULTI',), ('SET', 'a', '1'), ('NOPE',), ('MULTI',), ('EXEC',), ('GET', 'a'),
+        ('EXEC',), ('DISCARD',)))
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    replies = conn.writes[0].split(b'\r\n')
+    assert replies[:3] == [b'+OK', b'+QUEUED', b'-Unrecognized command: NOPE']
+    assert replies[3] == b'-MULTI inside MULTI is not allowed'
+    assert replies[4].startswith(b'-EXECABORT')
+    assert replies[5:8] == [b'$-1', b'-EXEC without MULTI', b'-DISCARD without MULTI']
+
+def test_watch_aborts_exec_when_key_changes():
+    server = Server(port=0, shards=1)
+    first, second = Transaction(), Transaction()
+    server.process_request(['WATCH', 'a'], first)
+    server.process_request(['MULTI'], first)
+    server.process_request(['INCR', 'a'], first)
+    server.process_request(['SET', 'a', '10'], second)
+    assert server.process_request(['EXEC'], first) is None
+    assert server.get_response(['GET', 'a']) == '10'
+    # The watch ended with EXEC, so the next transaction goes through
+    server.process_request(['MULTI'], first)
+    server.process_request(['INCR', 'a'], first)
+    assert server.process_request(['EXEC'], first) == [11]
+    assert server._kv._versions == {}
+
+def test_unwatch_queued_inside_multi():
+    server = Server(port=0, shards=1)
+    transaction = Transaction()
+    server.process_request(['WATCH', 'a'], transaction)
+    server.process_request(['MULTI'], transaction)
+    assert server.process_request(['UNWATCH'], transaction) == QUEUED
+    server.process_request(['INCR', 'a'], transaction)
+    assert server.process_request(['EXEC'], transaction) == [OK, 1]
+    assert server._kv._versions == {}
+
+def test_disconnect_releases_watched_keys():
+    server = Server(port=0, shards=1)
+    conn = FakeConnection(transaction_requests(('WATCH', 'a', 'b', 'a')))
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    assert conn.writes == [b'+OK\r\n']
+    assert server._kv._versions == {}
+
+def test_transactions_need_a_connection():
+    server = Server(port=0)
+    with pytest.raises(CommandError, match='client connection'):
+        server.get_response(['MULTI'])
+
+def test_replica_refuses_queued_writes():
+    server = Server(port=0)
+    server._replica_link = MagicMock()
+    transaction = Transaction()
+    server.process_request(['MULTI'], transaction)
+    assert server.process_request(['INCR', 'a'], transaction).message.startswith('READONLY')
+    assert server.process_request(['EXEC'], transaction).message.startswith('EXECABORT')
+
+def test_encoded_values_from_environment():
+    with patch.dict(os.environ, {'STORE_ENCODED_VALUES': '1'}):
+        assert Server(port=0)._encoded_values is True
+
+def test_info_counts_commands_and_traffic():
+    server = Server(port=0, shards=1)
+    payload = (b'*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n'
+               b'*2\r\n$3\r\nGET\r\n$1\r\na\r\n'
+               b'*3\r\n$6\r\nEXPIRE\r\n$1\r\na\r\n$1\r\nx\r\n')
+    conn = FakeConnection(payload)
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    info = server.info()
+    assert set(info) == {'server', 'clients', 'memory', 'keyspace', 'persistence', 'stats',
+                         'replication', 'commandstats', 'latencystats'}
+    assert info['commandstats']['set']['calls'] == 1
+    assert info['commandstats']['expire']['errors'] == 1
+    assert info['latencystats']['get']['count'] == 1
+    assert info['stats']['total_commands_processed'] == 3
+    assert info['stats']['total_connections_received'] == 1
+    assert info['stats']['total_net_input_bytes'] == len(payload)
+    assert info['stats']['total_net_output_bytes'] == sum(map(len, conn.writes))
+    assert info['clients']['connected_clients'] == 0
+    assert info['keyspace'] == {'keys': 1, 'expires': 0}
+
+def test_info_sections():
+    server = Server(port=0)
+    assert list(server.get_response(['INFO', 'keyspace', 'Memory'])) == ['keyspace', 'memory']
+    histograms = server.get_response(['INFO', 'all'])['histograms']
+    assert histograms['info']['count'] == 1
+    with pytest.raises(CommandError):
+        server.get_response(['INFO', 'nope'])
+
+def test_slowlog_records_client_and_arguments():
+    server = Server(port=0, slowlog_threshold_us=0, slowlog_max_len=4)
+    conn = FakeConnection(b'*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n')
+    server.connection_handler(conn, ('127.0.0.1', 1234))
+    entry, = server.get_response(['SLOWLOG', 'GET'])
+    assert entry['command'] == ['SET', 'a', '1']
+    assert entry['client'] == '127.0.0.1:1234'
+    assert server.get_response(['SLOWLOG', 'LEN']) == 2
+    server.get_response(['SLOWLOG', 'RESET'])
+    assert server.get_response(['SLOWLOG', 'LEN']) == 1
+
+def test_slowlog_skips_fast_commands():
+    server = Server(port=0)
+    server.get_response(['GET', 'a'])
+    assert server.get_response(['SLOWLOG', 'LEN']) == 0
+
+def test_debug_profile(tmp_path, monkeypatch):
+    monkeypatch.setenv('DEBUG_DUMP_DIR', str(tmp_path))
+    server = Server(port=0)
+    with pytest.raises(CommandError):
+        server.get_response(['DEBUG', 'PROFILE', 'STOP'])
+    server.get_response(['DEBUG', 'PROFILE', 'START', '5'])
+    with pytest.raises(CommandError):
+        server.get_response(['DEBUG', 'PROFILE', 'START'])
+    server.get_response(['SET', 'a', '1'])
+    report = server.get_response(['DEBUG', 'PROFILE', 'STOP', '10'])
+    assert 'function calls' in report and 'get_response' in report
+    path = server.get_response(['DEBUG', 'PROFILE', 'DUMP'])
+    assert os.path.dirname(path) == str(tmp_path) and os.path.getsize(path)
+    with pytest.raises(CommandError):
+        server.get_response(['DEBUG', 'PROFILE', 'START', '100000'])
+
+def test_debug_memory():
+    server = Server(port=0)
+    server.get_response(['DEBUG', 'MEMORY', 'START'])
+    try:
+        first = server.get_response(['DEBUG', 'MEMORY', 'SNAPSHOT', '5'])
+        server.get_response(['MSET'] + ['key', 'x' * 1000] * 50 + ['other', 'y' * 100000])
+        second = server.get_response(['DEBUG', 'MEMORY', 'SNAPSHOT', '5'])
+    finally:
+        server.get_response(['DEBUG', 'MEMORY', 'STOP'])
+    assert 'growth' not in first and len(first['top']) <= 5
+    assert second['traced_memory'] > 0 and second['growth']
+    with pytest.raises(CommandError):
+        server.get_response(['DEBUG', 'MEMORY', 'SNAPSHOT'])
+
+def test_command_errors_are_counted_not_logged(caplog):
+    server = Server(port=0)
+    with caplog.at_level(logging.DEBUG, logger='server'):
+        for _ in range(3):
+            reply = server.process_request(['EXPIRE', 'a', 'soon'])
+    assert 'not an integer' in reply.message
+    assert server.info('stats')['stats']['total_error_replies'] == 3
+    assert not [r for r in caplog.records if r.levelno >= logging.WARNING or r.exc_info]
+
+def test_ping():
+    server = Server(port=0)
+    assert server.get_response(['PING']) == 'PONG'
+    assert server.get_response(['PING', 'hello']) == 'hello'
+
+def test_run_signals_ready_and_shutdown_drains_connections():
+    server = Server(port=0)
+    assert not server.ready
+    runner = gevent.spawn(server.run)
+    assert server.wait_ready(5)
+    conn = gevent.socket.create_connection(server.address)
+    conn.sendall(b'*1\r\n$4\r\nPING\r\n')
+    assert conn.recv(64) == b'+PONG\r\n'
+    # Received by the socket but not yet read when the shutdown starts
+    conn.sendall(b'*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n')
+    server.shutdown(timeout=5)
+    assert conn.recv(64) == b':1\r\n'
+    assert conn.recv(64) == b''
+    conn.close()
+    runner.join(5)
+    assert runner.dead and not server.ready
+    with pytest.raises(OSError):
+        gevent.socket.create_connection(server.address, timeout=1)
+
+def test_optional_modules_are_imported_on_first_use():
+    code = ('import sys, server; print(sorted({"aof", "snapshot", "profiling", "argparse", '
+            '"tempfile"} & set(sys.modules)))')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.join(os.path.dirname(__file__), '../src'))
+    assert result.stdout.strip() == '[]'
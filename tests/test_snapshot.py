@@ -0,0 +1,116 @@
+import sys
+import os
+import time
+import pytest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from protocol import ProtocolHandler, Encoded, OK
+from server import Server
+from snapshot import Snapshotter, read_snapshot, write_snapshot
+from storage import KeyValueStore, ShardedKeyValueStore, CommandError
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'dump.kvs')
+
+def fill(store):
+    store.set('text', 'héllo')
+    store.set('number', 42)
+    store.set('list', ['a', 1, ['nested']])
+    store.set('expiring', 'soon', ttl=100)
+
+def test_roundtrip(path):
+    store = KeyValueStore()
+    fill(store)
+    assert write_snapshot(store, path) == 4
+
+    entries = {key: (value, deadline) for key, value, deadline in read_snapshot(path)}
+    assert entries['text'] == ('héllo', None)
+    assert entries['number'] == (42, None)
+    assert entries['list'] == (['a', 1, ['nested']], None)
+    assert entries['expiring'][1] == pytest.approx(time.time() + 100, abs=5)
+
+    restored = ShardedKeyValueStore(shards=4)
+    assert restored.restore(read_snapshot(path)) == 4
+    assert restored.get('list') == ['a', 1, ['nested']]
+    assert 95 < restored.ttl('expiring') <= 100
+
+def test_collections_roundtrip(path):
+    store = KeyValueStore(value_encoder=ProtocolHandler().encode_value)
+    store.hset('hash', [('f', 'v'), ('n', 1)])
+    store.rpush('list', [str(i) for i in range(200)])
+    store.sadd('set', ['a', 'b'])
+    store.expire('set', 100)
+    write_snapshot(store, path)
+
+    for encoded in (False, True):
+        restored = KeyValueStore()
+        assert restored.restore(read_snapshot(path, encoded)) == 3
+        assert restored.hgetall('hash') == {'f': 'v', 'n': 1}
+        assert restored.lrange('list', 0, -1) == [str(i) for i in range(200)]
+        assert restored._data['list'][0].encoding == 'quicklist'
+        assert sorted(restored.smembers('set')) == ['a', 'b']
+        assert 95 < restored.ttl('set') <= 100
+        assert restored.memory_usage('hash') == store.memory_usage('hash')
+
+def test_expired_keys_are_skipped(path):
+    store = KeyValueStore()
+    store.set('gone', 'v', ttl=0.01)
+    store.set('kept', 'v')
+    write_snapshot(store, path)
+    time.sleep(0.02)
+    restored = KeyValueStore()
+    assert restored.restore(read_snapshot(path)) == 1
+    assert restored.get('gone') is None
+
+def test_portable_between_value_modes(path):
+    protocol = ProtocolHandler()
+    encoded = KeyValueStore(value_encoder=protocol.encode_value)
+    fill(encoded)
+    write_snapshot(encoded, path)
+
+    decoded = KeyValueStore()
+    decoded.restore(read_snapshot(path))
+    assert decoded.get('text') == 'héllo'
+    assert decoded.get('list') == ['a', 1, ['nested']]
+
+    write_snapshot(decoded, path)
+    reencoded = KeyValueStore(value_encoder=protocol.encode_value)
+    reencoded.restore(read_snapshot(path, encoded=True))
+    assert reencoded.get('text') == encoded.get('text')
+    assert type(reencoded.get('number')) is Encoded
+
+def test_rejects_other_files(path):
+    with open(path, 'wb') as fh:
+        fh.write(b'not a snapshot at all')
+    with pytest.raises(CommandError):
+        list(read_snapshot(path))
+
+def test_bgsave_writes_from_child(path):
+    store = KeyValueStore()
+    fill(store)
+    snapshots = Snapshotter(store, path)
+    snapshots.bgsave()
+    assert snapshots.in_progress
+    with pytest.raises(CommandError):
+        snapshots.bgsave()
+    store.set('after', 'fork')
+    snapshots.wait()
+    assert not snapshots.in_progress
+    assert sorted(key for key, _, _ in read_snapshot(path)) == [
+        'expiring', 'list', 'number', 'text']
+
+def test_server_commands_and_load_on_start(path):
+    server = Server(port=0, snapshot_path=path)
+    server.get_response(['SET', 'k', 'v'])
+    assert server.get_response(['SAVE']) == OK
+    assert server.get_response(['LASTSAVE']) >= int(time.time()) - 1
+
+    restarted = Server(port=0, snapshot_path=path)
+    assert restarted.get_response(['GET', 'k']) == 'v'
+
+def test_snapshot_commands_need_a_path():
+    with pytest.raises(CommandError):
+        Server(port=0).get_response(['SAVE'])
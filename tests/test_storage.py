@@ -1,11 +1,14 @@
 import sys
 import os
 import pytest
+import time
+from unittest.mock import patch
 
 # Add the parent directory to the sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
-from storage import KeyValueStore, CommandError
+from storage import (KeyValueStore, ShardedKeyValueStore, CommandError, estimate_size,
+                     create_eviction_policy, COLLECTION_OVERHEAD, COMPACT_MAX_ENTRIES)
 
 @pytest.fixture
 def store():
@@ -59,5 +62,399 @@ def test_flush(store):
     assert store.get('key1') is None
     assert store.get('key2') is None
 
-def test_evict_oldest_empty(store):
-    assert store._evict_oldest() is False
\ No newline at end of file
+def test_evict_empty(store):
+    assert store._evict() is False
+
+def test_memory_accounting_tracks_writes(store):
+    store.set('key1', 'value1')
+    store.set('key2', ['a', 1])
+    expected = store.memory_usage('key1') + store.memory_usage('key2')
+    assert store.memory_stats()['used_memory'] == expected
+
+def test_memory_accounting_overwrite(store):
+    store.set('key1', 'x' * 100)
+    store.set('key1', 'y')
+    assert store.memory_stats()['used_memory'] == store.memory_usage('key1')
+
+def test_memory_accounting_delete_and_flush(store):
+    store.set('key1', 'value1')
+    store.set('key2', 'value2')
+    store.delete('key1')
+    assert store.memory_stats()['used_memory'] == store.memory_usage('key2')
+    store.flush()
+    assert store.memory_stats()['used_memory'] == 0
+
+def test_memory_accounting_eviction():
+    small_store = KeyValueStore(max_memory_mb=1)
+    small_store.set('key1', 'x' * 512 * 1024)
+    small_store.set('key2', 'x' * 512 * 1024)
+    stats = small_store.memory_stats()
+    assert stats['used_memory'] == small_store.memory_usage('key2')
+    assert stats['evicted_keys'] == 1
+
+def test_memory_usage_missing_key(store):
+    assert store.memory_usage('missing') is None
+
+def test_estimate_size_matches_encoding():
+    from protocol import ProtocolHandler
+    for value in ['hello', 'héllo', b'raw', 42, 1.5, None, ['a', 1, ['b']], {'k': 'v'}]:
+        out = bytearray()
+        ProtocolHandler().encode_into(out, value)
+        assert estimate_size(value) == len(out)
+
+
+def _filled_store(policy, keys=4):
+    """Return a store with room for exactly ``keys`` entries of 'k<nn>' -> 'x' * 100."""
+    store = KeyValueStore(eviction_policy=policy)
+    for i in range(keys):
+        store.set(f'k{i:02d}', 'x' * 100)
+    store._max_memory = store.memory_stats()['used_memory']
+    return store
+
+def test_lru_read_refreshes_recency():
+    store = _filled_store('allkeys-lru')
+    store.get('k00')
+    store.set('k04', 'x' * 100)
+    assert store.get('k00') == 'x' * 100
+    assert store.get('k01') is None
+
+def test_noeviction_rejects_writes():
+    store = _filled_store('noeviction')
+    with pytest.raises(CommandError, match='Cannot free enough memory'):
+        store.set('k04', 'x' * 100)
+    assert store.get('k00') == 'x' * 100
+    assert store.get('k04') is None
+
+@pytest.mark.parametrize('policy', ['allkeys-lru-sampled', 'allkeys-lfu'])
+def test_sampled_policies_evict_within_budget(policy):
+    store = _filled_store(policy)
+    for i in range(4, 20):
+        store.set(f'k{i:02d}', 'x' * 100)
+        assert store.get(f'k{i:02d}') == 'x' * 100
+    stats = store.memory_stats()
+    assert stats['used_memory'] <= stats['max_memory']
+    assert stats['evicted_keys'] == 16
+
+def test_lfu_prefers_frequently_used_keys():
+    policy = create_eviction_policy('allkeys-lfu')
+    policy.add('hot')
+    policy.add('cold')
+    for _ in range(100):
+        policy.touch('hot')
+    assert policy.frequency('hot') > policy.frequency('cold')
+    assert policy.victim() in ('cold', 'hot')
+    policy.remove('hot')
+    assert policy.victim() == 'cold'
+
+def test_unknown_eviction_policy():
+    with pytest.raises(ValueError, match='Unknown eviction policy: bogus'):
+        KeyValueStore(eviction_policy='bogus')
+
+def test_set_with_ttl_expires_lazily(store):
+    with patch('storage.time.time', return_value=1000.0):
+        store.set('key1', 'value1', ttl=10)
+    with patch('storage.time.time', return_value=1009.0):
+        assert store.get('key1') == 'value1'
+        assert store.ttl('key1') == 1.0
+    with patch('storage.time.time', return_value=1010.0):
+        assert store.get('key1') is None
+    stats = store.memory_stats()
+    assert stats['used_memory'] == 0
+    assert stats['expired_keys'] == 1
+
+def test_set_clears_existing_ttl(store):
+    store.set('key1', 'value1', ttl=10)
+    store.set('key1', 'value2')
+    assert store.ttl('key1') == -1
+
+def test_ttl_missing_and_persistent(store):
+    assert store.ttl('missing') == -2
+    store.set('key1', 'value1')
+    assert store.ttl('key1') == -1
+
+def test_expire_and_persist(store):
+    assert store.expire('missing', 10) is False
+    store.set('key1', 'value1')
+    assert store.persist('key1') is False
+    assert store.expire('key1', 10) is True
+    assert 0 < store.ttl('key1') <= 10
+    assert store.persist('key1') is True
+    assert store.ttl('key1') == -1
+
+def test_expire_in_the_past_deletes(store):
+    store.set('key1', 'value1')
+    assert store.expire('key1', -1) is True
+    assert store.get('key1') is None
+
+def test_expire_cycle_reclaims_without_access(store):
+    with patch('storage.time.time', return_value=1000.0):
+        for i in range(100):
+            store.set(f'key{i}', 'value', ttl=1)
+        store.set('forever', 'value')
+    with patch('storage.time.time', return_value=1002.0):
+        assert store.expire_cycle() is False
+    stats = store.memory_stats()
+    assert stats['keys'] == 1
+    assert stats['expires'] == 0
+    assert stats['expired_keys'] == 100
+
+def test_expire_cycle_respects_time_budget(store):
+    with patch('storage.time.time', return_value=1000.0):
+        for i in range(1000):
+            store.set(f'key{i}', 'value', ttl=1)
+    with patch('storage.time.time', return_value=1002.0):
+        assert store.expire_cycle(time_budget=0) is True
+        assert 0 < store.memory_stats()['keys'] < 1000
+        while store.expire_cycle(time_budget=0):
+            pass
+    assert store.memory_stats()['keys'] == 0
+
+def test_expire_cycle_skips_stale_deadlines(store):
+    with patch('storage.time.time', return_value=1000.0):
+        store.set('key1', 'value1', ttl=1)
+        store.persist('key1')
+    with patch('storage.time.time', return_value=1002.0):
+        store.expire_cycle()
+        assert store.get('key1') == 'value1'
+
+@pytest.fixture
+def sharded_store():
+    return ShardedKeyValueStore(max_memory_mb=4, shards=4)
+
+def test_sharded_set_get_delete(sharded_store):
+    assert sharded_store.set('key1', 'value1') is True
+    assert sharded_store.get('key1') == 'value1'
+    assert sharded_store.delete('key1') is True
+    assert sharded_store.get('key1') is None
+
+def test_sharded_mget_mset_preserve_order(sharded_store):
+    items = [(f'key{i}', f'value{i}') for i in range(100)]
+    assert sharded_store.mset(items) == 100
+    keys = [key for key, _ in items] + ['missing']
+    assert sharded_store.mget(keys) == [value for _, value in items] + [None]
+
+class CountingLock:
+    """Reentrant lock that counts outermost acquisitions."""
+
+    def __init__(self):
+        self.acquisitions = 0
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            self.acquisitions += 1
+        self._depth += 1
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+
+def test_sharded_multi_key_ops_lock_each_shard_once(sharded_store):
+    for shard in sharded_store._shards:
+        shard._lock = CountingLock()
+    sharded_store.mset((f'key{i}', i) for i in range(1000))
+    sharded_store.mget([f'key{i}' for i in range(1000)])
+    assert [shard._lock.acquisitions for shard in sharded_store._shards] == [2, 2, 2, 2]
+
+def test_sharded_memory_budget_is_split(sharded_store):
+    # Each of the 4 shards gets 1 MB of the 4 MB budget, which caps a value
+    # at 1 MB however empty the store is; one shard allows the full budget.
+    with pytest.raises(CommandError, match='Value too large'):
+        sharded_store.set('key1', 'x' * (2 * 1024 * 1024))
+    single = ShardedKeyValueStore(max_memory_mb=4, shards=1)
+    assert single.set('key1', 'x' * (2 * 1024 * 1024)) is True
+
+def test_sharded_memory_stats_aggregate(sharded_store):
+    sharded_store.mset([('key1', 'value1'), ('key2', 'value2')], ttl=60)
+    stats = sharded_store.memory_stats()
+    assert stats['keys'] == 2
+    assert stats['expires'] == 2
+    assert stats['shards'] == 4
+    assert stats['max_memory'] == 4 * 1024 * 1024
+    assert stats['used_memory'] == (sharded_store.memory_usage('key1') +
+                                    sharded_store.memory_usage('key2'))
+    assert sharded_store.flush() == 2
+
+def test_value_encoder_stores_encoded_bytes():
+    store = KeyValueStore(value_encoder=lambda value: b'<%s>' % str(value).encode())
+    store.set('key1', 'value1')
+    assert store.get('key1') == b'<value1>'
+    assert store.memory_usage('key1') == estimate_size('key1') + len(b'<value1>')
+
+def test_hash_commands(store):
+    assert store.hset('h', [('a', '1'), ('b', '2')]) == 2
+    assert store.hset('h', [('a', 'x'), ('c', '3')]) == 1
+    assert store.hget('h', 'a') == 'x'
+    assert store.hmget('h', ['a', 'missing', 'c']) == ['x', None, '3']
+    assert store.hgetall('h') == {'a': 'x', 'b': '2', 'c': '3'}
+    assert store.hdel('h', ['a', 'missing']) == 1
+    assert store.hdel('h', ['b', 'c']) == 2
+    assert store.key_type('h') == 'none'  # emptied collections are deleted
+    assert store.hgetall('h') == {}
+    assert store.hmget('h', ['a']) == [None]
+
+def test_list_commands(store):
+    assert store.rpush('l', ['b', 'c']) == 2
+    assert store.lpush('l', ['a', 'z']) == 4
+    assert store.lrange('l', 0, -1) == ['z', 'a', 'b', 'c']
+    assert store.lrange('l', -2, 10) == ['b', 'c']
+    assert store.lrange('l', 3, 1) == []
+    assert store.lpop('l') == ['z']
+    assert store.rpop('l', 2) == ['c', 'b']
+    assert store.lpop('l', 5) == ['a']
+    assert store.lpop('l') is None
+
+def test_set_commands(store):
+    assert store.sadd('s', ['a', 'b', 'a']) == 2
+    assert store.sadd('s', ['b', 'c']) == 1
+    assert sorted(store.smembers('s')) == ['a', 'b', 'c']
+    assert store.sismember('s', 'a') and not store.sismember('s', 'x')
+    assert store.srem('s', ['a', 'x']) == 1
+    assert store.sismember('missing', 'a') is False
+    with pytest.raises(CommandError, match='set members'):
+        store.sadd('s', [['nested']])
+
+def test_collections_reject_other_types(store):
+    store.set('str', 'v')
+    store.hset('h', [('f', 'v')])
+    with pytest.raises(CommandError, match='WRONGTYPE'):
+        store.get('h')
+    with pytest.raises(CommandError, match='WRONGTYPE'):
+        store.rpush('str', ['x'])
+    with pytest.raises(CommandError, match='WRONGTYPE'):
+        store.sismember('h', 'f')
+    assert store.mget(['str', 'h']) == ['v', None]
+    assert [store.key_type(key) for key in ('str', 'h', 'missing')] == ['string', 'hash', 'none']
+    assert store.set('h', 'replaced') is True
+    assert store.get('h') == 'replaced'
+
+@pytest.mark.parametrize('fill, encoding', [
+    (lambda store, i: store.hset('c', [(f'f{i}', i)]), 'hashtable'),
+    (lambda store, i: store.rpush('c', [i]), 'quicklist'),
+    (lambda store, i: store.sadd('c', [i]), 'hashtable'),
+])
+def test_collections_leave_compact_encoding_when_large(store, fill, encoding):
+    for i in range(COMPACT_MAX_ENTRIES):
+        fill(store, i)
+    value = store._data['c'][0]
+    assert value.encoding == 'listpack'
+    fill(store, COMPACT_MAX_ENTRIES)
+    assert store._data['c'][0] is value and value.encoding == encoding
+    assert len(value) == COMPACT_MAX_ENTRIES + 1
+
+def test_long_values_leave_compact_encoding(store):
+    store.hset('h', [('f', 'x' * 100)])
+    assert store._data['h'][0].encoding == 'hashtable'
+    assert store.hget('h', 'f') == 'x' * 100
+
+def test_large_list_ranges_from_either_end(store):
+    store.rpush('l', list(range(1000)))
+    assert store.lrange('l', 2, 4) == [2, 3, 4]
+    assert store.lrange('l', -3, -1) == [997, 998, 999]
+    assert store.lrange('l', 900, 902) == [900, 901, 902]
+
+def test_collection_memory_is_accounted_incrementally(store):
+    store.hset('h', [('f1', 'v1')])
+    base = estimate_size('h') + COLLECTION_OVERHEAD
+    assert store.memory_usage('h') == base + estimate_size('f1') + estimate_size('v1')
+    store.hset('h', [('f1', 'longer value'), ('f2', 2)])
+    assert store.memory_usage('h') == base + sum(map(estimate_size, ('f1', 'longer value', 'f2', 2)))
+    for i in range(300):
+        store.rpush('l', [f'item{i}'])
+    store.lpop('l', 100)
+    assert store.memory_usage('l') == estimate_size('l') + COLLECTION_OVERHEAD + sum(
+        estimate_size(f'item{i}') for i in range(100, 300))
+    store.sadd('s', ['a'])
+    store.srem('s', ['a'])
+    assert store.memory_stats()['used_memory'] == store.memory_usage('h') + store.memory_usage('l')
+
+def test_collection_growth_evicts_other_keys():
+    store = KeyValueStore(max_memory_mb=1)
+    store.set('old', 'x' * 600 * 1024)
+    store.rpush('l', ['y' * 300 * 1024])
+    store.rpush('l', ['y' * 300 * 1024])
+    assert store.get('old') is None
+    assert len(store.lrange('l', 0, -1)) == 2
+    assert store.memory_stats()['used_memory'] == store.memory_usage('l')
+
+def test_sharded_collections(sharded_store):
+    sharded_store.hset('h', [('f', 'v')])
+    sharded_store.rpush('l', ['a', 'b'])
+    sharded_store.sadd('s', ['m'])
+    assert sharded_store.hgetall('h') == {'f': 'v'}
+    assert sharded_store.lrange('l', 0, -1) == ['a', 'b']
+    assert sharded_store.smembers('s') == ['m']
+    assert sharded_store.key_type('l') == 'list'
+
+def test_incr_keeps_ttl_and_type_checks(store):
+    assert store.incr('c', 1) == 1
+    store.expire('c', 100)
+    assert store.incr('c', -5) == -4
+    assert 95 < store.ttl('c') <= 100
+    store.set('s', '41')
+    assert store.incr('s', 1) == 42
+    store.set('bad', '4.5')
+    with pytest.raises(CommandError, match='not an integer'):
+        store.incr('bad', 1)
+    store.set('max', 2 ** 63 - 1)
+    with pytest.raises(CommandError, match='overflow'):
+        store.incr('max', 1)
+    assert store.incr_float('bad', 0.5) == '5'
+    assert store.incr_float('bad', 0.25) == '5.25'
+    with pytest.raises(CommandError, match='NaN or Infinity'):
+        store.incr_float('bad', float('inf'))
+
+def test_incr_decodes_encoded_values():
+    from protocol import ProtocolHandler, decode_value
+    store = KeyValueStore(value_encoder=ProtocolHandler().encode_value, value_decoder=decode_value)
+    store.set('a', '10')
+    assert store.incr('a', 5) == 15
+    assert store.get('a') == b'$2\r\n15\r\n'
+
+def test_setnx_msetnx_getset(store):
+    assert store.setnx('a', '1') is True
+    assert store.setnx('a', '2') is False
+    assert store.getset('a', '3') == '1'
+    assert store.getset('new', 'v') is None
+    assert store.msetnx([('a', 'x'), ('b', 'y')]) is False
+    assert store.get('b') is None
+    assert store.msetnx([('b', 'y'), ('c', 'z')]) is True
+    assert store.mget(['a', 'b', 'c']) == ['3', 'y', 'z']
+
+def test_watched_key_versions(store):
+    store.set('a', '1')
+    watched = dict(zip(['a', 'b'], store.watch(['a', 'b'])))
+    store.set('other', 'x')
+    assert not store.changed(watched)
+    store.incr('b', 1)
+    assert store.changed(watched)
+    store.unwatch(['a', 'b'])
+    assert store._versions == {}
+
+@pytest.mark.parametrize('change', [
+    lambda store: store.delete('a'),
+    lambda store: store.expire('a', 10),
+    lambda store: store.flush(),
+    lambda store: store.rpush('list', ['x']),
+])
+def test_every_kind_of_change_bumps_watched_versions(store, change):
+    store.set('a', '1')
+    store.rpush('list', ['start'])
+    watched = dict(zip(['a', 'list'], store.watch(['a', 'list'])))
+    change(store)
+    assert store.changed(watched)
+
+def test_expired_watched_key_counts_as_changed(store):
+    store.set('a', '1', ttl=0.01)
+    watched = {'a': store.watch(['a'])[0]}
+    time.sleep(0.02)
+    assert store.changed(watched)
+
+def test_sharded_counters_and_watch(sharded_store):
+    assert sharded_store.incr('c', 2) == 2
+    watched = dict(zip(['c', 'd'], sharded_store.watch(['c', 'd'])))
+    assert sharded_store.msetnx([('d', '1'), ('e', '2')]) is True
+    assert sharded_store.changed(watched)
+    sharded_store.unwatch(['c', 'd'])
+    # EXEC runs its commands while holding every shard lock
+    with sharded_store.locked():
+        assert sharded_store.incr('c', 1) == 3